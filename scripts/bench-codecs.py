@@ -0,0 +1,521 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+
+# encoders exercised by default, each is decoded again with FFmpeg's
+# preferred decoder for the same codec
+DEFAULT_ENCODERS = ["libx264", "libx265", "libvpx-vp9", "libsvtav1", "libwebp"]
+
+# encoders swept by --scaling, with the decoder of their stream when it is
+# not FFmpeg's preferred one: the scaling of dav1d and of libvpx's decoder
+# is measured on the AV1 and VP9 streams
+SCALING_CODECS = {
+    "libx264": None,
+    "libx265": None,
+    "libvpx-vp9": "libvpx-vp9",
+    "libsvtav1": "libdav1d",
+}
+
+# minimum speedup over a single thread, by thread count. A library built
+# without thread support stays close to 1.0. VP9 only threads over tile
+# columns, of which 640 pixels wide frames have two.
+EXPECTED_SPEEDUP = {
+    ("libx264", "encode"): {2: 1.5, 4: 2.2},
+    ("libx265", "encode"): {2: 1.3, 4: 1.8},
+    ("libvpx-vp9", "encode"): {2: 1.2},
+    ("libvpx-vp9", "decode"): {2: 1.2},
+    ("libsvtav1", "encode"): {2: 1.3, 4: 1.8},
+    ("libsvtav1", "decode"): {2: 1.4, 4: 2.0},
+}
+
+# encoder options which disable the hand-written assembly of an encoder, so
+# that --asm-speedup can compare it with the C code of the same build
+NO_ASM_OPTIONS = {
+    "libx264": {"x264-params": "asm=0"},
+    "libx265": {"x265-params": "asm=0"},
+}
+
+# minimum encode speedup of the assembly over the C code
+MIN_ASM_SPEEDUP = 1.5
+
+# the CPU time of an encode or decode over its wall time, which a codec
+# running on a single thread cannot exceed. Unlike the speedup, this does
+# not depend on how busy the machine is.
+MIN_PARALLELISM = 1.2
+
+# wall time below which the CPU time of a phase is too coarse to compare,
+# as Windows counts it in 15.6 ms ticks. Decodes of the scaling sweep are
+# repeated until they last this long.
+MIN_CHECKED_SECONDS = 0.2
+
+
+def library_sizes(vendor_dir: str) -> dict[str, int]:
+    if platform.system() == "Windows":
+        pattern = os.path.join(vendor_dir, "bin", "*.dll")
+    elif platform.system() == "Darwin":
+        pattern = os.path.join(vendor_dir, "lib", "*.dylib")
+    else:
+        pattern = os.path.join(vendor_dir, "lib", "*.so*")
+
+    sizes = {}
+    for path in sorted(glob.glob(pattern)):
+        if not os.path.islink(path):
+            sizes[os.path.basename(path)] = os.path.getsize(path)
+    return sizes
+
+
+# run in a fresh interpreter, so nothing is mapped before the import
+IMPORT_PROBE = """\
+import json, time
+start = time.perf_counter()
+from dummy import binding
+seconds = time.perf_counter() - start
+with open("/proc/self/status") as fp:
+    rss = next(int(line.split()[1]) * 1024 for line in fp if line.startswith("VmRSS:"))
+with open("/proc/self/maps") as fp:
+    libraries = sorted({line.split()[-1] for line in fp if ".so" in line.split()[-1]})
+print(json.dumps({"seconds": seconds, "rss": rss, "libraries": libraries}))
+"""
+
+
+def measure_import(repeat: int = 5) -> dict:
+    """
+    Measures the time and memory it takes to import the binding, and the
+    shared libraries it maps. Only supported on Linux.
+    """
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", IMPORT_PROBE],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(repeat)
+    ]
+    result = {
+        "seconds": min(run["seconds"] for run in runs),
+        "rss": min(run["rss"] for run in runs),
+        "libraries": runs[0]["libraries"],
+    }
+    print(
+        f"import: {result['seconds'] * 1000:.1f} ms, "
+        f"RSS {result['rss'] / 2**20:.1f} MiB, "
+        f"{len(result['libraries'])} shared libraries mapped"
+    )
+    return result
+
+
+def run_encoders(
+    encoders: list[str],
+    *,
+    frames: int,
+    width: int,
+    height: int,
+    threads: int,
+    pix_fmt: str | None = None,
+    decoders: dict[str, str | None] | None = None,
+    min_decode_seconds: float = 0.0,
+    options: dict[str, dict[str, str]] | None = None,
+) -> dict[str, dict]:
+    from dummy import binding
+
+    results = {}
+    for encoder in encoders:
+        try:
+            result = binding.benchmark(
+                encoder,
+                decoder=(decoders or {}).get(encoder),
+                pix_fmt=pix_fmt,
+                frames=frames,
+                width=width,
+                height=height,
+                threads=threads,
+                min_decode_seconds=min_decode_seconds,
+                options=(options or {}).get(encoder),
+            )
+        except (RuntimeError, ValueError) as exc:
+            print(f"{encoder}: skipped ({exc})")
+            continue
+        # the binding releases the GIL, so the codec threads are the only
+        # ones using CPU time meanwhile
+        for direction in ("encode", "decode"):
+            seconds = result[f"{direction}_seconds"]
+            result[f"{direction}_parallelism"] = (
+                result[f"{direction}_cpu_seconds"] / seconds if seconds else 0.0
+            )
+        result["encode_fps"] = frames / result["encode_seconds"]
+        result["decode_fps"] = result["frames"] / result["decode_seconds"]
+        print(
+            f"{encoder}: encode {result['encode_fps']:.1f} fps, "
+            f"decode ({result['decoder']}) {result['decode_fps']:.1f} fps"
+        )
+        results[encoder] = result
+    return results
+
+
+def thread_counts(max_threads: int) -> list[int]:
+    """Returns the powers of two below max_threads, then max_threads."""
+    counts = []
+    threads = 1
+    while threads < max_threads:
+        counts.append(threads)
+        threads *= 2
+    return counts + [max_threads]
+
+
+def run_scaling(
+    encoders: list[str],
+    *,
+    max_threads: int,
+    frames: int,
+    width: int,
+    height: int,
+    pix_fmt: str | None = None,
+) -> dict[str, dict]:
+    """
+    Runs each encoder, and the decoder of its stream, with an increasing
+    number of threads and returns their throughput for each count.
+    """
+    scaling: dict[str, dict] = {}
+    for threads in thread_counts(max_threads):
+        print(f"{threads} threads:")
+        results = run_encoders(
+            encoders,
+            frames=frames,
+            width=width,
+            height=height,
+            threads=threads,
+            pix_fmt=pix_fmt,
+            decoders=SCALING_CODECS,
+            min_decode_seconds=MIN_CHECKED_SECONDS,
+        )
+        for encoder, result in results.items():
+            entry = scaling.setdefault(
+                encoder,
+                {
+                    "decoder": result["decoder"],
+                    "threads": [],
+                    "encode_fps": [],
+                    "decode_fps": [],
+                    "encode_seconds": [],
+                    "decode_seconds": [],
+                    "encode_parallelism": [],
+                    "decode_parallelism": [],
+                },
+            )
+            entry["threads"].append(threads)
+            for key in (
+                "encode_fps",
+                "decode_fps",
+                "encode_seconds",
+                "decode_seconds",
+                "encode_parallelism",
+                "decode_parallelism",
+            ):
+                entry[key].append(result[key])
+    return scaling
+
+
+def scaling_curve(entry: dict, direction: str) -> list[tuple[int, float, float, float]]:
+    """
+    Returns the thread count, throughput, speedup and efficiency of each
+    point of an encode or decode sweep, or nothing without a single-threaded
+    run to compare against.
+    """
+    points = list(zip(entry["threads"], entry[f"{direction}_fps"]))
+    if not points or points[0][0] != 1:
+        return []
+    base = points[0][1]
+    return [(threads, fps, fps / base, fps / base / threads) for threads, fps in points]
+
+
+def plot_scaling(scaling: dict[str, dict], width: int = 40) -> None:
+    """Prints the speedup of each sweep as bars against the ideal speedup."""
+    for encoder, entry in sorted(scaling.items()):
+        for direction in ("encode", "decode"):
+            curve = scaling_curve(entry, direction)
+            if not curve:
+                continue
+            name = encoder if direction == "encode" else entry["decoder"]
+            max_threads = curve[-1][0]
+            print(f"{name} {direction}: speedup (#) against linear scaling (.)")
+            for threads, fps, speedup, efficiency in curve:
+                bar = "#" * round(speedup / max_threads * width)
+                ideal = "." * (round(threads / max_threads * width) - len(bar))
+                print(
+                    f"  {threads:>3} threads {fps:8.1f} fps {speedup:5.2f}x "
+                    f"{efficiency:5.0%} |{bar}{ideal}"
+                )
+
+
+def check_scaling(scaling: dict[str, dict]) -> list[str]:
+    """
+    Returns the sweeps which fall short of EXPECTED_SPEEDUP. Thread counts
+    which were not measured, and encoders which were skipped, are not checked.
+    """
+    failures = []
+    for (encoder, direction), expected in sorted(EXPECTED_SPEEDUP.items()):
+        if encoder not in scaling:
+            continue
+        entry = scaling[encoder]
+        name = encoder if direction == "encode" else entry["decoder"]
+        speedups = {threads: speedup for threads, _, speedup, _ in scaling_curve(entry, direction)}
+        for threads, minimum in sorted(expected.items()):
+            if threads in speedups and speedups[threads] < minimum:
+                failures.append(
+                    f"{name} {direction}: {speedups[threads]:.2f}x with {threads} "
+                    f"threads, expected at least {minimum:.2f}x"
+                )
+    return failures
+
+
+def check_threads(
+    scaling: dict[str, dict], encoders: list[str], max_threads: int
+) -> list[str]:
+    """
+    Returns the encoders and decoders which did not use more CPU time than
+    wall time with max_threads, so that they ran on a single thread. An
+    encoder which was skipped with max_threads is a failure too, as is a run
+    too short to measure.
+    """
+    if max_threads < 2:
+        return []
+    failures = []
+    for encoder in encoders:
+        entry = scaling.get(encoder)
+        if entry is None or entry["threads"][-1] != max_threads:
+            failures.append(f"{encoder}: skipped with {max_threads} threads")
+            continue
+        for direction in ("encode", "decode"):
+            name = encoder if direction == "encode" else entry["decoder"]
+            seconds = entry[f"{direction}_seconds"][-1]
+            parallelism = entry[f"{direction}_parallelism"][-1]
+            if seconds < MIN_CHECKED_SECONDS:
+                failures.append(
+                    f"{name} {direction}: {seconds:.3f} s is too short to measure, "
+                    "raise --frames"
+                )
+            elif parallelism < MIN_PARALLELISM:
+                failures.append(
+                    f"{name} {direction}: {parallelism:.2f}x CPU time over wall time "
+                    f"with {max_threads} threads, expected at least "
+                    f"{MIN_PARALLELISM:.2f}x"
+                )
+    return failures
+
+
+def run_asm_speedup(
+    encoders: list[str], *, frames: int, width: int, height: int, threads: int,
+    pix_fmt: str | None = None,
+) -> dict[str, float]:
+    """
+    Encodes with and without the hand-written assembly of each encoder in
+    NO_ASM_OPTIONS and returns the speedup of the assembly.
+    """
+    encoders = [encoder for encoder in encoders if encoder in NO_ASM_OPTIONS]
+    kwargs = {
+        "frames": frames,
+        "width": width,
+        "height": height,
+        "threads": threads,
+        "pix_fmt": pix_fmt,
+    }
+    print("with assembly:")
+    asm = run_encoders(encoders, **kwargs)
+    print("without assembly:")
+    no_asm = run_encoders(encoders, options=NO_ASM_OPTIONS, **kwargs)
+
+    speedups = {}
+    for encoder in encoders:
+        if encoder in asm and encoder in no_asm:
+            speedups[encoder] = asm[encoder]["encode_fps"] / no_asm[encoder]["encode_fps"]
+            print(f"{encoder}: assembly encodes {speedups[encoder]:.2f}x faster")
+    return speedups
+
+
+def compare(base_path: str, new_path: str) -> None:
+    with open(base_path) as fp:
+        base = json.load(fp)
+    with open(new_path) as fp:
+        new = json.load(fp)
+
+    def change(old: float, value: float) -> str:
+        return f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+
+    if "codecs" in base and "codecs" in new:
+        print("throughput:")
+        for encoder in sorted(set(base["codecs"]) & set(new["codecs"])):
+            old, value = base["codecs"][encoder], new["codecs"][encoder]
+            print(
+                f"  {encoder}: encode {change(old['encode_fps'], value['encode_fps'])}, "
+                f"decode {change(old['decode_fps'], value['decode_fps'])}"
+            )
+
+    if "sizes" in base and "sizes" in new:
+        print("size:")
+        for name in sorted(set(base["sizes"]) & set(new["sizes"])):
+            old, value = base["sizes"][name], new["sizes"][name]
+            print(f"  {name}: {old} -> {value} bytes ({change(old, value)})")
+        old, value = sum(base["sizes"].values()), sum(new["sizes"].values())
+        print(f"  total: {old} -> {value} bytes ({change(old, value)})")
+
+    if base.get("import") and new.get("import"):
+        old, value = base["import"], new["import"]
+        print("import:")
+        print(
+            f"  time: {old['seconds'] * 1000:.1f} -> {value['seconds'] * 1000:.1f} ms "
+            f"({change(old['seconds'], value['seconds'])})"
+        )
+        print(
+            f"  RSS: {old['rss']} -> {value['rss']} bytes "
+            f"({change(old['rss'], value['rss'])})"
+        )
+        print(
+            f"  shared libraries: {len(old['libraries'])} -> {len(value['libraries'])}"
+        )
+
+    if base.get("scaling") and new.get("scaling"):
+        print("scaling:")
+        for encoder in sorted(set(base["scaling"]) & set(new["scaling"])):
+            for direction in ("encode", "decode"):
+                old = {t: s for t, _, s, _ in scaling_curve(base["scaling"][encoder], direction)}
+                value = {t: s for t, _, s, _ in scaling_curve(new["scaling"][encoder], direction)}
+                if not old.keys() & value.keys():
+                    continue
+                threads = max(old.keys() & value.keys())
+                name = encoder if direction == "encode" else new["scaling"][encoder]["decoder"]
+                print(
+                    f"  {name} {direction}: {old[threads]:.2f}x -> {value[threads]:.2f}x "
+                    f"with {threads} threads"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser("bench-codecs")
+    parser.add_argument("--vendor", help="FFmpeg install prefix to measure")
+    parser.add_argument("--encoder", action="append", dest="encoders")
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--size", default="640x360")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--scaling",
+        action="store_true",
+        help="sweep thread counts from 1 to --max-threads instead of using --threads",
+    )
+    parser.add_argument(
+        "--max-threads", type=int, default=os.cpu_count() or 1, help="(default: CPU count)"
+    )
+    parser.add_argument(
+        "--asm-speedup",
+        action="store_true",
+        help="compare the encoders of NO_ASM_OPTIONS with and without their assembly",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="with --scaling, exit with an error if a codec scales less than expected, "
+        "with --asm-speedup if the assembly is less than MIN_ASM_SPEEDUP times faster",
+    )
+    parser.add_argument(
+        "--check-threads",
+        action="store_true",
+        help="with --scaling, exit with an error if an encoder or decoder used no "
+        "more CPU time than wall time with the most threads, or was skipped",
+    )
+    parser.add_argument(
+        "--pix-fmt", help="pixel format to encode, e.g. yuv420p10le for 10-bit"
+    )
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "NEW"),
+        help="compare two JSON result files",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    width, height = (int(x) for x in args.size.split("x"))
+    if args.asm_speedup:
+        encoders = args.encoders or list(NO_ASM_OPTIONS)
+        speedups = run_asm_speedup(
+            encoders,
+            frames=args.frames,
+            width=width,
+            height=height,
+            threads=args.threads,
+            pix_fmt=args.pix_fmt,
+        )
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump({"asm_speedup": speedups}, fp, indent=2, sort_keys=True)
+        failures = [
+            f"{encoder}: {speedups[encoder]:.2f}x, expected at least {MIN_ASM_SPEEDUP:.2f}x"
+            if encoder in speedups
+            else f"{encoder}: skipped"
+            for encoder in encoders
+            if encoder not in speedups or speedups[encoder] < MIN_ASM_SPEEDUP
+        ]
+        for failure in failures:
+            print(f"assembly: {failure}")
+        if args.check and failures:
+            sys.exit(1)
+        return
+
+    if args.scaling:
+        encoders = args.encoders or list(SCALING_CODECS)
+        scaling = run_scaling(
+            encoders,
+            max_threads=args.max_threads,
+            frames=args.frames,
+            width=width,
+            height=height,
+            pix_fmt=args.pix_fmt,
+        )
+        plot_scaling(scaling)
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump(
+                    {"cpu_count": os.cpu_count(), "scaling": scaling},
+                    fp,
+                    indent=2,
+                    sort_keys=True,
+                )
+        failures = check_scaling(scaling)
+        for failure in failures:
+            print(f"scaling: {failure}")
+        thread_failures = check_threads(scaling, encoders, args.max_threads)
+        for failure in thread_failures:
+            print(f"threads: {failure}")
+        if (args.check and failures) or (args.check_threads and thread_failures):
+            sys.exit(1)
+        return
+
+    results = {
+        "import": measure_import() if platform.system() == "Linux" else None,
+        "codecs": run_encoders(
+            args.encoders or DEFAULT_ENCODERS,
+            frames=args.frames,
+            width=width,
+            height=height,
+            threads=args.threads,
+            pix_fmt=args.pix_fmt,
+        ),
+        "sizes": library_sizes(args.vendor) if args.vendor else {},
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
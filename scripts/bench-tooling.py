@@ -0,0 +1,269 @@
+# Benchmarks of the build tooling against synthetic fixtures
+#
+# This measures the Python code paths of the build, not the compilers: hashing
+# tarballs, extracting them, normalizing static archives, writing the output
+# tarball and scanning source trees. Results can be compared between commits.
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import tarfile
+import tempfile
+import time
+from collections.abc import Callable
+
+from cibuildpkg import Builder, Package, find_config_scripts
+from reproducible import AR_MAGIC, make_archive_deterministic
+from store import file_sha256
+
+build_ffmpeg = importlib.import_module("build-ffmpeg")
+
+WORDS = [
+    b"static",
+    b"const",
+    b"uint8_t",
+    b"int",
+    b"return",
+    b"av_malloc",
+    b"for",
+    b"if",
+    b"{",
+    b"}",
+    b"\n",
+]
+
+
+def source_like_data(size: int, rng: random.Random) -> bytes:
+    """Returns compressible bytes which look roughly like source code."""
+    chunk = b" ".join(rng.choice(WORDS) for _ in range(4096))
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+def make_tree(
+    root: str, *, files: int, file_size: int, rng: random.Random
+) -> list[str]:
+    names = []
+    for i in range(files):
+        name = os.path.join(f"dir{i % 16}", f"sub{i % 7}", f"file{i}.c")
+        os.makedirs(os.path.join(root, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(root, name), "wb") as fp:
+            fp.write(source_like_data(file_size, rng))
+        names.append(name)
+    return sorted(names)
+
+
+def make_ar_archive(
+    path: str, *, members: int, symbols: int, rng: random.Random
+) -> None:
+    """Writes a GNU ar archive with an unsorted symbol index and timestamps."""
+    member_data = [source_like_data(8192, rng) for _ in range(members)]
+
+    def header(name: str, size: int) -> bytes:
+        return (
+            f"{name:<16}{1700000000 + rng.randrange(1000):<12}{1000:<6}{1000:<6}"
+            f"{100644:<8}{size:<10}`\n"
+        ).encode()
+
+    names = [f"sym_{rng.randrange(10**9)}".encode() for _ in range(symbols)]
+    index_size = 4 + 4 * symbols + sum(len(name) + 1 for name in names)
+    index_size += index_size % 2
+    offset = len(AR_MAGIC) + 60 + index_size
+    member_offsets = []
+    for data in member_data:
+        member_offsets.append(offset)
+        offset += 60 + len(data) + len(data) % 2
+
+    index = struct.pack(">I", symbols)
+    index += b"".join(
+        struct.pack(">I", member_offsets[rng.randrange(members)]) for _ in names
+    )
+    index += b"".join(name + b"\0" for name in names)
+    index += b"\0" * (index_size - len(index))
+
+    with open(path, "wb") as fp:
+        fp.write(AR_MAGIC)
+        fp.write(header("/", index_size))
+        fp.write(index)
+        for i, data in enumerate(member_data):
+            fp.write(header(f"obj{i}.o/", len(data)))
+            fp.write(data + b"\n" * (len(data) % 2))
+
+
+def measure(
+    run: Callable[[], None], *, setup: Callable[[], None] | None, repeat: int
+) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def benchmarks(work_dir: str, scale: float) -> dict[str, tuple]:
+    """
+    Creates the fixtures and returns (setup, run) for each benchmark.
+    """
+    rng = random.Random(0)
+
+    def size(n: int) -> int:
+        return max(1, int(n * scale))
+
+    cases = {}
+
+    # hashing of downloaded tarballs
+    for mib in (1, 64):
+        path = os.path.join(work_dir, f"blob-{mib}.bin")
+        with open(path, "wb") as fp:
+            fp.write(os.urandom(size(mib * 2**20)))
+        cases[f"file_sha256/{mib}MiB"] = (
+            None,
+            lambda path=path: file_sha256(path),
+        )
+
+    # extraction, with many small files and with a few large ones
+    tree = os.path.join(work_dir, "tree")
+    make_tree(
+        os.path.join(tree, "small-1.0"), files=size(2000), file_size=4096, rng=rng
+    )
+    make_tree(
+        os.path.join(tree, "large-1.0"), files=4, file_size=size(8 * 2**20), rng=rng
+    )
+    builder = Builder(
+        os.path.join(work_dir, "dest"), build_dir=os.path.join(work_dir, "build")
+    )
+    builder.source_dir = os.path.join(work_dir, "source")
+    builder.patch_dir = os.path.join(work_dir, "patches")
+    os.makedirs(builder.source_dir)
+    os.makedirs(builder.build_dir)
+    for shape in ("small", "large"):
+        for compression in ("gz", "bz2", "xz"):
+            filename = f"{shape}-1.0.tar.{compression}"
+            tarball = os.path.join(builder.source_dir, filename)
+            with tarfile.open(tarball, f"w:{compression}") as tar:
+                tar.add(os.path.join(tree, f"{shape}-1.0"), arcname=f"{shape}-1.0")
+            package = Package(
+                name=f"{shape}-{compression}",
+                source_url=f"https://example.com/{filename}",
+                sha256="",
+            )
+            path = os.path.join(builder.build_dir, package.name)
+            cases[f"extract/{shape}.tar.{compression}"] = (
+                lambda path=path: shutil.rmtree(path, ignore_errors=True),
+                lambda package=package: builder._extract(package),
+            )
+
+    # normalization of a static archive, restored before each run
+    archive = os.path.join(work_dir, "libbench.a")
+    pristine = archive + ".orig"
+    make_ar_archive(pristine, members=size(500), symbols=size(20000), rng=rng)
+    cases["make_archive_deterministic"] = (
+        lambda: shutil.copyfile(pristine, archive),
+        lambda: make_archive_deterministic(archive),
+    )
+
+    # output tarball
+    prefix = os.path.join(work_dir, "prefix")
+    files = [
+        os.path.join("include", name)
+        for name in make_tree(
+            os.path.join(prefix, "include"), files=size(1000), file_size=16384, rng=rng
+        )
+    ]
+    files += [
+        os.path.join("lib", name)
+        for name in make_tree(
+            os.path.join(prefix, "lib"), files=2, file_size=size(16 * 2**20), rng=rng
+        )
+    ]
+    output = os.path.join(work_dir, "output.tar.gz")
+    cases["write_tarball"] = (
+        None,
+        lambda: build_ffmpeg.write_tarball(output, prefix, files),
+    )
+
+    # config.guess scan of a large source tree
+    scan_root = os.path.join(work_dir, "scan")
+    for i in range(size(20000)):
+        directory = os.path.join(scan_root, f"d{i % 50}", f"e{i % 13}")
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, f"f{i}.c"), "w").close()
+    for directory in ("build-aux", "d1/config"):
+        os.makedirs(os.path.join(scan_root, directory), exist_ok=True)
+        for name in ("config.guess", "config.sub"):
+            open(os.path.join(scan_root, directory, name), "w").close()
+    cases["find_config_scripts"] = (None, lambda: find_config_scripts(scan_root))
+
+    return cases
+
+
+def compare(base_path: str, new_path: str) -> None:
+    with open(base_path) as fp:
+        base = json.load(fp)["benchmarks"]
+    with open(new_path) as fp:
+        new = json.load(fp)["benchmarks"]
+
+    for name in sorted(set(base) & set(new)):
+        old, value = base[name]["min"], new[name]["min"]
+        print(
+            f"{name:<32} {old * 1000:10.2f} ms -> {value * 1000:10.2f} ms "
+            f"({(value - old) / old * 100:+.1f}%)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser("bench-tooling")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply the size of the fixtures"
+    )
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "NEW"),
+        help="compare two JSON result files",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, (setup, run) in benchmarks(work_dir, args.scale).items():
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(run, setup=setup, repeat=args.repeat)
+            print(
+                f"{name:<32} min {results[name]['min'] * 1000:10.2f} ms, "
+                f"median {results[name]['median'] * 1000:10.2f} ms"
+            )
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "scale": args.scale,
+                    "benchmarks": results,
+                },
+                fp,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
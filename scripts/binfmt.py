@@ -0,0 +1,149 @@
+# Minimal readers for the binary formats found in an FFmpeg prefix
+#
+# These only locate sections, they do not interpret their contents. This is
+# enough to tell which part of two builds of the same library differs.
+
+import struct
+
+from reproducible import AR_MAGIC, read_ar_members
+
+# COFF machine types of object files found in Windows static archives
+COFF_MACHINES = {0x014C, 0x8664, 0xAA64, 0x01C4}
+
+
+def identify(data: bytes) -> str | None:
+    """Returns "elf", "macho", "macho-fat", "pe", "coff" or "ar", if any."""
+    if data.startswith(b"\x7fELF"):
+        return "elf"
+    if data[:4] in {b"\xcf\xfa\xed\xfe", b"\xce\xfa\xed\xfe"}:
+        return "macho"
+    if data.startswith(b"\xca\xfe\xba\xbe"):
+        return "macho-fat"
+    if data.startswith(b"MZ") and len(data) >= 0x40:
+        pe_offset = struct.unpack_from("<I", data, 0x3C)[0]
+        if data[pe_offset : pe_offset + 4] == b"PE\0\0":
+            return "pe"
+    if data.startswith(AR_MAGIC):
+        return "ar"
+    if len(data) >= 20 and struct.unpack_from("<H", data)[0] in COFF_MACHINES:
+        return "coff"
+    return None
+
+
+def _elf_sections(data: bytes) -> list[tuple[str, bytes]]:
+    is_64 = data[4] == 2
+    endian = "<" if data[5] == 1 else ">"
+    if is_64:
+        shoff, ehsize, shentsize, shnum, shstrndx = (
+            struct.unpack_from(endian + "Q", data, 0x28)[0],
+            *struct.unpack_from(endian + "H", data, 0x34),
+            *struct.unpack_from(endian + "HHH", data, 0x3A),
+        )
+        header_format = endian + "IIQQQQIIQQ"
+    else:
+        shoff, ehsize, shentsize, shnum, shstrndx = (
+            struct.unpack_from(endian + "I", data, 0x20)[0],
+            *struct.unpack_from(endian + "H", data, 0x28),
+            *struct.unpack_from(endian + "HHH", data, 0x2E),
+        )
+        header_format = endian + "IIIIIIIIII"
+
+    headers = [
+        struct.unpack_from(header_format, data, shoff + i * shentsize) for i in range(shnum)
+    ]
+    sections = [
+        ("<elf header>", data[:ehsize]),
+        ("<section headers>", data[shoff : shoff + shnum * shentsize]),
+    ]
+    if not headers:
+        return sections
+    names = headers[shstrndx]
+    for header in headers[1:]:
+        name_offset, section_type, offset, size = header[0], header[1], header[4], header[5]
+        start = names[4] + name_offset
+        name = data[start : data.index(b"\0", start)].decode("latin-1")
+        # SHT_NOBITS sections (.bss) occupy no file space
+        sections.append((name, b"" if section_type == 8 else data[offset : offset + size]))
+    return sections
+
+
+def _macho_sections(data: bytes) -> list[tuple[str, bytes]]:
+    is_64 = data[:4] == b"\xcf\xfa\xed\xfe"
+    ncmds, sizeofcmds = struct.unpack_from("<II", data, 16)
+    pos = 32 if is_64 else 28
+    sections = [("<load commands>", data[pos : pos + sizeofcmds])]
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from("<II", data, pos)
+        if cmd in {0x1, 0x19}:  # LC_SEGMENT, LC_SEGMENT_64
+            if is_64:
+                segname, _, _, fileoff, filesize, _, _, nsects, _ = struct.unpack_from(
+                    "<16sQQQQiiII", data, pos + 8
+                )
+                section_pos, section_format = pos + 72, "<16s16sQQIIIIIIII"
+            else:
+                segname, _, _, fileoff, filesize, _, _, nsects, _ = struct.unpack_from(
+                    "<16sIIIIiiII", data, pos + 8
+                )
+                section_pos, section_format = pos + 56, "<16s16sIIIIIIIII"
+            segname = segname.rstrip(b"\0").decode("latin-1")
+            if nsects == 0:
+                sections.append((segname, data[fileoff : fileoff + filesize]))
+            for i in range(nsects):
+                fields = struct.unpack_from(
+                    section_format, data, section_pos + i * struct.calcsize(section_format)
+                )
+                sectname = fields[0].rstrip(b"\0").decode("latin-1")
+                size, offset = fields[3], fields[4]
+                # zero-fill sections have no file contents
+                contents = data[offset : offset + size] if offset else b""
+                sections.append((f"{segname},{sectname}", contents))
+        pos += cmdsize
+    return sections
+
+
+def _macho_fat_sections(data: bytes) -> list[tuple[str, bytes]]:
+    (nfat_arch,) = struct.unpack_from(">I", data, 4)
+    sections = []
+    for i in range(nfat_arch):
+        cputype, _, offset, size, _ = struct.unpack_from(">iiIII", data, 8 + i * 20)
+        for name, contents in _macho_sections(data[offset : offset + size]):
+            sections.append((f"cpu{cputype}:{name}", contents))
+    return sections
+
+
+def _coff_sections(data: bytes, coff_offset: int) -> list[tuple[str, bytes]]:
+    nsections, _, _, _, optional_size = struct.unpack_from("<HIIIH", data, coff_offset + 2)
+    table = coff_offset + 20 + optional_size
+    sections = [
+        ("<coff header>", data[coff_offset : coff_offset + 20]),
+        ("<optional header>", data[coff_offset + 20 : table]),
+    ]
+    for i in range(nsections):
+        name, _, _, raw_size, raw_offset = struct.unpack_from("<8sIIII", data, table + i * 40)
+        contents = data[raw_offset : raw_offset + raw_size] if raw_offset else b""
+        sections.append((name.rstrip(b"\0").decode("latin-1"), contents))
+    return sections
+
+
+def sections(data: bytes) -> list[tuple[str, bytes]]:
+    """
+    Returns the (name, contents) of each section of an object file or
+    library, or of each member of an ar archive.
+    """
+    kind = identify(data)
+    if kind == "elf":
+        return _elf_sections(data)
+    elif kind == "macho":
+        return _macho_sections(data)
+    elif kind == "macho-fat":
+        return _macho_fat_sections(data)
+    elif kind == "pe":
+        return _coff_sections(data, struct.unpack_from("<I", data, 0x3C)[0] + 4)
+    elif kind == "coff":
+        return _coff_sections(data, 0)
+    elif kind == "ar":
+        return [
+            (member.name, data[member.data_offset : member.data_offset + member.data_size])
+            for member in read_ar_members(data)
+        ]
+    raise ValueError("unknown binary format")
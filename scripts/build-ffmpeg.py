@@ -1,67 +1,388 @@
 import argparse
-import glob
+import concurrent.futures
 import gzip
 import hashlib
+import json
 import os
 import platform
+import re
 import shutil
 import subprocess
 import sys
 import tarfile
+import tempfile
+from collections.abc import Iterable, Iterator
+from dataclasses import replace
 
-from cibuildpkg import Builder, Package, fetch, log_group, run
+from buildcache import BuildCache
+from cibuildpkg import COMPILE_LAUNCHERS, Builder, Package, fetch, log_group, pool_jobs, run
 from pkg import *
+from metrics import BuildMetrics
+from monitor import ResourceMonitor
+import toolchain
+from reproducible import make_archive_deterministic, make_pkgconfig_relocatable
+from store import file_sha256
 
 plat = platform.system()
 
+# FFmpeg configure flags enabling each optional codec library
+codec_flags = {
+    "dav1d": "--enable-libdav1d",
+    "lamer": "--enable-libmp3lame",
+    "libsvtav1": "--enable-libsvtav1",
+    "libvmaf": "--enable-libvmaf",
+    "opus": "--enable-libopus",
+    "vpx": "--enable-libvpx",
+    "webp": "--enable-libwebp",
+    "x264": "--enable-libx264",
+    "x265": "--enable-libx265",
+}
+
+# ISA levels which can be targeted with --march-tier, by machine
+march_tiers = {
+    "x86_64": ["x86-64-v2", "x86-64-v3", "x86-64-v4"],
+    "aarch64": ["armv8.2-a"],
+}
+
+
+def write_tarball(path: str, root: str, files: Iterable[str]) -> None:
+    """
+    Writes files, given relative to root, into a reproducible gzipped tarball:
+    entries keep the given order and carry no timestamps or ownership. Files
+    are read as they are yielded, so they can be produced while writing.
+
+    The tarball is written next to path and renamed into place once
+    complete, so a failure never leaves a truncated artifact behind.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            with gzip.GzipFile(path, "wb", fileobj=fp, mtime=0) as gz:
+                with tarfile.open(fileobj=gz, mode="w|") as tar:
+                    for name in files:
+                        filepath = os.path.join(root, name)
+                        info = tar.gettarinfo(filepath, arcname=name)
+                        info.mtime = 0
+                        info.uid = 0
+                        info.gid = 0
+                        info.uname = ""
+                        info.gname = ""
+                        if info.issym() or info.islnk() or info.isdir():
+                            tar.addfile(info)
+                        else:
+                            with open(filepath, "rb") as f:
+                                tar.addfile(info, f)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
-def make_archive_deterministic(path: str) -> None:
-    """Zero mtime/uid/gid in every ar member header to make the archive reproducible.
 
-    Static archives (.a files) embed the file modification time (and uid/gid) of
-    each member in a 60-byte header.  Tools like ar(1), libtool -static, and ar -M
-    do not always produce deterministic timestamps even when SOURCE_DATE_EPOCH is set
-    or the -D flag is requested, especially in custom CMake commands (e.g. x265's
-    multi-lib merge).  Zeroing these fields in-place is the safest cross-platform fix.
+def walk_order(name: str) -> list[tuple[bool, str]]:
     """
-    MAGIC = b"!<arch>\n"
-    HEADER_SIZE = 60
-    with open(path, "r+b") as f:
-        if f.read(len(MAGIC)) != MAGIC:
-            return
-        while True:
-            pos = f.tell()
-            header = f.read(HEADER_SIZE)
-            if len(header) < HEADER_SIZE:
-                break
-            if header[58:60] != b"`\n":
-                break  # not a valid ar member header
-            try:
-                size = int(header[48:58].decode().strip())
-            except ValueError:
-                break
-            # ar member header layout (60 bytes):
-            #   [0:16]  name          16 bytes
-            #   [16:28] mtime         12 bytes  ← zero this
-            #   [28:34] uid            6 bytes  ← zero this
-            #   [34:40] gid            6 bytes  ← zero this
-            #   [40:48] mode           8 bytes
-            #   [48:58] size          10 bytes
-            #   [58:60] end magic      2 bytes  (`\n)
-            patched = (
-                header[:16]
-                + b"0           "  # mtime: 12 bytes
-                + b"0     "        # uid:    6 bytes
-                + b"0     "        # gid:    6 bytes
-                + header[40:]      # mode + size + end magic unchanged
-            )
-            f.seek(pos)
-            f.write(patched)
-            # advance past member data; ar pads to even offset
-            f.seek(size + (size % 2), 1)
+    Sort key which orders relative paths like a sorted os.walk(): the files
+    of a directory come before its subdirectories.
+    """
+    parts = name.split(os.sep)
+    return [(True, part) for part in parts[:-1]] + [(False, parts[-1])]
+
+
+def is_shared_library(name: str) -> bool:
+    """Tells whether a path, relative to the prefix, is a shipped library."""
+    name = name.replace(os.sep, "/")
+    if plat == "Darwin":
+        return name.startswith("lib/") and name.endswith(".dylib")
+    elif plat == "Windows":
+        return name.startswith("bin/") and name.endswith(".dll")
+    return name.startswith("lib/") and re.search(r"\.so(\.\d+)*$", name) is not None
+
+
+def extract_debug_info(lib: str, debug_dir: str) -> None:
+    """Copies the debug info of a library into debug_dir before stripping."""
+    name = os.path.basename(lib)
+    if plat == "Darwin":
+        run(["dsymutil", lib, "-o", os.path.join(debug_dir, name + ".dSYM")])
+    else:
+        run(["objcopy", "--only-keep-debug", lib, os.path.join(debug_dir, name + ".debug")])
+
+
+def link_debug_info(lib: str, debug_dir: str) -> None:
+    """Records the debug file of a stripped library in a .gnu_debuglink section."""
+    if plat == "Darwin":
+        # dSYM bundles are matched on LC_UUID, which -reproducible keeps stable
+        return
+    debug_file = os.path.join(debug_dir, os.path.basename(lib) + ".debug")
+    run(["objcopy", "--add-gnu-debuglink=" + debug_file, lib])
+
+
+def fix_install_names(lib: str, dest_dir: str) -> list[str]:
+    """
+    Points the install name of a dylib, and its references to other libraries
+    of the prefix, at dest_dir/lib, and drops rpaths into the build tree.
+    """
+    lib_dir = os.path.join(dest_dir, "lib")
+    build_dir = os.path.abspath("build")
+
+    def otool(flag: str) -> list[str]:
+        return subprocess.run(
+            ["otool", flag, lib], check=True, stdout=subprocess.PIPE, text=True
+        ).stdout.splitlines()[1:]
+
+    changes = []
+    install_name = otool("-D")[0].strip()
+    if not install_name.startswith(lib_dir + "/"):
+        new_name = os.path.join(lib_dir, os.path.basename(install_name))
+        run(["install_name_tool", "-id", new_name, lib])
+        changes.append(f"install name {install_name} -> {new_name}")
+
+    for line in otool("-L"):
+        dependency = line.strip().split(" (")[0]
+        name = os.path.basename(dependency)
+        if dependency.startswith(("@rpath/", build_dir + "/")) and os.path.exists(
+            os.path.join(lib_dir, name)
+        ):
+            run(["install_name_tool", "-change", dependency, os.path.join(lib_dir, name), lib])
+            changes.append(f"dependency {dependency} -> {os.path.join(lib_dir, name)}")
+
+    lines = otool("-l")
+    for i, line in enumerate(lines):
+        if line.strip() == "cmd LC_RPATH":
+            rpath = lines[i + 2].split()[1]
+            if rpath.startswith(build_dir + "/"):
+                run(["install_name_tool", "-delete_rpath", rpath, lib])
+                changes.append(f"removed rpath {rpath}")
+    return changes
+
+
+def check_text_relocations(lib: str) -> None:
+    """Fails if a shared library needs text relocations, which musl rejects."""
+    dynamic = subprocess.run(
+        ["readelf", "--dynamic", lib], check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    if "TEXTREL" in dynamic:
+        raise RuntimeError(f"{os.path.basename(lib)} has text relocations")
+
+
+def postprocess_file(
+    dest_dir: str, name: str, debug_dir: str | None
+) -> tuple[dict, list[str]]:
+    """
+    Prepares one file of the prefix for shipping and returns its manifest
+    entry along with the changes made.
+    """
+    path = os.path.join(dest_dir, name)
+    if os.path.islink(path):
+        return {"link": os.readlink(path)}, []
+
+    changes = []
+    if is_shared_library(name):
+        if debug_dir:
+            extract_debug_info(path, debug_dir)
+        if plat == "Darwin":
+            changes += fix_install_names(path, dest_dir)
+            run(["strip", "-x", "-S", path])
+            if changes and platform.machine() == "arm64":
+                # install_name_tool invalidates the ad-hoc signature
+                run(["codesign", "--force", "--sign", "-", path])
+        else:
+            run(["strip", "-s", path])
+        changes.append("stripped")
+        if debug_dir:
+            link_debug_info(path, debug_dir)
+        if plat == "Linux":
+            check_text_relocations(path)
+    elif name.endswith(".a"):
+        changes += make_archive_deterministic(path)
+    elif name.endswith(".pc"):
+        changes += make_pkgconfig_relocatable(path, dest_dir)
+
+    return {"sha256": file_sha256(path), "size": os.path.getsize(path)}, changes
+
+
+def write_debug_archive(
+    output_dir: str, tarball_name: str, debug_dir: str, library_hashes: dict[str, str]
+) -> str:
+    """
+    Archives the extracted debug info, keyed by a hash of the stripped
+    libraries it belongs to so profiles can be symbolized offline.
+    """
+    h = hashlib.sha256()
+    for name, sha256 in sorted(library_hashes.items()):
+        h.update(f"{name}:{sha256}\n".encode())
+
+    files = []
+    for root, dirs, names in os.walk(debug_dir):
+        dirs.sort()
+        for name in sorted(names):
+            files.append(os.path.relpath(os.path.join(root, name), debug_dir))
+
+    path = os.path.join(output_dir, f"{tarball_name}-debug-{h.hexdigest()[:16]}.tar.gz")
+    write_tarball(path, debug_dir, files)
+    return path
+
+
+def pgo_cache_key(
+    packages: list[Package], pgo_packages: set[str], march_tier: str | None
+) -> str:
+    """Fingerprint of everything which influences the PGO training profiles."""
+    h = hashlib.sha256()
+    h.update(make_tarball_name(march_tier).encode())
+    h.update(os.environ.get("CC", "").encode())
+    with open(os.path.join("scripts", "pgo-train.py"), "rb") as f:
+        h.update(f.read())
+    for package in packages:
+        if package.name not in pgo_packages:
+            continue
+        h.update(f"{package.name}:{package.sha256}:{package.build_arguments}".encode())
+        patch = os.path.join("patches", package.name + ".patch")
+        if os.path.exists(patch):
+            with open(patch, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def train_pgo_profiles(
+    packages: list[Package],
+    dest_dir: str,
+    profile_dir: str,
+    pgo_packages: set[str],
+    lto: bool,
+    march_tier: str | None,
+) -> None:
+    """
+    Builds instrumented libraries into a scratch prefix and runs the training
+    workload against them through the dummy binding.
+    """
+    stage_dir = dest_dir + ".pgo"
+    for path in (stage_dir, profile_dir):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    builder = Builder(
+        dest_dir=stage_dir,
+        lto=lto,
+        march=march_tier,
+        pgo="generate",
+        pgo_dir=profile_dir,
+        pgo_packages=pgo_packages,
+    )
+    builder.create_directories()
+    for package in packages:
+        # building mutates some packages, keep the originals for the final build
+        builder.build(replace(package), for_builder=package.name == "nasm")
+
+    with log_group("pgo training"):
+        env = os.environ.copy()
+        env["FFMPEG_VENDOR_DIR"] = stage_dir
+        ext_dir = os.path.join(builder.build_dir, "pgo-train")
+        run(
+            [
+                sys.executable,
+                "setup.py",
+                "build",
+                "--build-base",
+                ext_dir,
+                "--build-lib",
+                ext_dir,
+            ],
+            env=env,
+        )
 
+        env["PYTHONPATH"] = ext_dir
+        if plat == "Windows":
+            env["PATH"] = os.path.join(stage_dir, "bin") + os.pathsep + env["PATH"]
+        elif plat == "Darwin":
+            env["DYLD_LIBRARY_PATH"] = os.path.join(stage_dir, "lib")
+        else:
+            env["LD_LIBRARY_PATH"] = os.path.join(stage_dir, "lib")
+        run([sys.executable, os.path.join("scripts", "pgo-train.py")], env=env)
+
+    builder.merge_pgo_profiles()
+    with open(os.path.join(profile_dir, "complete"), "w") as fp:
+        fp.write("complete\n")
+
+
+def build_targets(
+    packages: list[Package],
+    dest_dir: str,
+    tiers: list[str],
+    jobs: int,
+    child_args: list[str],
+    host_prefix: str,
+    metrics_output: str | None = None,
+    monitor_output: str | None = None,
+) -> None:
+    """
+    Builds several targets of the host platform concurrently, one child
+    process per target. Host tools are built and sources are extracted once,
+    then each target gets its own prefix, build directory and share of jobs.
+    System packages and host tools are set up by the caller, not by the
+    children.
+    """
+    source_cache = os.path.abspath(os.path.join("build", "sources"))
+    builder = Builder(dest_dir, jobs=jobs, build_dir=source_cache, host_prefix=host_prefix)
+    builder.create_directories()
+    for package in packages:
+        if package.name == "nasm":
+            builder.build(package, for_builder=True)
+    with log_group("extract sources"):
+        builder.extract([package for package in packages if package.name != "nasm"])
+        for name, url in config_script_urls.items():
+            path = os.path.join(builder.source_dir, name)
+            if not os.path.exists(path):
+                fetch(url, path)
+
+    def build_target(tier: str) -> int:
+        log_path = os.path.join("build", f"{tier}.log")
+        tier_args = list(child_args)
+        if metrics_output:
+            base, ext = os.path.splitext(metrics_output)
+            tier_args += ["--metrics-output", f"{base}-{tier}{ext}"]
+        if monitor_output:
+            base, ext = os.path.splitext(monitor_output)
+            tier_args += ["--monitor-output", f"{base}-{tier}{ext}"]
+        with open(log_path, "w") as log:
+            return subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    f"{dest_dir}-{tier}",
+                    "--march-tier",
+                    tier,
+                    "--jobs",
+                    str(max(1, jobs // len(tiers))),
+                    "--build-dir",
+                    os.path.join("build", tier),
+                    "--host-prefix",
+                    host_prefix,
+                    "--source-cache",
+                    source_cache,
+                    "--skip-host-setup",
+                    *tier_args,
+                ],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            ).returncode
+
+    with concurrent.futures.ThreadPoolExecutor(len(tiers)) as executor:
+        returncodes = dict(zip(tiers, executor.map(build_target, tiers)))
+
+    failed = [tier for tier, returncode in returncodes.items() if returncode]
+    for tier in tiers:
+        log_path = os.path.join("build", f"{tier}.log")
+        print(f"{tier}: {'failed' if tier in failed else 'ok'}, log in {log_path}")
+        if tier in failed:
+            with open(log_path) as fp:
+                print("".join(fp.readlines()[-100:]))
+    if failed:
+        raise RuntimeError(f"Failed to build {', '.join(failed)}")
+
+
+def make_tarball_name(*variants: str | None) -> str:
+    if any(variants):
+        return "-".join([make_tarball_name(), *filter(None, variants)])
 
-def make_tarball_name() -> str:
     machine = platform.machine().lower()
     isArm64 = machine in {"arm64", "aarch64"}
 
@@ -85,6 +406,110 @@ def make_tarball_name() -> str:
 def main():
     parser = argparse.ArgumentParser("build-ffmpeg")
     parser.add_argument("destination")
+    parser.add_argument(
+        "--lto",
+        action="store_true",
+        help="build with link-time optimization (ThinLTO with clang)",
+    )
+    parser.add_argument(
+        "--march-tier",
+        choices=[tier for tiers in march_tiers.values() for tier in tiers],
+        nargs="+",
+        help=(
+            "tune C code for an ISA level, the artifact is named after the tier; "
+            "several tiers are built concurrently"
+        ),
+    )
+    parser.add_argument(
+        "--profiling",
+        action="store_true",
+        help="keep frame pointers and ship debug info in a separate archive",
+    )
+    parser.add_argument(
+        "--components",
+        choices=sorted(component_profiles),
+        default="full",
+        help="FFmpeg components and dependencies to build (default: full)",
+    )
+    parser.add_argument(
+        "--pgo",
+        action="store_true",
+        help="build with profile-guided optimization, training first if needed",
+    )
+    parser.add_argument(
+        "--pgo-packages",
+        default="ffmpeg",
+        help="comma-separated packages to optimize with PGO (default: ffmpeg)",
+    )
+    parser.add_argument(
+        "--pgo-profile-dir",
+        default="pgo-profiles",
+        help="directory where training profiles are cached",
+    )
+    parser.add_argument(
+        "--staged-install",
+        action="store_true",
+        help="install each package into its own staging root (not on Windows)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="parallel compile jobs, shared by all targets (default: CPU count, "
+        "or the size of the --distributed pool)",
+    )
+    parser.add_argument(
+        "--distributed",
+        choices=COMPILE_LAUNCHERS,
+        help="send compile jobs to a pool of distcc or icecream workers, not on Windows",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="keep build trees between runs and rebuild only what changed",
+    )
+    parser.add_argument(
+        "--lazy-libs",
+        nargs="?",
+        const=",".join(default_lazy_libraries),
+        help=(
+            "comma-separated optional dependencies to load on first use "
+            f"(default: {','.join(default_lazy_libraries)}), Linux only"
+        ),
+    )
+    parser.add_argument(
+        "--monitor-interval",
+        type=float,
+        help="sample CPU, memory and I/O of each package build every N seconds",
+    )
+    parser.add_argument(
+        "--monitor-output", help="write the resource usage samples as JSON"
+    )
+    parser.add_argument(
+        "--build-cache",
+        default=os.environ.get("BUILD_CACHE"),
+        help="URL of a bazel-remote compatible cache of package builds, "
+        "requires --staged-install (default: $BUILD_CACHE)",
+    )
+    parser.add_argument(
+        "--build-cache-read-only",
+        action="store_true",
+        help="use the build cache without uploading to it",
+    )
+    parser.add_argument(
+        "--host-tools-cache",
+        help="directory where the host tools (cmake, meson, ninja, nasm, xxd) are "
+        "cached between builds, not on Windows",
+    )
+    parser.add_argument(
+        "--metrics-output",
+        help="write build metrics in OpenMetrics text format, e.g. for the "
+        "node exporter textfile collector",
+    )
+    # set when building one of several targets, see build_targets()
+    parser.add_argument("--build-dir", default="build", help=argparse.SUPPRESS)
+    parser.add_argument("--host-prefix", help=argparse.SUPPRESS)
+    parser.add_argument("--source-cache", help=argparse.SUPPRESS)
+    parser.add_argument("--skip-host-setup", action="store_true", help=argparse.SUPPRESS)
 
     args = parser.parse_args()
     dest_dir = os.path.abspath(args.destination)
@@ -94,29 +519,85 @@ def main():
     is_arm = machine in {"arm64", "aarch64"} or is_arm32
     is_riscv = machine in {"riscv64"}
 
-    use_alsa = plat == "Linux"
+    tier_machine = {"amd64": "x86_64", "arm64": "aarch64"}.get(machine, machine)
+    for tier in args.march_tier or []:
+        if tier not in march_tiers.get(tier_machine, []):
+            parser.error(f"--march-tier {tier} does not apply to {machine}")
+    march_tier = args.march_tier[0] if args.march_tier else None
+    multi_target = args.march_tier is not None and len(args.march_tier) > 1
+    if multi_target and args.pgo:
+        parser.error("--pgo builds a single --march-tier at a time")
+    if multi_target and args.incremental:
+        parser.error("--incremental builds a single --march-tier at a time")
+    lazy_libs = set(args.lazy_libs.split(",")) if args.lazy_libs else set()
+    if lazy_libs and (plat != "Linux" or tier_machine not in {"x86_64", "aarch64"}):
+        parser.error("--lazy-libs is only supported on Linux x86_64 and aarch64")
+    if lazy_libs - set(lazy_libraries):
+        parser.error(f"--lazy-libs supports {', '.join(sorted(lazy_libraries))}")
+    if args.staged_install and plat == "Windows":
+        parser.error("--staged-install is not supported on Windows")
+    if args.build_cache and not args.staged_install:
+        parser.error("--build-cache requires --staged-install")
+    if args.build_cache and args.incremental:
+        parser.error("--build-cache and --incremental cannot be combined")
+    if args.pgo and args.incremental:
+        # the instrumented build of the training stage shares build/
+        parser.error("--pgo and --incremental cannot be combined")
+    if args.host_tools_cache and plat == "Windows":
+        parser.error("--host-tools-cache is not supported on Windows")
+    if args.distributed and plat == "Windows":
+        parser.error("--distributed is not supported on Windows")
+    if args.distributed and not shutil.which(args.distributed):
+        parser.error(f"--distributed {args.distributed}: not found on PATH")
+    if args.distributed and args.pgo:
+        parser.error("--pgo profiles are not available to --distributed workers")
+    if args.jobs is None:
+        args.jobs = pool_jobs(args.distributed) if args.distributed else os.cpu_count() or 4
+
+    profile = component_profiles[args.components]
+
+    use_alsa = plat == "Linux" and profile.uses(alsa_package.name)
     # CUDA, AMF, and Intel VPL are not available on ARM64 Windows
-    use_cuda = plat in {"Linux", "Windows"} and not is_arm and not is_riscv
-    use_amf = plat in {"Linux", "Windows"} and not is_arm and not is_riscv
+    use_cuda = (
+        plat in {"Linux", "Windows"}
+        and not is_arm
+        and not is_riscv
+        and profile.uses(nvheaders_package.name)
+    )
+    use_amf = (
+        plat in {"Linux", "Windows"}
+        and not is_arm
+        and not is_riscv
+        and profile.uses(amfheaders_package.name)
+    )
 
     # Use Intel VPL (Video Processing Library) if supported to enable Intel QSV (Quick Sync Video)
     # hardware encoders/decoders on modern integrated and discrete Intel GPUs.
-    use_libvpl = plat in {"Linux", "Windows"} and not is_arm
+    use_libvpl = plat in {"Linux", "Windows"} and not is_arm and profile.uses(libvpl_package.name)
 
     # Use GnuTLS only on Linux, FFmpeg has native TLS backends for macOS and Windows.
-    use_gnutls = plat == "Linux"
+    use_gnutls = plat == "Linux" and profile.uses("gnutls")
+
+    # x264/x265 are skipped on 32-bit ARM (armv7)
+    codec_packages = [
+        p
+        for p in codec_group
+        if profile.uses(p.name) and not (is_arm32 and p.name in {"x264", "x265"})
+    ]
 
     output_dir = os.path.abspath("output")
     if plat == "Linux" and os.environ.get("CIBUILDWHEEL") == "1":
         output_dir = "/output"
 
-    output_tarball = os.path.join(output_dir, make_tarball_name() + ".tar.gz")
-    if os.path.exists(output_tarball):
+    tarball_name = make_tarball_name(
+        None if profile.components is None else profile.name,
+        march_tier,
+        "profiling" if args.profiling else None,
+    )
+    output_tarball = os.path.join(output_dir, tarball_name + ".tar.gz")
+    if not multi_target and os.path.exists(output_tarball):
         return
 
-    builder = Builder(dest_dir=dest_dir)
-    builder.create_directories()
-
     # install packages
     available_tools = set()
     if plat == "Windows":
@@ -132,7 +613,31 @@ def main():
         for tool in tools:
             run(["where", tool])
 
-    if plat == "Linux" and (is_musllinux or shutil.which("xxd") is None):
+    # cmake, meson, ninja, nasm and xxd are restored from the cache if they
+    # were installed by a previous build on the same platform
+    host_prefix = args.host_prefix or dest_dir + ".builder"
+    # nasm is built for x86 unless the system provides it
+    use_nasm = (
+        plat != "Darwin"
+        and "nasm" not in available_tools
+        and machine in {"x86_64", "amd64", "i686", "i386"}
+    )
+    host_tools_key = toolchain.layer_key(with_xxd=plat == "Linux", with_nasm=use_nasm)
+    host_tools_restored = False
+    # the targets of a multi-target build share the host set up by the parent
+    set_up_host = not args.skip_host_setup
+    if args.host_tools_cache and set_up_host:
+        with log_group("restore host tools"):
+            host_tools_restored = toolchain.restore(
+                host_prefix, args.host_tools_cache, host_tools_key, with_nasm=use_nasm
+            )
+
+    if (
+        plat == "Linux"
+        and set_up_host
+        and not host_tools_restored
+        and (is_musllinux or shutil.which("xxd") is None)
+    ):
         with log_group("install system packages"):
             # libvmaf uses xxd to embed its built-in models. BusyBox xxd,
             # provided by musllinux images, cannot write C output to a file.
@@ -148,8 +653,32 @@ def main():
             else:
                 raise RuntimeError("Unable to install xxd")
 
-    with log_group("install python packages"):
-        run(["pip", "install", "cmake", "meson", "ninja"])
+    if set_up_host and args.host_tools_cache and not host_tools_restored:
+        with log_group("install host tools"):
+            toolchain.install_python_tools(host_prefix)
+            if plat == "Linux":
+                toolchain.copy_system_tool(host_prefix, "xxd")
+            if use_nasm:
+                # staging records the files of nasm, which make up the layer
+                host_builder = Builder(
+                    dest_dir,
+                    staged=True,
+                    jobs=args.jobs,
+                    build_dir=os.path.join(args.build_dir, "host-tools"),
+                    host_prefix=host_prefix,
+                )
+                host_builder.create_directories()
+                host_builder.build(nasm_package, for_builder=True)
+            toolchain.save(
+                host_prefix,
+                args.host_tools_cache,
+                host_tools_key,
+                with_xxd=plat == "Linux",
+                with_nasm=use_nasm,
+            )
+    elif set_up_host and not args.host_tools_cache:
+        with log_group("install python packages"):
+            run(["pip", "install", "cmake", "meson", "ninja"])
 
     ffmpeg_package.build_arguments = [
         "--disable-programs",
@@ -169,22 +698,18 @@ def main():
         "--enable-version3",
         "--enable-alsa" if use_alsa else "--disable-alsa",
         "--enable-gnutls" if use_gnutls else "--disable-gnutls",
-        "--enable-libdav1d",
-        "--enable-libmp3lame",
-        "--enable-libopus",
-        "--enable-libsvtav1",
-        "--enable-libvmaf",
-        "--enable-libvpx",
-        "--enable-libwebp",
-        "--enable-libxcb" if plat == "Linux" else "--disable-libxcb",
+        # x11grab is an input device, which reduced profiles do not enable
+        (
+            "--enable-libxcb"
+            if plat == "Linux" and profile.components is None
+            else "--disable-libxcb"
+        ),
         "--enable-zlib",
+        *profile.configure_arguments(),
     ]
-
-    # x264/x265 are skipped on 32-bit ARM (armv7)
-    if not is_arm32:
-        ffmpeg_package.build_arguments.extend(
-            ["--enable-libx264", "--enable-libx265"]
-        )
+    ffmpeg_package.build_arguments.extend(
+        codec_flags[p.name] for p in codec_packages if p.name in codec_flags
+    )
 
     if use_cuda:
         ffmpeg_package.build_arguments.extend(["--enable-nvenc", "--enable-nvdec"])
@@ -233,7 +758,7 @@ def main():
     )
 
     packages = []
-    if plat != "Darwin" and "nasm" not in available_tools and machine in {"x86_64", "amd64", "i686", "i386"}:
+    if use_nasm:
         packages.append(nasm_package)
     if use_alsa:
         packages += [alsa_package]
@@ -246,11 +771,7 @@ def main():
 
     if use_gnutls:
         packages += gnutls_group
-    if is_arm32:
-        # x264/x265 are not built on 32-bit ARM (armv7)
-        packages += [p for p in codec_group if p.name not in {"x264", "x265"}]
-    else:
-        packages += codec_group
+    packages += codec_packages
     packages += [ffmpeg_package]
 
     # Disable runtime CPU detection for opus on Windows ARM64
@@ -261,9 +782,102 @@ def main():
                 pkg.build_arguments.append("--disable-rtcd")
                 break
 
+    if multi_target:
+        child_args = ["--components", args.components]
+        for flag in ("lto", "profiling", "staged_install"):
+            if getattr(args, flag):
+                child_args.append("--" + flag.replace("_", "-"))
+        if args.monitor_interval:
+            child_args += ["--monitor-interval", str(args.monitor_interval)]
+        if lazy_libs:
+            child_args += ["--lazy-libs", ",".join(sorted(lazy_libs))]
+        if args.host_tools_cache:
+            child_args += ["--host-tools-cache", args.host_tools_cache]
+        if args.distributed:
+            child_args += ["--distributed", args.distributed]
+        if args.build_cache:
+            child_args += ["--build-cache", args.build_cache]
+            if args.build_cache_read_only:
+                child_args.append("--build-cache-read-only")
+        build_targets(
+            packages,
+            dest_dir,
+            args.march_tier,
+            args.jobs,
+            child_args,
+            host_prefix,
+            metrics_output=args.metrics_output,
+            monitor_output=args.monitor_output,
+        )
+        return
+
+    metrics = None
+    if args.metrics_output:
+        metrics = BuildMetrics(
+            artifact=tarball_name,
+            components=profile.name,
+            march_tier=march_tier or "",
+            platform=f"{plat.lower()}-{machine}",
+        )
+
+    pgo_packages = set(args.pgo_packages.split(","))
+    profile_dir = ""
+    if args.pgo:
+        profile_dir = os.path.join(
+            os.path.abspath(args.pgo_profile_dir),
+            pgo_cache_key(packages, pgo_packages, march_tier),
+        )
+        cached = os.path.exists(os.path.join(profile_dir, "complete"))
+        if metrics:
+            metrics.cache_lookup("pgo_profiles", cached)
+        if cached:
+            print(f"Using cached PGO profiles from {profile_dir}")
+        else:
+            train_pgo_profiles(
+                packages, dest_dir, profile_dir, pgo_packages, args.lto, march_tier
+            )
+
+    monitor = None
+    if args.monitor_interval:
+        monitor = ResourceMonitor(args.monitor_interval)
+        monitor.start()
+
+    builder = Builder(
+        dest_dir=dest_dir,
+        lto=args.lto,
+        march=march_tier,
+        profiling=args.profiling,
+        pgo="use" if args.pgo else None,
+        pgo_dir=profile_dir,
+        pgo_packages=pgo_packages,
+        staged=args.staged_install,
+        jobs=args.jobs,
+        build_dir=args.build_dir,
+        host_prefix=args.host_prefix,
+        source_cache=args.source_cache,
+        monitor=monitor,
+        metrics=metrics,
+        build_cache=(
+            BuildCache(args.build_cache, upload=not args.build_cache_read_only)
+            if args.build_cache
+            else None
+        ),
+        incremental=args.incremental,
+        lazy_libs=lazy_libs,
+        distributed=args.distributed,
+    )
+    builder.create_directories()
     for package in packages:
         builder.build(package, for_builder=package.name == "nasm")
 
+    if monitor:
+        monitor.stop()
+        with log_group("resource usage"):
+            monitor.print_report()
+        if args.monitor_output:
+            with open(args.monitor_output, "w") as fp:
+                json.dump(monitor.report(), fp, indent=1)
+
     if plat == "Windows":
         # fix .lib files being installed in the wrong directory
         for name in (
@@ -311,51 +925,81 @@ def main():
         for name in dll_names:
             shutil.copy(os.path.join(mingw_bindir, name), os.path.join(dest_dir, "bin"))
 
-    # find libraries
-    if plat == "Darwin":
-        libraries = glob.glob(os.path.join(dest_dir, "lib", "*.dylib"))
-    elif plat == "Linux":
-        libraries = glob.glob(os.path.join(dest_dir, "lib", "*.so"))
-    elif plat == "Windows":
-        libraries = glob.glob(os.path.join(dest_dir, "bin", "*.dll"))
-
-    if plat == "Darwin":
-        run(["strip", "-x", "-S"] + libraries)
-    else:
-        run(["strip", "-s"] + libraries)
-
-    for lib in glob.glob(os.path.join(dest_dir, "lib", "*.a")):
-        make_archive_deterministic(lib)
-
-    # build output tarball (reproducible: fixed timestamps, sorted entries)
-    os.makedirs(output_dir, exist_ok=True)
+    # collect output files (reproducible: sorted entries)
     subdirs = ["include", "lib"]
     if plat == "Windows":
         subdirs.append("bin")
-    with gzip.GzipFile(output_tarball, "wb", mtime=0) as gz:
-        with tarfile.open(fileobj=gz, mode="w|") as tar:
-            for subdir in subdirs:
-                subdir_path = os.path.join(dest_dir, subdir)
-                if not os.path.exists(subdir_path):
-                    continue
-                for root, dirs, files in os.walk(subdir_path):
-                    dirs.sort()
-                    for name in sorted(files):
-                        if subdir == "bin" and not name.endswith(".dll"):
-                            continue
-                        filepath = os.path.join(root, name)
-                        arcname = os.path.relpath(filepath, dest_dir)
-                        info = tar.gettarinfo(filepath, arcname=arcname)
-                        info.mtime = 0
-                        info.uid = 0
-                        info.gid = 0
-                        info.uname = ""
-                        info.gname = ""
-                        if info.issym() or info.islnk():
-                            tar.addfile(info)
-                        else:
-                            with open(filepath, "rb") as f:
-                                tar.addfile(info, f)
+    files = []
+    if args.staged_install:
+        # every file is recorded by the package which installed it
+        files = sorted(
+            {
+                name
+                for names in builder.installed_files().values()
+                for name in names
+                if name.split(os.sep)[0] in subdirs
+            },
+            key=walk_order,
+        )
+    else:
+        for subdir in subdirs:
+            subdir_path = os.path.join(dest_dir, subdir)
+            if not os.path.exists(subdir_path):
+                continue
+            for root, dirs, names in os.walk(subdir_path):
+                dirs.sort()
+                for name in sorted(names):
+                    if subdir == "bin" and not name.endswith(".dll"):
+                        continue
+                    files.append(os.path.relpath(os.path.join(root, name), dest_dir))
+
+    debug_dir = None
+    if args.profiling:
+        debug_dir = os.path.join(builder.build_dir, "debug")
+        os.makedirs(debug_dir, exist_ok=True)
+
+    # strip and normalize every file concurrently, streaming each one into
+    # the output tarball as soon as it and the files before it are done
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {}
+    with log_group("post-process and package"):
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            results = executor.map(
+                lambda name: postprocess_file(dest_dir, name, debug_dir), files
+            )
+
+            def processed_files() -> Iterator[str]:
+                for name, (entry, changes) in zip(files, results):
+                    posix_name = name.replace(os.sep, "/")
+                    manifest[posix_name] = entry
+                    if changes:
+                        print(f"{posix_name}: {', '.join(changes)}")
+                    yield name
+
+            write_tarball(output_tarball, dest_dir, processed_files())
+
+    with open(os.path.join(output_dir, tarball_name + ".manifest.json"), "w") as fp:
+        json.dump({"files": manifest}, fp, indent=1, sort_keys=True)
+        fp.write("\n")
+
+    if debug_dir:
+        library_hashes = {
+            name: entry["sha256"]
+            for name, entry in manifest.items()
+            if is_shared_library(name) and "sha256" in entry
+        }
+        write_debug_archive(output_dir, tarball_name, debug_dir, library_hashes)
+
+    if metrics:
+        metrics.set(
+            "artifact_size_bytes", os.path.getsize(output_tarball), artifact=tarball_name
+        )
+        metrics.set(
+            "artifact_unpacked_size_bytes",
+            sum(entry.get("size", 0) for entry in manifest.values()),
+            artifact=tarball_name,
+        )
+        metrics.write(args.metrics_output)
 
 
 if __name__ == "__main__":
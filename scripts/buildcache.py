@@ -0,0 +1,360 @@
+# Remote cache of package builds, over the HTTP protocol of bazel-remote
+#
+# The files a package installs into its staging root are archived and stored
+# as a blob under /cas/<sha256 of the archive>. The fingerprint of all inputs
+# of the build is the key of an entry under /ac/<fingerprint>, an ActionResult
+# message which names the archive as its single output file. Any bazel-remote
+# instance can serve as the cache, and `serve` runs a file-backed stand-in
+# which verifies uploads and evicts the least recently used entries.
+
+import argparse
+import collections
+import functools
+import hashlib
+import http.server
+import io
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+# name of the output file in the ActionResult
+OUTPUT_NAME = "install.tar.gz"
+
+# seconds a request may wait on the cache, which then counts as unreachable
+TIMEOUT = 30
+
+HEX_KEY = re.compile(r"^/(ac|cas)/([0-9a-f]{64})$")
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+
+def _length_delimited(number: int, payload: bytes) -> bytes:
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _parse_message(data: bytes) -> dict[int, list]:
+    """Returns the varint and length-delimited fields of a protobuf message."""
+    fields: dict[int, list] = {}
+    pos = 0
+    while pos < len(data):
+        tag, pos = _read_varint(data, pos)
+        if tag & 7 == 0:
+            value, pos = _read_varint(data, pos)
+        elif tag & 7 == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+            if pos > len(data):
+                raise ValueError("truncated message")
+        else:
+            raise ValueError(f"unsupported wire type {tag & 7}")
+        fields.setdefault(tag >> 3, []).append(value)
+    return fields
+
+
+def encode_action_result(sha256: str, size: int) -> bytes:
+    """
+    Returns an ActionResult whose only output file is the given blob.
+    """
+    digest = _length_delimited(1, sha256.encode()) + _varint(2 << 3) + _varint(size)
+    output_file = _length_delimited(1, OUTPUT_NAME.encode()) + _length_delimited(
+        2, digest
+    )
+    return _length_delimited(2, output_file)
+
+
+def decode_action_result(data: bytes) -> tuple[str, int]:
+    """Returns the sha256 and size of the output file of an ActionResult."""
+    for output_file in _parse_message(data).get(2, []):
+        fields = _parse_message(output_file)
+        if fields.get(1) == [OUTPUT_NAME.encode()]:
+            digest = _parse_message(fields[2][0])
+            return digest[1][0].decode(), digest.get(2, [0])[0]
+    raise ValueError(f"no {OUTPUT_NAME} in action result")
+
+
+def archive_directory(directory: str) -> bytes:
+    """Returns a reproducible gzipped tarball of a directory."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=6) as tar:
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(dirs + names):
+                path = os.path.join(root, name)
+                info = tar.gettarinfo(path, arcname=os.path.relpath(path, directory))
+                info.mtime = info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                if info.isfile():
+                    with open(path, "rb") as fp:
+                        tar.addfile(info, fp)
+                else:
+                    tar.addfile(info)
+    return buffer.getvalue()
+
+
+def extract_tarball(tar: tarfile.TarFile, directory: str) -> None:
+    """
+    Extracts an untrusted tarball into directory, refusing members which
+    would end up outside of it.
+    """
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(directory, filter="data")
+        return
+
+    # Python releases from before the extraction filters
+    def escapes(path: str) -> bool:
+        return os.path.isabs(path) or os.path.normpath(path).split(os.sep)[0] == ".."
+
+    for member in tar.getmembers():
+        if escapes(member.name):
+            raise tarfile.TarError(f"{member.name}: outside of the destination")
+        target = member.linkname
+        if member.issym():
+            target = os.path.join(os.path.dirname(member.name), member.linkname)
+        if (member.issym() or member.islnk()) and escapes(target):
+            raise tarfile.TarError(f"{member.name}: link outside of the destination")
+    tar.extractall(directory)
+
+
+class BuildCache:
+    """
+    Client of a cache which speaks the HTTP protocol of bazel-remote.
+    """
+
+    def __init__(self, url: str, *, upload: bool = True) -> None:
+        self.url = url.rstrip("/")
+        self.upload = upload
+
+    def _get(self, kind: str, key: str) -> bytes | None:
+        try:
+            with urllib.request.urlopen(
+                f"{self.url}/{kind}/{key}", timeout=TIMEOUT
+            ) as response:
+                return response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return None
+            raise
+
+    def _put(self, kind: str, key: str, data: bytes) -> None:
+        request = urllib.request.Request(
+            f"{self.url}/{kind}/{key}", data=data, method="PUT"
+        )
+        request.add_header("Content-Type", "application/octet-stream")
+        with urllib.request.urlopen(request, timeout=TIMEOUT):
+            pass
+
+    def restore(self, fingerprint: str, directory: str) -> bool:
+        """
+        Extracts the cached build of a fingerprint into directory and returns
+        whether there was one. A corrupt or unreachable cache is a miss.
+        """
+        try:
+            action_result = self._get("ac", fingerprint)
+            if action_result is None:
+                return False
+            sha256, size = decode_action_result(action_result)
+            blob = self._get("cas", sha256)
+        # OSError includes timeouts and refused connections
+        except (OSError, ValueError, IndexError) as exc:
+            print(f"build cache: {exc}")
+            return False
+        if blob is None:
+            return False
+        if len(blob) != size or hashlib.sha256(blob).hexdigest() != sha256:
+            print(f"build cache: corrupt blob cas/{sha256}")
+            return False
+
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with tarfile.open(fileobj=io.BytesIO(blob), mode="r:gz") as tar:
+                extract_tarball(tar, directory)
+        except tarfile.TarError as exc:
+            # the caller clears the directory before building
+            print(f"build cache: cas/{sha256}: {exc}")
+            return False
+        return True
+
+    def save(self, fingerprint: str, directory: str) -> None:
+        """
+        Uploads the contents of directory as the build of a fingerprint.
+        Failures are reported but do not fail the build.
+        """
+        if not self.upload:
+            return
+        blob = archive_directory(directory)
+        sha256 = hashlib.sha256(blob).hexdigest()
+        try:
+            self._put("cas", sha256, blob)
+            self._put("ac", fingerprint, encode_action_result(sha256, len(blob)))
+        except OSError as exc:
+            print(f"build cache: upload failed: {exc}")
+            return
+        print(f"build cache: uploaded {len(blob)} bytes as ac/{fingerprint}")
+
+
+class FileStore:
+    """
+    Entries of the local server, evicted least recently used first once
+    their total size exceeds max_size.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # relative path: size, least recently used first
+        self._entries: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._size = 0
+
+        found = []
+        for kind in ("ac", "cas"):
+            os.makedirs(os.path.join(directory, kind), exist_ok=True)
+            for name in os.listdir(os.path.join(directory, kind)):
+                if not HEX_KEY.match(f"/{kind}/{name}"):
+                    continue
+                stat = os.stat(os.path.join(directory, kind, name))
+                found.append((stat.st_mtime, f"{kind}/{name}", stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+
+    def get(self, name: str) -> bytes | None:
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+            # the modification time keeps the order across restarts
+            os.utime(path)
+        try:
+            with open(path, "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            # evicted meanwhile
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.directory, name)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        with self._lock:
+            os.replace(temp_path, path)
+            self._size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            while self._size > self.max_size and len(self._entries) > 1:
+                evicted, size = self._entries.popitem(last=False)
+                os.unlink(os.path.join(self.directory, evicted))
+                self._size -= size
+
+
+class CacheHandler(http.server.BaseHTTPRequestHandler):
+    def __init__(self, *args, store: FileStore, **kwargs) -> None:
+        self.store = store
+        super().__init__(*args, **kwargs)
+
+    def _key(self) -> tuple[str, str] | None:
+        match = HEX_KEY.match(self.path)
+        if match is None:
+            self.send_error(400, "expected /ac/<sha256> or /cas/<sha256>")
+            return None
+        return match.group(1), match.group(2)
+
+    def _get(self, *, send_body: bool) -> None:
+        if (key := self._key()) is None:
+            return
+        data = self.store.get("/".join(key))
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        self._get(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._get(send_body=False)
+
+    def do_PUT(self) -> None:
+        if (key := self._key()) is None:
+            return
+        kind, name = key
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if kind == "cas" and hashlib.sha256(data).hexdigest() != name:
+            self.send_error(400, "sha256 of the blob does not match its key")
+            return
+        if kind == "ac":
+            try:
+                decode_action_result(data)
+            except (ValueError, IndexError):
+                self.send_error(400, "not an action result")
+                return
+        self.store.put(f"{kind}/{name}", data)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def parse_size(value: str) -> int:
+    """Parses a size such as 500M or 20G."""
+    units = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    match = re.fullmatch(r"(\d+)([KMGT]?)i?B?", value.strip().upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+    return int(match.group(1)) * units[match.group(2)]
+
+
+def serve(directory: str, bind: str, port: int, max_size: int) -> None:
+    handler = functools.partial(CacheHandler, store=FileStore(directory, max_size))
+    with http.server.ThreadingHTTPServer((bind, port), handler) as server:
+        print(f"Serving the build cache in {directory} at http://{bind}:{port}/", flush=True)
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser("buildcache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser(
+        "serve", help="serve a file-backed cache over HTTP"
+    )
+    serve_parser.add_argument("directory")
+    serve_parser.add_argument("--bind", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument(
+        "--max-size", type=parse_size, default="10G", help="evict entries beyond this size"
+    )
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.directory, args.bind, args.port, args.max_size)
+
+
+if __name__ == "__main__":
+    main()
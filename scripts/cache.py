@@ -1,10 +1,118 @@
-from pkg import all_packages
+# Per-package cache of source tarballs
+#
+# Each tarball is cached under its own content-addressed key, the sha256
+# pinned in pkg.py, using the layout of the source store. Restoring copies
+# only the tarballs missing from the source directory, and saving adds only
+# the tarballs missing from the cache, so bumping one package downloads that
+# package alone. The cache is a local directory, which CI persists between
+# runs, or the URL of a served store for restores.
+
+import argparse
+import os
+
+import store
+from pkg import Package, all_packages
+
+
+def source_filename(package: Package) -> str:
+    return package.source_filename or package.source_url.split("/")[-1]
+
+
+def source_key(package: Package) -> str:
+    return f"sha256/{package.sha256}"
+
+
+def restore(cache_dir: str, source_dir: str, packages: list[Package]) -> list[str]:
+    """
+    Copies the tarballs which are missing from source_dir out of the cache
+    and returns the names of the packages the cache did not have.
+    """
+    os.makedirs(source_dir, exist_ok=True)
+    missing = []
+    for package in packages:
+        path = os.path.join(source_dir, source_filename(package))
+        if os.path.exists(path):
+            continue
+        found = store.get(
+            path, url=package.source_url, sha256=package.sha256, store=cache_dir
+        )
+        print(f"{package.name}: {'restored' if found else 'not cached'}")
+        if not found:
+            missing.append(package.name)
+    return missing
+
+
+def save(
+    source_dir: str, cache_dir: str, packages: list[Package], *, prune: bool = False
+) -> None:
+    """
+    Adds the tarballs of source_dir which the cache does not have yet. With
+    prune, entries no package refers to any more are removed, along with the
+    URL index entries which point at them.
+    """
+    for package in packages:
+        path = os.path.join(source_dir, source_filename(package))
+        if os.path.exists(os.path.join(cache_dir, *source_key(package).split("/"))):
+            continue
+        if not os.path.exists(path):
+            print(f"{package.name}: not in {source_dir}")
+        elif store.file_sha256(path) != package.sha256:
+            print(f"{package.name}: sha256 does not match, not saved")
+        else:
+            store.put(path, url=package.source_url, store=cache_dir)
+            print(f"{package.name}: saved")
+
+    if prune:
+        keys = {source_key(package) for package in packages}
+        blob_dir = os.path.join(cache_dir, "sha256")
+        for name in sorted(os.listdir(blob_dir)) if os.path.isdir(blob_dir) else []:
+            if f"sha256/{name}" not in keys:
+                os.unlink(os.path.join(blob_dir, name))
+                print(f"sha256/{name}: pruned")
+        # and the URLs which resolved to them
+        index_dir = os.path.join(cache_dir, "url")
+        for name in sorted(os.listdir(index_dir)) if os.path.isdir(index_dir) else []:
+            with open(os.path.join(index_dir, name)) as fp:
+                digest = fp.read().strip()
+            if f"sha256/{digest}" not in keys:
+                os.unlink(os.path.join(index_dir, name))
+                print(f"url/{name}: pruned")
+
 
 def main():
-    with open("cache.txt", "w") as file:
-        for package in sorted(all_packages):
-            file.write(f"{package.name}:{package.sha256}\n")
+    parser = argparse.ArgumentParser("cache")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("keys", help="print the cache key of each package")
+    restore_parser = subparsers.add_parser(
+        "restore", help="copy the missing tarballs from the cache"
+    )
+    restore_parser.add_argument("cache")
+    restore_parser.add_argument("--source-dir", default="source")
+    save_parser = subparsers.add_parser(
+        "save", help="add the tarballs the cache does not have"
+    )
+    save_parser.add_argument("cache")
+    save_parser.add_argument("--source-dir", default="source")
+    save_parser.add_argument(
+        "--prune", action="store_true", help="remove entries of older versions"
+    )
+    args = parser.parse_args()
+
+    packages = sorted(all_packages, key=lambda package: package.name)
+    if args.command == "keys":
+        for package in packages:
+            print(f"{package.name} {source_key(package)} {source_filename(package)}")
+    elif args.command == "restore":
+        missing = restore(args.cache, args.source_dir, packages)
+        print(f"{len(packages) - len(missing)} restored or present, {len(missing)} missing")
+    elif args.command == "save":
+        save(args.source_dir, args.cache, packages, prune=args.prune)
+    else:
+        # a summary of all keys, whose hash names the whole cache
+        with open("cache.txt", "w") as file:
+            for package in packages:
+                file.write(f"{package.name}:{package.sha256}\n")
+
 
 if __name__ == "__main__":
     main()
-
@@ -1,6 +1,11 @@
 # Utilities for building native library inside cibuildwheel
 
+import concurrent.futures
 import contextlib
+import filecmp
+import glob
+import hashlib
+import json
 import os
 import platform
 import shutil
@@ -10,12 +15,37 @@ import tarfile
 import tempfile
 import time
 from collections.abc import Iterator
-from dataclasses import dataclass, field, replace
+from dataclasses import asdict, dataclass, field, replace
 
+import lazylib
+import store
+from buildcache import BuildCache
+from metrics import BuildMetrics
+from monitor import ResourceMonitor
 from pkg import *
 
-def fetch(url: str, path: str) -> None:
-    run(["curl", "-L", "-o", path, url])
+def fetch(
+    url: str,
+    path: str,
+    sha256: str | None = None,
+    *,
+    metrics: BuildMetrics | None = None,
+) -> None:
+    """
+    Downloads url to path, unless the source store has the file.
+    """
+    found = store.get(path, url=url, sha256=sha256)
+    if metrics and os.environ.get("SOURCE_STORE"):
+        metrics.cache_lookup("source_store", found)
+    if found:
+        return
+    start = time.monotonic()
+    run(["curl", "-f", "-L", "-o", path, url])
+    if metrics:
+        metrics.download(
+            os.path.basename(path), os.path.getsize(path), time.monotonic() - start
+        )
+    store.put(path, url=url)
 
 
 @contextlib.contextmanager
@@ -50,6 +80,60 @@ def log_group(title: str) -> Iterator[None]:
         print(f"::endgroup::\n{ok_str}", flush=True)
 
 
+# environment variables which affect the outcome of a configure step
+CONFIGURE_ENV = (
+    "AR",
+    "AS",
+    "CC",
+    "CFLAGS",
+    "CPPFLAGS",
+    "CXX",
+    "CXXFLAGS",
+    "LDFLAGS",
+    "NM",
+    "PKG_CONFIG_PATH",
+    "RANLIB",
+)
+
+# compiler wrappers which send compile jobs to a pool of workers
+COMPILE_LAUNCHERS = ("distcc", "icecc")
+
+
+def pool_jobs(launcher: str) -> int:
+    """
+    Returns how many compile jobs keep a pool of distcc or icecream workers
+    busy, preprocessing and linking still happen on this machine.
+    """
+    if launcher == "distcc":
+        # the sum of the job limits of DISTCC_HOSTS
+        try:
+            output = subprocess.run(
+                ["distcc", "-j"], check=True, capture_output=True, text=True
+            ).stdout
+            return int(output.strip())
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    # the icecream scheduler does not tell the size of its pool
+    return 4 * (os.cpu_count() or 4)
+
+
+def find_config_scripts(path: str) -> list[str]:
+    """
+    Returns the config.guess and config.sub scripts found under path.
+    """
+    scripts = []
+    for root, dirs, files in os.walk(path):
+        for name in filter(lambda x: x in config_script_urls, files):
+            scripts.append(os.path.join(root, name))
+    return scripts
+
+
+def _same_file(a: str, b: str) -> bool:
+    if os.path.islink(a) or os.path.islink(b):
+        return os.path.islink(a) and os.path.islink(b) and os.readlink(a) == os.readlink(b)
+    return os.path.samefile(a, b) or filecmp.cmp(a, b, shallow=False)
+
+
 def prepend_env(env, name: str, new: str, separator: str = " ") -> None:
     old = env.get(name)
     if old:
@@ -76,11 +160,79 @@ def run(cmd: list[str], env=None) -> None:
 
 
 class Builder:
-    def __init__(self, dest_dir: str) -> None:
-        self._builder_dest_dir = dest_dir + ".builder"
+    def __init__(
+        self,
+        dest_dir: str,
+        *,
+        lto: bool = False,
+        march: str | None = None,
+        profiling: bool = False,
+        pgo: str | None = None,
+        pgo_dir: str = "",
+        pgo_packages: set[str] | None = None,
+        staged: bool = False,
+        jobs: int = 4,
+        build_dir: str = "build",
+        host_prefix: str | None = None,
+        source_cache: str | None = None,
+        monitor: ResourceMonitor | None = None,
+        metrics: BuildMetrics | None = None,
+        build_cache: BuildCache | None = None,
+        incremental: bool = False,
+        lazy_libs: set[str] | None = None,
+        distributed: str | None = None,
+    ) -> None:
+        # host tools can be shared by builders for several targets
+        self._builder_dest_dir = host_prefix or dest_dir + ".builder"
         self._target_dest_dir = dest_dir
-
-        self.build_dir = os.path.abspath("build")
+        self.lto = lto
+        self.march = march
+        self.profiling = profiling
+
+        # profile-guided optimization: "generate" builds instrumented
+        # libraries which write profiles to pgo_dir, "use" consumes them
+        assert pgo in {None, "generate", "use"}
+        self.pgo = pgo
+        self.pgo_dir = pgo_dir
+        self.pgo_packages = pgo_packages or set()
+
+        # install each package into its own staging root, then link its files
+        # into the prefix, this relies on DESTDIR which MSYS does not map
+        assert not (staged and platform.system() == "Windows")
+        self.staged = staged
+
+        self.jobs = jobs
+        self.monitor = monitor
+
+        # send compile jobs to distcc or icecream workers, jobs should then
+        # be sized to the pool rather than to the local cores
+        assert distributed in {None, *COMPILE_LAUNCHERS}
+        self.distributed = distributed
+
+        # phase durations are attributed to the package being built
+        self.metrics = metrics
+        self._package_name: str | None = None
+
+        # keep build trees between runs, re-extracting a package only when its
+        # tarball or patch changed and relying on incremental rebuilds. An
+        # installed package is kept while the fingerprint of its inputs, which
+        # chains those of the packages built before, is unchanged.
+        self.incremental = incremental
+
+        # packages FFmpeg links through stubs which load them on first use
+        self.lazy_libs = lazy_libs or set()
+
+        # share the staged files of package builds, keyed by the fingerprint
+        # of their inputs, each fingerprint chains the previous one
+        assert build_cache is None or (staged and not incremental)
+        self.build_cache = build_cache
+        self._fingerprint_chain = ""
+        self._compiler_versions: dict[str, str | None] = {}
+
+        # extracted and patched sources to copy instead of extracting tarballs
+        self.source_cache = source_cache and os.path.abspath(source_cache)
+
+        self.build_dir = os.path.abspath(build_dir)
         self.patch_dir = os.path.abspath("patches")
         self.source_dir = os.path.abspath("source")
 
@@ -90,28 +242,250 @@ class Builder:
             self._prefix(for_builder=for_builder), "var", "lib", "cibuildpkg"
         )
         installed_file = os.path.join(installed_dir, package.name)
-        if os.path.exists(installed_file):
+        fingerprint = (
+            self._fingerprint(package, for_builder=for_builder)
+            if self.build_cache or self.incremental
+            else None
+        )
+        if os.path.exists(installed_file) and not self.incremental:
             return
 
-        with log_group(f"build {package.name}"):
-            self._extract(package)
-            if package.name == "lamer":
-                self._build_lame(package, for_builder=for_builder)
-            elif package.name == "x265":
-                self._build_x265(package)
-            elif package.build_system == "cmake":
-                self._build_with_cmake(package, for_builder=for_builder)
-            elif package.build_system == "meson":
-                self._build_with_meson(package, for_builder=for_builder)
-            elif package.build_system == "make":
-                self._build_with_make(package, for_builder=for_builder)
+        files = None
+        usage = (
+            self.monitor.track(package.name) if self.monitor else contextlib.nullcontext()
+        )
+        self._package_name = package.name
+        with log_group(f"build {package.name}"), usage:
+            if self.build_cache and self._restore_build(package, fingerprint, for_builder):
+                print("restored from the build cache")
             else:
-                self._build_with_autoconf(package, for_builder=for_builder)
+                if not self.incremental:
+                    self._extract(package)
+                elif (
+                    not self._update_sources(package)
+                    and os.path.exists(installed_file)
+                    and self._read_inputs_stamp(package) == fingerprint
+                ):
+                    print("inputs unchanged, keeping the installed package")
+                    if self.metrics:
+                        self.metrics.cache_lookup("build_tree", True)
+                    return
+                elif self.metrics:
+                    self.metrics.cache_lookup("build_tree", False)
+                if self.incremental:
+                    # an interrupted build must not be kept by the next run
+                    self._write_inputs_stamp(package, None)
+                if package.name == "ffmpeg" and self.lazy_libs:
+                    self._write_lazy_stubs(package)
+                if self.staged:
+                    shutil.rmtree(self._stage_dir(package), ignore_errors=True)
+                if package.name == "lamer":
+                    self._build_lame(package, for_builder=for_builder)
+                elif package.name == "x265":
+                    self._build_x265(package)
+                elif package.build_system == "cmake":
+                    self._build_with_cmake(package, for_builder=for_builder)
+                elif package.build_system == "meson":
+                    self._build_with_meson(package, for_builder=for_builder)
+                elif package.build_system == "make":
+                    self._build_with_make(package, for_builder=for_builder)
+                else:
+                    self._build_with_autoconf(package, for_builder=for_builder)
+                if self.staged:
+                    self._check_stage(package, for_builder=for_builder)
+                if package.name == "ffmpeg" and self.lazy_libs:
+                    self._unlink_lazy_stubs(package)
+                if self.build_cache:
+                    self.build_cache.save(
+                        fingerprint, self._stage_prefix(package, for_builder=for_builder)
+                    )
+                if self.incremental:
+                    self._write_inputs_stamp(package, fingerprint)
+            if self.staged:
+                files = self._assemble_stage(package, for_builder=for_builder)
 
-        # mark package as installed
+        # mark package as installed, recording its files when they are known
         os.makedirs(installed_dir, exist_ok=True)
         with open(installed_file, "w") as fp:
             fp.write("installed\n")
+            if files is not None:
+                fp.writelines(f"{name}\n" for name in files)
+
+    def installed_files(self, *, for_builder: bool = False) -> dict[str, list[str]]:
+        """
+        Returns the files recorded for each installed package, relative to the
+        prefix. Packages built without staging have no files recorded.
+        """
+        installed_dir = os.path.join(
+            self._prefix(for_builder=for_builder), "var", "lib", "cibuildpkg"
+        )
+        files = {}
+        if not os.path.exists(installed_dir):
+            return files
+        for name in sorted(os.listdir(installed_dir)):
+            with open(os.path.join(installed_dir, name)) as fp:
+                files[name] = fp.read().splitlines()[1:]
+        return files
+
+    def _stage_dir(self, package: Package) -> str:
+        return os.path.join(self.build_dir, "stage", package.name)
+
+    def _stage_prefix(self, package: Package, *, for_builder: bool) -> str:
+        """Returns where DESTDIR puts the prefix of a staged package."""
+        return self._stage_dir(package) + self._prefix(for_builder=for_builder)
+
+    def _fingerprint(self, package: Package, *, for_builder: bool) -> str:
+        """
+        Returns a hash of every input of a package build. Each fingerprint
+        includes the one of the package built before, since a build may use
+        any file installed earlier.
+        """
+        # where the compiler runs does not change its output
+        env = self._environment(package, for_builder=for_builder, launcher=False)
+        compilers = {}
+        for var, default in (("CC", "cc"), ("CXX", "c++")):
+            command = env.get(var, default)
+            if command not in self._compiler_versions:
+                try:
+                    self._compiler_versions[command] = subprocess.run(
+                        command.split() + ["--version"],
+                        check=True,
+                        capture_output=True,
+                        text=True,
+                    ).stdout
+                except (OSError, subprocess.CalledProcessError):
+                    self._compiler_versions[command] = None
+            compilers[var] = self._compiler_versions[command]
+
+        def file_sha256(path: str) -> str | None:
+            return store.file_sha256(path) if os.path.exists(path) else None
+
+        inputs = {
+            "package": asdict(package),
+            "patch": file_sha256(os.path.join(self.patch_dir, package.name + ".patch")),
+            "builder": {
+                "for_builder": for_builder,
+                "lazy_libs": sorted(self.lazy_libs) if package.name == "ffmpeg" else [],
+                "lazylib": (
+                    file_sha256(lazylib.__file__)
+                    if package.name == "ffmpeg" and self.lazy_libs
+                    else None
+                ),
+                "lto": self._uses_lto(package, for_builder=for_builder),
+                "march": self.march,
+                "pgo": self.pgo if package.name in self.pgo_packages else None,
+                "pgo_profile": (
+                    file_sha256(os.path.join(self.pgo_dir, package.name + ".profdata"))
+                    if self.pgo == "use" and package.name in self.pgo_packages
+                    else None
+                ),
+                "prefix": self._prefix(for_builder=for_builder),
+                "profiling": self.profiling,
+                "script": file_sha256(__file__),
+            },
+            "compilers": compilers,
+            "env": {var: env.get(var) for var in CONFIGURE_ENV},
+            "platform": {
+                "auditwheel_plat": os.environ.get("AUDITWHEEL_PLAT"),
+                "libc": platform.libc_ver(),
+                "machine": platform.machine(),
+                "macos": os.environ.get("MACOSX_DEPLOYMENT_TARGET"),
+                "system": platform.system(),
+            },
+            "previous": self._fingerprint_chain,
+        }
+        self._fingerprint_chain = hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode()
+        ).hexdigest()
+        return self._fingerprint_chain
+
+    def _restore_build(self, package: Package, fingerprint: str, for_builder: bool) -> bool:
+        assert self.build_cache is not None
+        shutil.rmtree(self._stage_dir(package), ignore_errors=True)
+        restored = self.build_cache.restore(
+            fingerprint, self._stage_prefix(package, for_builder=for_builder)
+        )
+        if self.metrics:
+            self.metrics.cache_lookup("build_cache", restored)
+        return restored
+
+    def _install_environment(
+        self, package: Package, env: dict[str, str]
+    ) -> dict[str, str]:
+        """
+        Returns the environment of the install step. For staged builds it
+        points DESTDIR, which make, cmake --install and ninja install all
+        honour, at the staging root of the package.
+        """
+        if not self.staged:
+            return env
+        return {**env, "DESTDIR": self._stage_dir(package)}
+
+    def _check_stage(self, package: Package, *, for_builder: bool) -> None:
+        """
+        Fails if a package installed nothing into its staging root, as when
+        its install step ignores DESTDIR and writes into the prefix directly.
+        """
+        stage_prefix = self._stage_prefix(package, for_builder=for_builder)
+        if not os.path.isdir(stage_prefix) or not os.listdir(stage_prefix):
+            raise RuntimeError(
+                f"{package.name} installed nothing into {stage_prefix}, "
+                "its install step may not honour DESTDIR"
+            )
+
+    def _assemble_stage(self, package: Package, *, for_builder: bool) -> list[str]:
+        """
+        Links the files a package installed into its staging root into the
+        prefix, and returns their paths relative to the prefix.
+
+        Files are hardlinked, or copied across filesystems. A file which an
+        earlier package installed with different contents is a conflict.
+        """
+        prefix = self._prefix(for_builder=for_builder)
+        stage_prefix = self._stage_prefix(package, for_builder=for_builder)
+        owners = {
+            name: owner
+            for owner, names in self.installed_files(for_builder=for_builder).items()
+            for name in names
+        }
+
+        # check for conflicts before the prefix is modified
+        files = []
+        for root, dirs, names in os.walk(stage_prefix):
+            dirs.sort()
+            # symbolic links to directories are linked, not walked
+            links = [name for name in dirs if os.path.islink(os.path.join(root, name))]
+            dirs[:] = [name for name in dirs if name not in links]
+            for name in sorted(names + links):
+                src = os.path.join(root, name)
+                rel = os.path.relpath(src, stage_prefix)
+                dest = os.path.join(prefix, rel)
+                if (
+                    os.path.lexists(dest)
+                    and owners.get(rel) != package.name
+                    and not _same_file(src, dest)
+                ):
+                    owner = owners.get(rel, "the prefix")
+                    raise RuntimeError(f"{package.name} conflicts with {owner}: {rel}")
+                files.append(rel)
+
+        for rel in files:
+            src = os.path.join(stage_prefix, rel)
+            dest = os.path.join(prefix, rel)
+            if os.path.lexists(dest):
+                if _same_file(src, dest):
+                    continue
+                # a rebuild of the package which installed it
+                os.unlink(dest)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dest)
+            else:
+                try:
+                    os.link(src, dest)
+                except OSError:
+                    shutil.copy2(src, dest)
+        return files
 
     def create_directories(self) -> None:
         # print debugging information
@@ -121,7 +495,7 @@ class Builder:
                 print(f" - {var}: {os.environ[var]}")
 
         # delete build directory
-        if os.path.exists(self.build_dir):
+        if os.path.exists(self.build_dir) and not self.incremental:
             shutil.rmtree(self.build_dir)
 
         # create directories
@@ -142,12 +516,12 @@ class Builder:
         package_source_path = os.path.join(package_path, package.source_dir)
 
         # Get environment and prefix
-        env = self._environment(for_builder=for_builder)
+        env = self._environment(package, for_builder=for_builder)
         prefix = self._prefix(for_builder=for_builder)
 
         # Build package
         with chdir(package_source_path):
-            make_command = ["make", "-j", "4"]
+            make_command = ["make", "-j", str(self.jobs)]
             install_command = ["make", "install"]
 
             # Add PREFIX to both make and install commands
@@ -160,8 +534,10 @@ class Builder:
             install_command.extend(package.build_arguments)
 
             # Run build and install
-            run(make_command, env=env)
-            run(install_command, env=env)
+            with self._phase("compile"):
+                run(make_command, env=env)
+            with self._phase("install"):
+                run(install_command, env=self._install_environment(package, env))
 
     def _build_lame(self, package: Package, for_builder: bool) -> None:
         # basswood-io/lamer builds libmp3lame with a plain Makefile. Build only
@@ -172,7 +548,7 @@ class Builder:
         package_source_path = os.path.join(
             self.build_dir, package.name, package.source_dir
         )
-        env = self._environment(for_builder=for_builder)
+        env = self._environment(package, for_builder=for_builder)
         prefix = self._prefix(for_builder=for_builder)
 
         make_vars: list[str] = []
@@ -188,11 +564,13 @@ class Builder:
             make_vars.append("PIC=1")
 
         with chdir(package_source_path):
-            run(["make", "-j", "4", "lib", *make_vars], env=env)
-            run(
-                ["make", "install", f"PREFIX={self._mangle_path(prefix)}", *make_vars],
-                env=env,
-            )
+            with self._phase("compile"):
+                run(["make", "-j", str(self.jobs), "lib", *make_vars], env=env)
+            with self._phase("install"):
+                run(
+                    ["make", "install", f"PREFIX={self._mangle_path(prefix)}", *make_vars],
+                    env=self._install_environment(package, env),
+                )
 
     def _build_with_autoconf(self, package: Package, for_builder: bool) -> None:
         assert package.build_system == "autoconf"
@@ -201,21 +579,16 @@ class Builder:
         package_build_path = os.path.join(package_path, package.build_dir)
 
         # update config.guess and config.sub
-        config_files = ("config.guess", "config.sub")
-        for root, dirs, files in os.walk(package_path):
-            for name in filter(lambda x: x in config_files, files):
-                script_path = os.path.join(root, name)
-                cache_path = os.path.join(self.source_dir, name)
-                if not os.path.exists(cache_path):
-                    fetch(
-                        f"https://raw.githubusercontent.com/gcc-mirror/gcc/refs/heads/master/{name}",
-                        cache_path,
-                    )
-                shutil.copy(cache_path, script_path)
-                os.chmod(script_path, 0o755)
+        for script_path in find_config_scripts(package_path):
+            name = os.path.basename(script_path)
+            cache_path = os.path.join(self.source_dir, name)
+            if not os.path.exists(cache_path):
+                fetch(config_script_urls[name], cache_path, metrics=self.metrics)
+            shutil.copy(cache_path, script_path)
+            os.chmod(script_path, 0o755)
 
         # determine configure arguments
-        env = self._environment(for_builder=for_builder)
+        env = self._environment(package, for_builder=for_builder)
         prefix = self._prefix(for_builder=for_builder)
         configure_args = [
             "--disable-static",
@@ -225,9 +598,9 @@ class Builder:
         ]
 
         if package.name == "x264":
-            # Disable asm on Windows ARM64 (no nasm available)
             if platform.system() == "Windows" and platform.machine().lower() in {"arm64", "aarch64"}:
-                configure_args.append("--disable-asm")
+                # the assembly is kept: on aarch64 x264's configure assembles
+                # with $CC, whose integrated assembler needs no nasm
                 # Specify host to ensure correct resource compiler target
                 configure_args.append("--host=aarch64-w64-mingw32")
 
@@ -250,6 +623,31 @@ class Builder:
                     prepend_env(env, "CXXFLAGS", "-pthread")
                     prepend_env(env, "LDFLAGS", "-pthread")
 
+        # keep debug info until build-ffmpeg.py splits it off
+        build_arguments = package.build_arguments
+        if self.profiling and not for_builder:
+            if package.name == "ffmpeg":
+                configure_args.append("--disable-stripping")
+            build_arguments = [a for a in build_arguments if a != "--enable-strip"]
+
+        # FFmpeg's configure ignores CC and CXX, wrap the compilers it is given
+        if package.name == "ffmpeg" and self.distributed:
+            compilers = {"--cc": env["CC"], "--cxx": env["CXX"]}
+            for arg in build_arguments:
+                option, _, value = arg.partition("=")
+                if option in compilers:
+                    compilers[option] = f"{self.distributed} {value}"
+            build_arguments = [
+                a for a in build_arguments if a.partition("=")[0] not in compilers
+            ] + [f"{option}={value}" for option, value in compilers.items()]
+
+        if package.name == "ffmpeg" and self._uses_lto(package, for_builder=for_builder):
+            # FFmpeg's configure picks the matching archiver and disables
+            # inline asm constructs which LTO cannot handle
+            configure_args.append(
+                "--enable-lto=thin" if self._is_clang(env) else "--enable-lto"
+            )
+
         if package.name == "ffmpeg" and platform.system() == "Windows":
             prepend_env(env, "LDFLAGS", "-LC:/PROGRA~1/OpenSSL/lib")
             prepend_env(
@@ -277,17 +675,19 @@ class Builder:
         # build package
         os.makedirs(package_build_path, exist_ok=True)
         with chdir(package_build_path):
-            run(
+            self._configure(
                 [
                     "sh",
                     self._mangle_path(os.path.join(package_source_path, "configure")),
                 ]
                 + configure_args
-                + package.build_arguments,
+                + build_arguments,
                 env=env,
             )
-            run(["make", "-j", "4", "V=1"], env=env)
-            run(["make", "install"], env=env)
+            with self._phase("compile"):
+                run(["make", "-j", str(self.jobs), "V=1"], env=env)
+            with self._phase("install"):
+                run(["make", "install"], env=self._install_environment(package, env))
 
     def _build_with_cmake(self, package: Package, for_builder: bool) -> None:
         assert package.build_system == "cmake"
@@ -296,7 +696,7 @@ class Builder:
         package_build_path = os.path.join(package_path, package.build_dir)
 
         # determine cmake arguments
-        env = self._environment(for_builder=for_builder)
+        env = self._environment(package, for_builder=for_builder)
         prefix = self._prefix(for_builder=for_builder)
         cmake_args = [
             "-GUnix Makefiles",
@@ -308,6 +708,17 @@ class Builder:
         if platform.system() == "Darwin":
             cmake_args.append("-DCMAKE_INSTALL_NAME_DIR=" + os.path.join(prefix, "lib"))
 
+        # static archives of LTO objects need an archiver which understands them,
+        # CMake ignores the AR and RANLIB environment variables
+        for var in ("AR", "RANLIB"):
+            if var in env and self._uses_lto(package, for_builder=for_builder):
+                cmake_args.append(f"-DCMAKE_{var}={shutil.which(env[var])}")
+
+        # CMake takes the wrapper as a launcher, see _environment
+        if self.distributed:
+            for lang in ("C", "CXX"):
+                cmake_args.append(f"-DCMAKE_{lang}_COMPILER_LAUNCHER={self.distributed}")
+
         if package.name == "srt" and platform.system() == "Linux":
             if platform.libc_ver()[0] == "glibc":
                 run(["yum", "-y", "install", "openssl-devel"])
@@ -317,12 +728,17 @@ class Builder:
         # build package
         os.makedirs(package_build_path, exist_ok=True)
         with chdir(package_build_path):
-            run(
+            self._configure(
                 ["cmake", package_source_path] + cmake_args + package.build_arguments,
                 env=env,
             )
-            run(["cmake", "--build", ".", "--verbose", "-j", "4"], env=env)
-            run(["cmake", "--install", "."], env=env)
+            with self._phase("compile"):
+                run(["cmake", "--build", ".", "--verbose", "-j", str(self.jobs)], env=env)
+            with self._phase("install"):
+                run(
+                    ["cmake", "--install", "."],
+                    env=self._install_environment(package, env),
+                )
 
     def _build_with_meson(self, package: Package, for_builder: bool) -> None:
         assert package.build_system == "meson"
@@ -331,19 +747,22 @@ class Builder:
         package_build_path = os.path.join(package_path, package.build_dir)
 
         # determine meson arguments
-        env = self._environment(for_builder=for_builder)
+        env = self._environment(package, for_builder=for_builder)
         prefix = self._prefix(for_builder=for_builder)
         meson_args = ["--libdir=lib", "--prefix=" + prefix]
 
         # build package
         os.makedirs(package_build_path, exist_ok=True)
         with chdir(package_build_path):
-            run(
+            self._configure(
                 ["meson", package_source_path] + meson_args + package.build_arguments,
                 env=env,
+                reconfigure=["--reconfigure"],
             )
-            run(["ninja", "--verbose"], env=env)
-            run(["ninja", "install"], env=env)
+            with self._phase("compile"):
+                run(["ninja", "--verbose", "-j", str(self.jobs)], env=env)
+            with self._phase("install"):
+                run(["ninja", "install"], env=self._install_environment(package, env))
 
     def _build_x265(self, package: Package) -> None:
         assert package.name == "x265"
@@ -360,17 +779,31 @@ class Builder:
         # builds in dummy directory
         dummy_install_path = os.path.join(package_path, "dummy_install_path")
 
-        # For 10/12 bits version, only x86_64 has assembly instructions available
+        # For 10/12 bits version, only x86_64 and aarch64 have assembly
+        # instructions available. On aarch64 enable the extensions the toolchain
+        # can assemble, x265 picks kernels from the CPU features at runtime.
+        flags = []
         flags_high_bits = []
 
-        disable_sve = platform.system() == "Linux" and platform.machine() == "aarch64"
-        if platform.machine() not in {"x86_64", "amd64"}:
+        machine = platform.machine().lower()
+        if machine in {"aarch64", "arm64"} and platform.system() != "Windows":
+            env = self._environment(package, for_builder=False)
+            features = self._probe_aarch64_assembler(env)
+            # still disabled until they are verified: SVE2, and SVE and high
+            # bit depth assembly on macOS
+            flags.append("-DENABLE_SVE2=OFF")
+            if platform.system() == "Darwin":
+                features.discard("sve")
+                flags_high_bits.append("-DENABLE_ASSEMBLY=0")
+                flags_high_bits.append("-DENABLE_ALTIVEC=0")
+            elif "neon" not in features:
+                flags_high_bits.append("-DENABLE_ASSEMBLY=0")
+            if "sve" not in features:
+                flags.append("-DENABLE_SVE=OFF")
+        elif machine not in {"x86_64", "amd64"}:
             flags_high_bits.append("-DENABLE_ASSEMBLY=0")
             flags_high_bits.append("-DENABLE_ALTIVEC=0")
 
-            if disable_sve:
-                flags_high_bits.append("-DENABLE_SVE2=OFF")
-
         x265_12bits = replace(
             package,
             build_dir="x265-12bits",
@@ -382,6 +815,7 @@ class Builder:
                 "-DENABLE_SHARED=0",
                 "-DCMAKE_INSTALL_PREFIX=" + dummy_install_path,
                 *flags_high_bits,
+                *flags,
             ],
         )
         self._build_with_cmake(package=x265_12bits, for_builder=False)
@@ -396,6 +830,7 @@ class Builder:
                 "-DENABLE_SHARED=0",
                 "-DCMAKE_INSTALL_PREFIX=" + dummy_install_path,
                 *flags_high_bits,
+                *flags,
             ],
         )
         self._build_with_cmake(package=x265_10bits, for_builder=False)
@@ -411,11 +846,249 @@ class Builder:
             "-DLINKED_10BIT=1",
             "-DLINKED_12BIT=1",
             "-DEXTRA_LINK_FLAGS=-L../x265-10bits -L../x265-12bits",
-        ] + (["-DENABLE_SVE2=OFF"] if disable_sve else [])
+        ] + flags
         self._build_with_cmake(package=package, for_builder=False)
 
+    def _probe_aarch64_assembler(self, env: dict[str, str]) -> set[str]:
+        """
+        Returns the aarch64 extensions ("neon", "sve") the compiler can
+        assemble.
+        """
+        probes = {
+            "neon": ("armv8-a", "add v0.4s, v0.4s, v0.4s"),
+            "sve": ("armv8.2-a+sve", "ptrue p0.b"),
+        }
+        cc = env.get("CC", "cc").split()
+        cflags = env.get("CPPFLAGS", "").split() + env.get("CFLAGS", "").split()
+        features = set()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "probe.S")
+            for feature, (march, instruction) in probes.items():
+                with open(source, "w") as fp:
+                    fp.write(instruction + "\n")
+                result = subprocess.run(
+                    cc
+                    + cflags
+                    + [f"-march={march}", "-c", source, "-o", source + ".o"],
+                    env=env,
+                    capture_output=True,
+                )
+                if result.returncode == 0:
+                    features.add(feature)
+        print(f"aarch64 assembler supports: {', '.join(sorted(features)) or 'none'}")
+        return features
+
+    def extract(self, packages: list[Package]) -> None:
+        """
+        Extracts and patches the sources of packages concurrently.
+        """
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            for future in [executor.submit(self._extract, package) for package in packages]:
+                future.result()
+
+    def _phase(self, phase: str, package_name: str | None = None):
+        """
+        Returns a context manager which records the duration of a phase of
+        the current package build.
+        """
+        package_name = package_name or self._package_name
+        if self.metrics is None or package_name is None:
+            return contextlib.nullcontext()
+        return self.metrics.phase(package_name, phase)
+
+    def _lazy_dir(self) -> str:
+        return os.path.join(self.build_dir, "lazy")
+
+    def _write_lazy_stubs(self, package: Package) -> None:
+        """
+        Generates stub archives for the libraries of self.lazy_libs, and
+        pkg-config files which point FFmpeg at them.
+        """
+        env = self._environment(package, for_builder=False)
+        pkgconfig_dir = os.path.join(self._prefix(for_builder=False), "lib", "pkgconfig")
+        lib_dir = os.path.join(self._lazy_dir(), "lib")
+        stub_pkgconfig_dir = os.path.join(self._lazy_dir(), "pkgconfig")
+        os.makedirs(lib_dir, exist_ok=True)
+        os.makedirs(stub_pkgconfig_dir, exist_ok=True)
+
+        machine = {"amd64": "x86_64", "arm64": "aarch64"}.get(
+            platform.machine().lower(), platform.machine().lower()
+        )
+        for name in sorted(self.lazy_libs):
+            for module in lazy_libraries[name]:
+                pc_file = os.path.join(pkgconfig_dir, module + ".pc")
+                if not os.path.exists(pc_file):
+                    continue
+                stubs = {}
+                for lib in lazylib.linked_libraries(pc_file):
+                    library = os.path.join(os.path.dirname(pkgconfig_dir), f"lib{lib}.so")
+                    if not os.path.exists(library):
+                        continue
+                    stubs[lib] = f"{lib}_lazy"
+                    exports = lazylib.write_stub_archive(
+                        library,
+                        os.path.join(lib_dir, f"lib{lib}_lazy.a"),
+                        machine=machine,
+                        env=env,
+                        failures=lazy_library_failures,
+                    )
+                    print(
+                        f"{exports.soname}: {len(exports.functions)} functions "
+                        f"loaded lazily, {len(exports.data)} data symbols not forwarded"
+                    )
+                lazylib.write_stub_pkgconfig(pc_file, stub_pkgconfig_dir, lib_dir, stubs)
+
+    def _unlink_lazy_stubs(self, package: Package) -> None:
+        """
+        Removes the stub archives from the pkg-config files FFmpeg installed,
+        which would otherwise point into the build directory, and lists the
+        lazily loaded libraries in lib/lazy-libraries.txt.
+        """
+        prefix = (
+            self._stage_prefix(package, for_builder=False)
+            if self.staged
+            else self._prefix(for_builder=False)
+        )
+        pkgconfig_dir = os.path.join(prefix, "lib", "pkgconfig")
+        lib_dir = os.path.join(self._lazy_dir(), "lib")
+        for name in sorted(os.listdir(pkgconfig_dir)):
+            if name.endswith(".pc"):
+                lazylib.unlink_stubs_from_pkgconfig(
+                    os.path.join(pkgconfig_dir, name), lib_dir
+                )
+
+        # they are not in DT_NEEDED, so wheel repair tools only bundle them
+        # if the wheel links them some other way, see setup.py
+        libraries = sorted(
+            name[len("lib") : -len("_lazy.a")]
+            for name in os.listdir(lib_dir)
+            if name.startswith("lib") and name.endswith("_lazy.a")
+        )
+        with open(os.path.join(prefix, "lib", "lazy-libraries.txt"), "w") as fp:
+            fp.writelines(f"{name}\n" for name in libraries)
+
+    def _configure(
+        self,
+        command: list[str],
+        env: dict[str, str],
+        *,
+        reconfigure: list[str] | None = None,
+    ) -> None:
+        """
+        Runs a configure step in the current directory. In incremental mode
+        the step is skipped if it last ran with the same arguments, and the
+        reconfigure arguments are added when it ran before with others.
+        """
+        stamp_path = ".cibuildpkg-configure"
+        stamp = json.dumps([command, {var: env.get(var) for var in CONFIGURE_ENV}])
+        configured = os.path.exists(stamp_path)
+        if configured:
+            with open(stamp_path) as fp:
+                if self.incremental and fp.read() == stamp:
+                    print("configure arguments unchanged, skipping configure")
+                    if self.metrics:
+                        self.metrics.cache_lookup("configure", True)
+                    return
+            os.unlink(stamp_path)
+
+        if self.metrics and self.incremental:
+            self.metrics.cache_lookup("configure", False)
+        if configured and reconfigure:
+            command = command + reconfigure
+        with self._phase("configure"):
+            run(command, env=env)
+        with open(stamp_path, "w") as fp:
+            fp.write(stamp)
+
+    def _inputs_stamp_path(self, package: Package) -> str:
+        return os.path.join(self.build_dir, ".stamps", package.name + ".inputs")
+
+    def _read_inputs_stamp(self, package: Package) -> str | None:
+        try:
+            with open(self._inputs_stamp_path(package)) as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_inputs_stamp(self, package: Package, fingerprint: str | None) -> None:
+        path = self._inputs_stamp_path(package)
+        if fingerprint is None:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            fp.write(fingerprint)
+
+    def _update_sources(self, package: Package) -> bool:
+        """
+        Brings the extracted sources of a package up to date with its tarball
+        and patch, and returns whether anything changed.
+
+        A changed patch is swapped in place, so only the files it touches are
+        rebuilt. If the old patch does not reverse cleanly, or the tarball
+        changed, the sources are extracted again.
+        """
+        path = os.path.join(self.build_dir, package.name)
+        stamp_dir = os.path.join(self.build_dir, ".stamps")
+        stamp_path = os.path.join(stamp_dir, package.name + ".json")
+        applied_patch = os.path.join(stamp_dir, package.name + ".patch")
+        patch = os.path.join(self.patch_dir, package.name + ".patch")
+
+        def read(path: str) -> bytes | None:
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as fp:
+                return fp.read()
+
+        stamp = json.dumps(
+            {"sha256": package.sha256, "source_url": package.source_url}
+        ).encode()
+        old_patch, new_patch = read(applied_patch), read(patch)
+        if read(stamp_path) == stamp and os.path.exists(path):
+            if old_patch == new_patch:
+                return False
+            try:
+                if old_patch is not None:
+                    run(["patch", "-R", "-d", path, "-i", applied_patch, "-p1"])
+                    os.unlink(applied_patch)
+                if new_patch is not None:
+                    run(["patch", "-d", path, "-i", patch, "-p1"])
+                    shutil.copyfile(patch, applied_patch)
+                return True
+            except subprocess.CalledProcessError:
+                print("patch does not apply in place, extracting again")
+
+        if os.path.exists(stamp_path):
+            os.unlink(stamp_path)
+        shutil.rmtree(path, ignore_errors=True)
+        self._extract(package)
+        os.makedirs(stamp_dir, exist_ok=True)
+        if new_patch is not None:
+            shutil.copyfile(patch, applied_patch)
+        elif os.path.exists(applied_patch):
+            os.unlink(applied_patch)
+        with open(stamp_path, "wb") as fp:
+            fp.write(stamp)
+        return True
+
     def _extract(self, package: Package) -> None:
+        with self._phase("extract", package.name):
+            self._extract_sources(package)
+
+    def _extract_sources(self, package: Package) -> None:
         path = os.path.join(self.build_dir, package.name)
+        cached = self.source_cache and os.path.exists(
+            os.path.join(self.source_cache, package.name)
+        )
+        if self.source_cache and self.metrics:
+            self.metrics.cache_lookup("source_cache", bool(cached))
+        if cached:
+            shutil.copytree(
+                os.path.join(self.source_cache, package.name), path, symlinks=True
+            )
+            return
+
         patch = os.path.join(self.patch_dir, package.name + ".patch")
         tarball = os.path.join(
             self.source_dir,
@@ -445,7 +1118,9 @@ class Builder:
         if os.path.exists(patch):
             run(["patch", "-d", path, "-i", patch, "-p1"])
 
-    def _environment(self, *, for_builder: bool) -> dict[str, str]:
+    def _environment(
+        self, package: Package, *, for_builder: bool, launcher: bool = True
+    ) -> dict[str, str]:
         env = os.environ.copy()
 
         # Reproducible builds: zero out embedded timestamps from __DATE__/__TIME__
@@ -481,6 +1156,15 @@ class Builder:
             separator=pkg_config_sep,
         )
 
+        # stubs of lazily loaded libraries take precedence for FFmpeg
+        if package.name == "ffmpeg" and self.lazy_libs:
+            prepend_env(
+                env,
+                "PKG_CONFIG_PATH",
+                os.path.join(self._lazy_dir(), "pkgconfig"),
+                separator=pkg_config_sep,
+            )
+
         if platform.system() == "Darwin" and not for_builder:
             arch_flags = os.environ["ARCHFLAGS"]
             for var in ["CFLAGS", "CXXFLAGS", "LDFLAGS"]:
@@ -492,8 +1176,107 @@ class Builder:
             env["RC"] = "llvm-windres"
             env["WINDRES"] = "llvm-windres"
 
+        # tune compiled C code for an ISA level, hand-written assembly keeps
+        # its own runtime dispatch
+        if self.march and not for_builder:
+            for var in ["CFLAGS", "CXXFLAGS"]:
+                prepend_env(env, var, f"-march={self.march}")
+
+        # frame pointers for usable perf stacks, debug info is split off
+        # before stripping and does not change the generated code
+        if self.profiling and not for_builder:
+            flags = "-g -fno-omit-frame-pointer"
+            if platform.machine().lower() in {"x86_64", "amd64", "aarch64", "arm64"}:
+                flags += " -mno-omit-leaf-frame-pointer"
+            for var in ["CFLAGS", "CXXFLAGS"]:
+                prepend_env(env, var, flags)
+
+        # FFmpeg enables LTO through its own configure flag
+        if package.name != "ffmpeg" and self._uses_lto(package, for_builder=for_builder):
+            self._add_lto_flags(env)
+
+        if self.pgo and package.name in self.pgo_packages and not for_builder:
+            self._add_pgo_flags(env, package)
+
+        # preprocessing stays local, so SOURCE_DATE_EPOCH and the include
+        # paths apply as before, and linking with the flags above is local too
+        if self.distributed and launcher and package.build_system != "cmake":
+            for var, default in (("CC", "cc"), ("CXX", "c++")):
+                env[var] = f"{self.distributed} {env.get(var, default)}"
+
         return env
 
+    def _add_lto_flags(self, env: dict[str, str]) -> None:
+        if self._is_clang(env):
+            # ThinLTO keeps link times and memory usage close to regular builds
+            flags = "-flto=thin"
+            tools = {"AR": "llvm-ar", "NM": "llvm-nm", "RANLIB": "llvm-ranlib"}
+        else:
+            flags = "-flto=auto"
+            tools = {"AR": "gcc-ar", "NM": "gcc-nm", "RANLIB": "gcc-ranlib"}
+        for var in ["CFLAGS", "CXXFLAGS", "LDFLAGS"]:
+            prepend_env(env, var, flags)
+
+        # static archives of LTO objects need a symbol index built by the
+        # compiler's plugin, Apple's ar and ranlib handle this natively
+        if platform.system() != "Darwin":
+            for var, tool in tools.items():
+                if shutil.which(tool):
+                    env[var] = tool
+
+    def _add_pgo_flags(self, env: dict[str, str], package: Package) -> None:
+        profile_path = os.path.join(self.pgo_dir, package.name)
+        if self.pgo == "generate":
+            # codecs run multithreaded, keep the counters consistent
+            flags = f"-fprofile-generate={profile_path} -fprofile-update=atomic"
+        elif self._is_clang(env):
+            flags = (
+                f"-fprofile-use={profile_path}.profdata"
+                " -Wno-profile-instr-unprofiled -Wno-profile-instr-out-of-date"
+            )
+        else:
+            # code the training workload does not reach is optimized as usual
+            flags = (
+                f"-fprofile-use={profile_path} -fprofile-partial-training"
+                " -Wno-missing-profile"
+            )
+        for var in ["CFLAGS", "CXXFLAGS", "LDFLAGS"]:
+            prepend_env(env, var, flags)
+
+    def merge_pgo_profiles(self) -> None:
+        """
+        Merges the raw profiles written by the training workload.
+
+        GCC reads its .gcda files directly, clang needs them merged into
+        one .profdata file per package.
+        """
+        env = os.environ
+        if not self._is_clang(env):
+            return
+
+        if platform.system() == "Darwin":
+            profdata = ["xcrun", "llvm-profdata"]
+        else:
+            cc_dir = os.path.dirname(shutil.which(env.get("CC", "clang")) or "")
+            profdata = [shutil.which("llvm-profdata", path=cc_dir) or "llvm-profdata"]
+
+        for name in sorted(self.pgo_packages):
+            profile_path = os.path.join(self.pgo_dir, name)
+            raw_profiles = sorted(glob.glob(os.path.join(profile_path, "*.profraw")))
+            if not raw_profiles:
+                raise RuntimeError(f"No profiles were written for {name}")
+            run(profdata + ["merge", "-o", profile_path + ".profdata"] + raw_profiles)
+
+    def _is_clang(self, env: dict[str, str]) -> bool:
+        if platform.system() == "Darwin":
+            return True
+        if platform.system() == "Windows" and platform.machine().lower() in {"arm64", "aarch64"}:
+            return True
+        command = env.get("CC", "cc").split()
+        if len(command) > 1 and command[0] in COMPILE_LAUNCHERS:
+            command = command[1:]
+        return "clang" in os.path.basename(command[0])
+
     def _mangle_path(self, path: str) -> str:
         if platform.system() == "Windows":
             path = path.replace(os.path.sep, "/")
@@ -501,6 +1284,9 @@ class Builder:
                 path = f"/{path[0].lower()}{path[2:]}"
         return path
 
+    def _uses_lto(self, package: Package, *, for_builder: bool) -> bool:
+        return self.lto and package.lto and not for_builder
+
     def _prefix(self, *, for_builder: bool) -> str:
         if for_builder:
             return self._builder_dest_dir
@@ -0,0 +1,173 @@
+# Runs a pool of compile workers on this machine, to try --distributed
+#
+# distcc: several distccd daemons on consecutive ports, which DISTCC_HOSTS
+# lists so that compile jobs go over TCP exactly as they would to other
+# machines. icecream: a scheduler and one iceccd, since iceccd listens on a
+# fixed port. The environment for the build is printed, and written to
+# --env-file, then the daemons run until interrupted.
+
+import argparse
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+DISTCC_PORT = 3632
+ICECC_SCHEDULER_PORT = 8765
+ICECC_DAEMON_PORT = 10245
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with status {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{process.args[0]} does not listen on port {port}")
+            time.sleep(0.1)
+
+
+def start_distcc(
+    processes: list[subprocess.Popen], workers: int, slots: int, port: int, log_dir: str
+) -> dict[str, str]:
+    # distcc 3.3 only runs whitelisted compilers unless told otherwise,
+    # which is fine for daemons only reachable from this machine
+    usage = subprocess.run(["distccd", "--help"], capture_output=True, text=True)
+    insecure = ["--enable-tcp-insecure"] if "tcp-insecure" in usage.stdout + usage.stderr else []
+
+    hosts = []
+    for i in range(workers):
+        process = subprocess.Popen(
+            [
+                "distccd",
+                "--daemon",
+                "--no-detach",
+                "--listen",
+                "127.0.0.1",
+                "--allow",
+                "127.0.0.1",
+                "--port",
+                str(port + i),
+                "--jobs",
+                str(slots),
+                "--log-file",
+                os.path.join(log_dir, f"distccd-{port + i}.log"),
+                *insecure,
+            ]
+        )
+        processes.append(process)
+        wait_for_port(port + i, process)
+        # 127.0.0.1 rather than localhost, which distcc runs in-process
+        hosts.append(f"127.0.0.1:{port + i}/{slots}")
+    return {"DISTCC_HOSTS": " ".join(hosts)}
+
+
+def start_icecc(processes: list[subprocess.Popen], slots: int, log_dir: str) -> dict[str, str]:
+    netname = f"compile-pool-{os.getpid()}"
+    scheduler = subprocess.Popen(
+        [
+            "icecc-scheduler",
+            "-n",
+            netname,
+            "-p",
+            str(ICECC_SCHEDULER_PORT),
+            "-l",
+            os.path.join(log_dir, "icecc-scheduler.log"),
+        ]
+    )
+    processes.append(scheduler)
+    wait_for_port(ICECC_SCHEDULER_PORT, scheduler)
+    daemon = subprocess.Popen(
+        [
+            "iceccd",
+            "-s",
+            "127.0.0.1",
+            "-n",
+            netname,
+            "-m",
+            str(slots),
+            "-b",
+            os.path.join(log_dir, "icecc-envs"),
+            "-l",
+            os.path.join(log_dir, "iceccd.log"),
+        ]
+    )
+    processes.append(daemon)
+    wait_for_port(ICECC_DAEMON_PORT, daemon)
+    # icecc sends jobs through the local iceccd, which needs no environment
+    return {}
+
+
+def stop(processes: list[subprocess.Popen]) -> None:
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser("compile-pool")
+    parser.add_argument("launcher", choices=["distcc", "icecc"])
+    parser.add_argument(
+        "--workers", type=int, help="number of distccd daemons (default: 3)"
+    )
+    parser.add_argument(
+        "--slots", type=int, default=2, help="compile jobs per daemon (default: 2)"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DISTCC_PORT, help="port of the first distccd"
+    )
+    parser.add_argument("--log-dir", default=os.path.join("build", "compile-pool"))
+    parser.add_argument("--env-file", help="write the environment as shell exports")
+    args = parser.parse_args()
+
+    if args.launcher == "icecc" and args.workers not in {None, 1}:
+        parser.error("icecc runs a single iceccd per machine")
+    workers = args.workers or (3 if args.launcher == "distcc" else 1)
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    # terminate the daemons on SIGTERM as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    processes: list[subprocess.Popen] = []
+    try:
+        if args.launcher == "distcc":
+            env = start_distcc(processes, workers, args.slots, args.port, args.log_dir)
+        else:
+            env = start_icecc(processes, args.slots, args.log_dir)
+
+        exports = "".join(f"export {name}={shlex.quote(value)}\n" for name, value in env.items())
+        if args.env_file:
+            with open(args.env_file, "w") as fp:
+                fp.write(exports)
+        print(exports, end="")
+        print(
+            f"# {workers * args.slots} slots, build with "
+            f"--distributed {args.launcher} --jobs {workers * args.slots}",
+            flush=True,
+        )
+
+        # the pool is only useful while every daemon runs
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        failed = next(process for process in processes if process.poll() is not None)
+        raise RuntimeError(f"{failed.args[0]} exited with status {failed.returncode}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop(processes)
+
+
+if __name__ == "__main__":
+    main()
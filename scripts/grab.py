@@ -1,20 +1,17 @@
+import argparse
 import concurrent.futures
 import os
 import subprocess
-import hashlib
 
-from pkg import all_packages
+from pkg import Package, all_packages
 from cibuildpkg import fetch
+from metrics import BuildMetrics
+from store import file_sha256
 
-def calculate_sha256(filename: str) -> str:
-    sha256_hash = hashlib.sha256()
-    with open(filename, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
 
-
-def download_and_verify_package(package: Package) -> None:
+def download_and_verify_package(
+    package: Package, metrics: BuildMetrics | None = None
+) -> None:
     tarball = os.path.join(
         os.path.abspath("source"),
         package.source_filename or package.source_url.split("/")[-1],
@@ -22,14 +19,14 @@ def download_and_verify_package(package: Package) -> None:
 
     if not os.path.exists(tarball):
         try:
-            fetch(package.source_url, tarball)
+            fetch(package.source_url, tarball, package.sha256, metrics=metrics)
         except subprocess.CalledProcessError:
             pass
 
     if not os.path.exists(tarball):
         raise ValueError(f"tar bar doesn't exist: {tarball}")
 
-    sha = calculate_sha256(tarball)
+    sha = file_sha256(tarball)
     if package.sha256 == sha:
         print(f"{package.name} tarball: hashes match")
     else:
@@ -38,10 +35,12 @@ def download_and_verify_package(package: Package) -> None:
         )
 
 
-def download_tars(packages: list[Package]) -> None:
+def download_tars(
+    packages: list[Package], metrics: BuildMetrics | None = None
+) -> None:
     with concurrent.futures.ThreadPoolExecutor() as executor:
         future_to_package = {
-            executor.submit(download_and_verify_package, package): package.name
+            executor.submit(download_and_verify_package, package, metrics): package.name
             for package in packages
         }
 
@@ -54,8 +53,18 @@ def download_tars(packages: list[Package]) -> None:
                 raise
 
 def main():
+    parser = argparse.ArgumentParser("grab")
+    parser.add_argument(
+        "--metrics-output",
+        help="write download metrics in OpenMetrics text format",
+    )
+    args = parser.parse_args()
+
+    metrics = BuildMetrics() if args.metrics_output else None
     os.makedirs(os.path.abspath("source"), exist_ok=True)
-    download_tars(all_packages)
+    download_tars(all_packages, metrics)
+    if metrics:
+        metrics.write(args.metrics_output)
 
 if __name__ == "__main__":
     main()
@@ -34,8 +34,19 @@ c8541b2d36f0fd8f13ddabe1292b6fb7550a742e76e0f1f70fb29fcee073be4a  static-clang-l
 b311137f955b55139b02e8c1d7ec259628404a0563d136df7a817a33784bd2bf  static-clang-linux-riscv64.tar.xz
 de74fd8e5de244d36398684b2afa67add2311df6ccfa24f3c08a1d777ca814fa  static-clang-linux-s390x.tar.xz
 EOF
-curl -fsSLO "${STATIC_CLANG_URL}"
+# STATIC_CLANG_CACHE names a directory where the download is kept between runs
+STATIC_CLANG_CACHED="${STATIC_CLANG_CACHE:-}/static-clang-${STATIC_CLANG_VERSION}-${GO_ARCH}.tar.xz"
+if [ "${STATIC_CLANG_CACHE:-}" != "" ] && [ -f "${STATIC_CLANG_CACHED}" ]; then
+	cp "${STATIC_CLANG_CACHED}" "${STATIC_CLANG_FILENAME}"
+else
+	curl -fsSLO "${STATIC_CLANG_URL}"
+fi
 sha256sum -c "${STATIC_CLANG_FILENAME}.sha256"
+if [ "${STATIC_CLANG_CACHE:-}" != "" ] && [ ! -f "${STATIC_CLANG_CACHED}" ]; then
+	mkdir -p "${STATIC_CLANG_CACHE}"
+	cp "${STATIC_CLANG_FILENAME}" "${STATIC_CLANG_CACHED}.tmp"
+	mv "${STATIC_CLANG_CACHED}.tmp" "${STATIC_CLANG_CACHED}"
+fi
 tar -C /opt -xf "${STATIC_CLANG_FILENAME}"
 popd
 
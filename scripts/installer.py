@@ -0,0 +1,234 @@
+# Installs an FFmpeg artifact produced by build-ffmpeg.py
+#
+# The artifact is fetched, or taken from the download cache, and unpacked once
+# per version into <cache>/trees/<hash of the manifest>. Every file is checked
+# against the manifest written next to the tarball. Installs then hardlink the
+# verified tree into the destination, skipping files which are already there.
+#
+# Files in the cache are read-only, since installed files share their inode.
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import urllib.request
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyav-ffmpeg")
+
+
+def _is_url(location: str) -> bool:
+    return location.startswith(("http://", "https://"))
+
+
+def manifest_location(artifact: str) -> str:
+    """Returns where build-ffmpeg.py writes the manifest of an artifact."""
+    assert artifact.endswith(".tar.gz"), artifact
+    return artifact[: -len(".tar.gz")] + ".manifest.json"
+
+
+def fetch(location: str, cache_dir: str) -> str:
+    """
+    Returns a local path for location, downloading URLs into the cache unless
+    they are already there.
+    """
+    if not _is_url(location):
+        return location
+
+    key = hashlib.sha256(location.encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, "downloads", f"{key}-{location.split('/')[-1]}")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fp, urllib.request.urlopen(location) as response:
+                shutil.copyfileobj(response, fp)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    return path
+
+
+def read_manifest(path: str) -> tuple[str, dict[str, dict]]:
+    """Returns the hash of a manifest, which identifies the tree, and its files."""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    return hashlib.sha256(data).hexdigest(), json.loads(data)["files"]
+
+
+def _write_file(name: str, path: str, data: bytes, entry: dict, mode: int) -> None:
+    if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+        raise ValueError(f"{name}: sha256 does not match the manifest")
+    with open(path, "wb") as fp:
+        fp.write(data)
+    os.chmod(path, mode & 0o555)
+
+
+def unpack(tarball: str, tree_dir: str, files: dict[str, dict], jobs: int) -> None:
+    """
+    Unpacks a tarball into tree_dir, verifying each file against the
+    manifest. The tarball is decompressed by this thread while files are
+    hashed and written concurrently.
+    """
+    seen = set()
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        pending: set[concurrent.futures.Future] = set()
+        with tarfile.open(tarball, "r|gz") as tar:
+            for info in tar:
+                entry = files.get(info.name)
+                if entry is None:
+                    raise ValueError(f"{info.name}: not in the manifest")
+                path = os.path.join(tree_dir, *info.name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if info.issym():
+                    if entry.get("link") != info.linkname:
+                        raise ValueError(f"{info.name}: link does not match the manifest")
+                    os.symlink(info.linkname, path)
+                elif info.isfile() and "sha256" in entry:
+                    fp = tar.extractfile(info)
+                    assert fp is not None
+                    pending.add(
+                        executor.submit(
+                            _write_file, info.name, path, fp.read(), entry, info.mode
+                        )
+                    )
+                else:
+                    raise ValueError(f"{info.name}: unexpected entry in the artifact")
+                seen.add(info.name)
+
+                # bound the amount of file contents held in memory
+                if len(pending) >= 2 * jobs:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        future.result()
+        for future in pending:
+            future.result()
+
+    missing = sorted(files.keys() - seen)
+    if missing:
+        raise ValueError(f"missing from the artifact: {', '.join(missing)}")
+
+
+def cached_tree(
+    tarball_location: str, manifest_path: str, cache_dir: str, jobs: int
+) -> tuple[str, dict[str, dict]]:
+    """
+    Returns the verified tree of an artifact and its manifest, unpacking the
+    artifact unless a previous install already did.
+    """
+    key, files = read_manifest(manifest_path)
+    tree_dir = os.path.join(cache_dir, "trees", key)
+    if os.path.isdir(tree_dir):
+        return tree_dir, files
+
+    tarball = fetch(tarball_location, cache_dir)
+    os.makedirs(os.path.dirname(tree_dir), exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(tree_dir), prefix=key + ".")
+    try:
+        unpack(tarball, temp_dir, files, jobs)
+    except BaseException:
+        shutil.rmtree(temp_dir)
+        raise
+    try:
+        os.rename(temp_dir, tree_dir)
+    except OSError:
+        # another install unpacked the same version concurrently
+        shutil.rmtree(temp_dir)
+        if not os.path.isdir(tree_dir):
+            raise
+    return tree_dir, files
+
+
+# a copy of store.file_sha256, as this module only uses the standard library
+# so that downstream projects can vendor it alone
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(2**20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _install_file(tree_dir: str, dest_dir: str, name: str, entry: dict) -> bool:
+    """Links one file of the tree into dest_dir and returns whether it did."""
+    source = os.path.join(tree_dir, *name.split("/"))
+    path = os.path.join(dest_dir, *name.split("/"))
+    if "link" in entry:
+        if os.path.islink(path) and os.readlink(path) == entry["link"]:
+            return False
+    elif os.path.isfile(path) and not os.path.islink(path):
+        if os.path.samefile(source, path):
+            return False
+        if os.path.getsize(path) == entry["size"] and _file_sha256(path) == entry["sha256"]:
+            return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.unlink(path)
+    if "link" in entry:
+        os.symlink(entry["link"], path)
+    else:
+        try:
+            os.link(source, path)
+        except OSError:
+            # the cache is on another filesystem
+            shutil.copy2(source, path)
+    return True
+
+
+def install(
+    artifact: str,
+    dest_dir: str,
+    *,
+    manifest: str | None = None,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    jobs: int | None = None,
+) -> int:
+    """
+    Installs an artifact, given as a URL or a path, into dest_dir and returns
+    how many files were added or replaced.
+    """
+    jobs = jobs or os.cpu_count() or 4
+    manifest_path = fetch(manifest or manifest_location(artifact), cache_dir)
+    tree_dir, files = cached_tree(artifact, manifest_path, cache_dir, jobs)
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        installed = executor.map(
+            lambda name: _install_file(tree_dir, dest_dir, name, files[name]),
+            sorted(files),
+        )
+        return sum(installed)
+
+
+def main():
+    parser = argparse.ArgumentParser("installer")
+    parser.add_argument("artifact", help="URL or path of ffmpeg-<platform>.tar.gz")
+    parser.add_argument("destination")
+    parser.add_argument(
+        "--manifest", help="URL or path of the manifest, defaults to the one next to the artifact"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("FFMPEG_INSTALL_CACHE", DEFAULT_CACHE_DIR),
+        help="downloads and unpacked trees, defaults to $FFMPEG_INSTALL_CACHE",
+    )
+    parser.add_argument("--jobs", type=int)
+    args = parser.parse_args()
+
+    count = install(
+        args.artifact,
+        args.destination,
+        manifest=args.manifest,
+        cache_dir=args.cache_dir,
+        jobs=args.jobs,
+    )
+    print(f"{args.destination}: {count} files installed")
+
+
+if __name__ == "__main__":
+    main()
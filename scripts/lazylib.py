@@ -0,0 +1,404 @@
+# Stubs which load a shared library on the first call into it
+#
+# For each function a shared library exports, the stub archive defines a
+# hidden trampoline of the same name. The trampoline jumps through a table of
+# addresses which starts empty: the first call to any function opens the
+# library with dlopen() and resolves the function with dlsym(). Linking
+# against the stub instead of the library removes it from DT_NEEDED, so
+# processes which never call into it never map it. If the library cannot be
+# loaded, its functions resolve to fallbacks which return an error instead.
+#
+# Only ELF on x86_64 and aarch64 is supported. Exported data cannot be
+# forwarded, libraries whose data is referenced must be linked normally.
+
+import os
+import re
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+# nm symbol types of exported code; "i" marks GNU indirect functions
+FUNCTION_TYPES = {"T", "W", "i"}
+
+RESOLVER_TEMPLATE = """\
+#define _GNU_SOURCE
+#include <ctype.h>
+#include <dirent.h>
+#include <dlfcn.h>
+#include <libgen.h>
+#include <limits.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+__attribute__((visibility("hidden"))) void *{prefix}_addrs[{count}];
+
+static const char *const names[{count}] = {{
+{names}
+}};
+
+/* what each function returns when the library cannot be loaded */
+static long fail_zero(void) {{ return 0; }}
+
+/* an API table of failing functions, laid out like x265_api: version
+   fields, then version strings, then function pointers */
+static struct {{
+    int fields[8];
+    const char *strings[2];
+    long (*functions[256])(void);
+}} fail_api;
+
+static long fail_table(void) {{ return (long)&fail_api; }}
+
+{failure_functions}
+static void *const failures[{count}] = {{
+{failures}
+}};
+
+static pthread_once_t once = PTHREAD_ONCE_INIT;
+static void *handle;
+
+/* auditwheel renames the libraries it bundles to {stem}-<hash>{suffix} */
+static void *open_renamed(const char *dir)
+{{
+    const size_t stem_len = strlen("{stem}"), suffix_len = strlen("{suffix}");
+    void *found = NULL;
+    struct dirent *entry;
+    DIR *d = opendir(dir);
+    if (!d)
+        return NULL;
+    while (!found && (entry = readdir(d))) {{
+        const char *name = entry->d_name;
+        size_t len = strlen(name), i = stem_len + 1;
+        if (len <= i + suffix_len || strncmp(name, "{stem}-", i) ||
+            strcmp(name + len - suffix_len, "{suffix}"))
+            continue;
+        while (i < len - suffix_len && isalnum((unsigned char)name[i]))
+            i++;
+        if (i == len - suffix_len) {{
+            char path[PATH_MAX];
+            snprintf(path, sizeof(path), "%s/%s", dir, name);
+            found = dlopen(path, RTLD_NOW | RTLD_GLOBAL);
+        }}
+    }}
+    closedir(d);
+    return found;
+}}
+
+static void load(void)
+{{
+    /* prefer the copy next to the library this stub is linked into */
+    Dl_info info;
+    if (dladdr((void *)load, &info) && info.dli_fname) {{
+        char path[PATH_MAX], buffer[PATH_MAX];
+        strncpy(buffer, info.dli_fname, sizeof(buffer) - 1);
+        buffer[sizeof(buffer) - 1] = 0;
+        const char *dir = dirname(buffer);
+        snprintf(path, sizeof(path), "%s/{soname}", dir);
+        handle = dlopen(path, RTLD_NOW | RTLD_GLOBAL);
+        if (!handle)
+            handle = open_renamed(dir);
+    }}
+    if (!handle)
+        handle = dlopen("{soname}", RTLD_NOW | RTLD_GLOBAL);
+    if (!handle) {{
+        /* as when an optional library is missing, its users fail to open */
+        fprintf(stderr, "cannot load {soname}: %s\\n", dlerror());
+        fail_api.strings[0] = fail_api.strings[1] = "";
+        for (size_t i = 0; i < sizeof(fail_api.functions) / sizeof(*fail_api.functions); i++)
+            fail_api.functions[i] = fail_zero;
+    }}
+}}
+
+__attribute__((visibility("hidden"))) void *{prefix}_resolve(unsigned int index)
+{{
+    void *addr = NULL;
+    pthread_once(&once, load);
+    if (handle) {{
+        addr = dlsym(handle, names[index]);
+        if (!addr)
+            fprintf(stderr, "cannot resolve %s in {soname}: %s\\n", names[index], dlerror());
+    }}
+    if (!addr)
+        addr = failures[index];
+    __atomic_store_n(&{prefix}_addrs[index], addr, __ATOMIC_RELEASE);
+    return addr;
+}}
+"""
+
+# The slow path saves every argument register, including the vector
+# registers and %al for variadic calls on x86_64, then calls the resolver and
+# tail-calls the resolved function with the original arguments.
+X86_64_COMMON = """\
+    .text
+    .p2align 4
+    .type {prefix}_slow, @function
+{prefix}_slow:
+    pushq %rbp
+    movq %rsp, %rbp
+    pushq %rax
+    pushq %rdi
+    pushq %rsi
+    pushq %rdx
+    pushq %rcx
+    pushq %r8
+    pushq %r9
+    subq $136, %rsp
+    movdqu %xmm0, 0(%rsp)
+    movdqu %xmm1, 16(%rsp)
+    movdqu %xmm2, 32(%rsp)
+    movdqu %xmm3, 48(%rsp)
+    movdqu %xmm4, 64(%rsp)
+    movdqu %xmm5, 80(%rsp)
+    movdqu %xmm6, 96(%rsp)
+    movdqu %xmm7, 112(%rsp)
+    movl %r11d, %edi
+    call {prefix}_resolve
+    movq %rax, %r11
+    movdqu 0(%rsp), %xmm0
+    movdqu 16(%rsp), %xmm1
+    movdqu 32(%rsp), %xmm2
+    movdqu 48(%rsp), %xmm3
+    movdqu 64(%rsp), %xmm4
+    movdqu 80(%rsp), %xmm5
+    movdqu 96(%rsp), %xmm6
+    movdqu 112(%rsp), %xmm7
+    addq $136, %rsp
+    popq %r9
+    popq %r8
+    popq %rcx
+    popq %rdx
+    popq %rsi
+    popq %rdi
+    popq %rax
+    popq %rbp
+    jmp *%r11
+"""
+
+X86_64_TRAMPOLINE = """\
+    .globl {name}
+    .hidden {name}
+    .type {name}, @function
+    .p2align 4
+{name}:
+    movq {prefix}_addrs+{offset}(%rip), %r11
+    testq %r11, %r11
+    jz 1f
+    jmp *%r11
+1:
+    movl ${index}, %r11d
+    jmp {prefix}_slow
+"""
+
+AARCH64_COMMON = """\
+    .text
+    .p2align 4
+    .type {prefix}_slow, %function
+{prefix}_slow:
+    stp x29, x30, [sp, #-224]!
+    mov x29, sp
+    stp x0, x1, [sp, #16]
+    stp x2, x3, [sp, #32]
+    stp x4, x5, [sp, #48]
+    stp x6, x7, [sp, #64]
+    str x8, [sp, #80]
+    stp q0, q1, [sp, #96]
+    stp q2, q3, [sp, #128]
+    stp q4, q5, [sp, #160]
+    stp q6, q7, [sp, #192]
+    mov w0, w16
+    bl {prefix}_resolve
+    mov x16, x0
+    ldp q6, q7, [sp, #192]
+    ldp q4, q5, [sp, #160]
+    ldp q2, q3, [sp, #128]
+    ldp q0, q1, [sp, #96]
+    ldr x8, [sp, #80]
+    ldp x6, x7, [sp, #64]
+    ldp x4, x5, [sp, #48]
+    ldp x2, x3, [sp, #32]
+    ldp x0, x1, [sp, #16]
+    ldp x29, x30, [sp], #224
+    br x16
+"""
+
+AARCH64_TRAMPOLINE = """\
+    .globl {name}
+    .hidden {name}
+    .type {name}, %function
+    .p2align 4
+{name}:
+    adrp x16, {prefix}_addrs+{offset}
+    ldr x17, [x16, #:lo12:{prefix}_addrs+{offset}]
+    cbz x17, 1f
+    br x17
+1:
+    mov x16, #{index}
+    b {prefix}_slow
+"""
+
+ASSEMBLY = {
+    "x86_64": (X86_64_COMMON, X86_64_TRAMPOLINE),
+    "aarch64": (AARCH64_COMMON, AARCH64_TRAMPOLINE),
+}
+
+
+@dataclass(slots=True)
+class Exports:
+    soname: str
+    functions: list[str]
+    data: list[str]
+
+
+def read_exports(library: str) -> Exports:
+    """
+    Returns the SONAME and the exported functions and data of a library.
+    """
+    dynamic = subprocess.run(
+        ["readelf", "-d", library], check=True, capture_output=True, text=True
+    ).stdout
+    match = re.search(r"\(SONAME\)\s+Library soname: \[(.+)\]", dynamic)
+    soname = match.group(1) if match else os.path.basename(library)
+
+    symbols = subprocess.run(
+        ["nm", "-D", "--defined-only", library],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    functions, data = set(), set()
+    for line in symbols.splitlines():
+        fields = line.split()
+        if len(fields) != 3 or fields[1] in {"A", "N"}:
+            continue
+        # newer binutils print symbol versions, dlsym() uses the default one
+        name = fields[2].split("@")[0]
+        (functions if fields[1] in FUNCTION_TYPES else data).add(name)
+    return Exports(soname=soname, functions=sorted(functions), data=sorted(data))
+
+
+def write_stub_archive(
+    library: str,
+    archive: str,
+    *,
+    machine: str,
+    env: dict[str, str],
+    failures: dict[str, int | str] | None = None,
+) -> Exports:
+    """
+    Compiles the stub of a shared library into a static archive of
+    position-independent code.
+
+    If the library cannot be loaded, the functions named in failures return
+    the given value, or a table of failing functions for "table", and the
+    others return 0.
+    """
+    failures = failures or {}
+    common, trampoline = ASSEMBLY[machine]
+    exports = read_exports(library)
+    prefix = "_lazy_" + re.sub(r"\W", "_", exports.soname)
+    stem, dot, version = exports.soname.partition(".so")
+
+    failure_functions, fallbacks = [], []
+    for index, name in enumerate(exports.functions):
+        value = failures.get(name, 0)
+        if value == "table":
+            fallbacks.append("fail_table")
+        elif value:
+            failure_functions.append(
+                f"static long fail_{index}(void) {{ return {value}; }}\n"
+            )
+            fallbacks.append(f"fail_{index}")
+        else:
+            fallbacks.append("fail_zero")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        resolver = os.path.join(temp_dir, "resolver.c")
+        with open(resolver, "w") as fp:
+            fp.write(
+                RESOLVER_TEMPLATE.format(
+                    prefix=prefix,
+                    soname=exports.soname,
+                    stem=stem,
+                    suffix=dot + version,
+                    count=max(len(exports.functions), 1),
+                    names="\n".join(f'    "{name}",' for name in exports.functions),
+                    failure_functions="".join(failure_functions),
+                    failures="\n".join(f"    (void *){name}," for name in fallbacks),
+                )
+            )
+        trampolines = os.path.join(temp_dir, "trampolines.S")
+        with open(trampolines, "w") as fp:
+            fp.write(common.format(prefix=prefix))
+            for index, name in enumerate(exports.functions):
+                fp.write(
+                    trampoline.format(
+                        name=name, prefix=prefix, index=index, offset=index * 8
+                    )
+                )
+            fp.write('    .section .note.GNU-stack,"",%progbits\n')
+
+        cc = env.get("CC", "cc").split()
+        cflags = env.get("CPPFLAGS", "").split() + env.get("CFLAGS", "").split()
+        objects = []
+        for source in (resolver, trampolines):
+            obj = source + ".o"
+            subprocess.run(
+                cc + cflags + ["-fPIC", "-O2", "-c", source, "-o", obj],
+                check=True,
+                env=env,
+            )
+            objects.append(obj)
+        if os.path.exists(archive):
+            os.unlink(archive)
+        subprocess.run(
+            [env.get("AR", "ar").split()[0], "rcs", archive] + objects,
+            check=True,
+            env=env,
+        )
+    return exports
+
+
+def linked_libraries(pc_file: str) -> list[str]:
+    """Returns the names of the libraries in the Libs of a pkg-config file."""
+    with open(pc_file) as fp:
+        match = re.search(r"^Libs:(.*)$", fp.read(), re.MULTILINE)
+    return re.findall(r"(?:^|\s)-l(\S+)", match.group(1)) if match else []
+
+
+def write_stub_pkgconfig(
+    pc_file: str, dest_dir: str, lib_dir: str, stubs: dict[str, str]
+) -> None:
+    """
+    Writes a copy of a pkg-config file which links stub archives instead of
+    the libraries they are named after.
+    """
+    with open(pc_file) as fp:
+        content = fp.read()
+    content = content.replace("${pcfiledir}", os.path.dirname(os.path.abspath(pc_file)))
+
+    def replace_libs(match: re.Match) -> str:
+        flags = [
+            f"-l{stubs[flag[2:]]}" if flag[2:] in stubs else flag
+            for flag in match.group(1).split()
+        ]
+        return " ".join(["Libs:", f"-L{lib_dir}", *flags, "-ldl", "-lpthread"])
+
+    content = re.sub(r"^Libs:(.*)$", replace_libs, content, flags=re.MULTILINE)
+    with open(os.path.join(dest_dir, os.path.basename(pc_file)), "w") as fp:
+        fp.write(content)
+
+
+def unlink_stubs_from_pkgconfig(pc_file: str, lib_dir: str) -> None:
+    """
+    Makes a pkg-config file which was generated against stub archives name
+    the libraries instead, as the stubs are not installed.
+    """
+    with open(pc_file) as fp:
+        content = fp.read()
+    unlinked = re.sub(rf"[ \t]*-L{re.escape(lib_dir)}(?=\s)", "", content)
+    unlinked = re.sub(r"(?<=\s)-l(\S+)_lazy(?=\s)", r"-l\1", unlinked)
+    if unlinked != content:
+        with open(pc_file, "w") as fp:
+            fp.write(unlinked)
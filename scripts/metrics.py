@@ -0,0 +1,160 @@
+# Machine-readable metrics of a build, in OpenMetrics text format
+#
+# The metrics describe a single build, so they are all gauges: the file is
+# replaced atomically at the end of each build, which is what the textfile
+# collector of the Prometheus node exporter expects. Dashboards then trend
+# phase durations, cache hit rates, download throughput and artifact sizes
+# across commits using the build_info labels.
+
+import contextlib
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+
+PREFIX = "cibuildpkg_"
+
+# name: help
+METRICS = {
+    "build_info": "Build metadata, the value is always 1.",
+    "build_timestamp_seconds": "When the metrics were written.",
+    "phase_duration_seconds": "Time spent in a phase of a package build.",
+    "cache_hits": "Lookups which were served from a cache.",
+    "cache_misses": "Lookups which were not served from a cache.",
+    "cache_hit_ratio": "Fraction of lookups which were served from a cache.",
+    "download_size_bytes": "Size of a downloaded file.",
+    "download_duration_seconds": "Time spent downloading a file.",
+    "download_throughput_bytes_per_second": "Bytes downloaded per second over all downloads.",
+    "artifact_size_bytes": "Size of the compressed artifact.",
+    "artifact_unpacked_size_bytes": "Total size of the files in the artifact.",
+}
+
+# the phases a package build is divided into
+PHASES = ("extract", "configure", "compile", "install")
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def git_commit() -> str:
+    """Returns the commit being built, or "unknown" outside of a checkout."""
+    if os.environ.get("GITHUB_SHA"):
+        return os.environ["GITHUB_SHA"]
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class BuildMetrics:
+    """
+    Collects metrics from any thread and writes them out as a textfile.
+    """
+
+    def __init__(self, **info: str) -> None:
+        self.info = {"commit": git_commit(), **info}
+        self._values: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float, **labels: str) -> None:
+        assert name in METRICS, name
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        assert name in METRICS, name
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    @contextlib.contextmanager
+    def phase(self, package: str, phase: str) -> Iterator[None]:
+        """Adds the time until exit to a phase of a package build."""
+        assert phase in PHASES, phase
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(
+                "phase_duration_seconds",
+                time.monotonic() - start,
+                package=package,
+                phase=phase,
+            )
+
+    def cache_lookup(self, cache: str, hit: bool) -> None:
+        self.add("cache_hits" if hit else "cache_misses", 1, cache=cache)
+
+    def download(self, name: str, size: int, seconds: float) -> None:
+        self.set("download_size_bytes", size, file=name)
+        self.set("download_duration_seconds", seconds, file=name)
+
+    def render(self) -> str:
+        with self._lock:
+            values = dict(self._values)
+
+        # derived values
+        caches = {
+            dict(labels)["cache"]
+            for name, labels in values
+            if name in {"cache_hits", "cache_misses"}
+        }
+        for cache in caches:
+            hits = values.get(("cache_hits", (("cache", cache),)), 0.0)
+            misses = values.get(("cache_misses", (("cache", cache),)), 0.0)
+            values[("cache_hit_ratio", (("cache", cache),))] = hits / (hits + misses)
+        sizes = [v for (name, _), v in values.items() if name == "download_size_bytes"]
+        seconds = [
+            v for (name, _), v in values.items() if name == "download_duration_seconds"
+        ]
+        if sum(seconds):
+            values[("download_throughput_bytes_per_second", ())] = sum(sizes) / sum(
+                seconds
+            )
+        values[("build_info", tuple(sorted(self.info.items())))] = 1
+        values[("build_timestamp_seconds", ())] = time.time()
+
+        lines = []
+        for name, help_text in METRICS.items():
+            samples = sorted(
+                (labels, value) for (key, labels), value in values.items() if key == name
+            )
+            if not samples:
+                continue
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(
+                    f"{PREFIX}{name}{{{label_text}}} {_format(value)}"
+                    if label_text
+                    else f"{PREFIX}{name} {_format(value)}"
+                )
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Writes the metrics to path, replacing it atomically so a collector
+        never reads a partial file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write(self.render())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
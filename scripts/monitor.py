@@ -0,0 +1,205 @@
+# Resource usage of package builds, sampled from /proc
+#
+# A background thread periodically walks the process tree of the build and
+# records CPU time, resident memory and storage I/O against the package being
+# built. On platforms without /proc the monitor records wall time only.
+
+import contextlib
+import os
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+@dataclass(slots=True)
+class PackageUsage:
+    name: str
+    start: float
+    end: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_cores: float = 0.0
+    peak_rss: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    # (seconds since start, cores busy, RSS in bytes)
+    samples: list[tuple[float, float, int]] = field(default_factory=list)
+
+    @property
+    def wall_seconds(self) -> float:
+        return self.end - self.start
+
+    @property
+    def average_cores(self) -> float:
+        return self.cpu_seconds / self.wall_seconds if self.wall_seconds else 0.0
+
+
+def _read_stat(pid: str) -> tuple[int, float, int] | None:
+    """Returns the parent, CPU seconds (including reaped children) and RSS."""
+    try:
+        with open(f"/proc/{pid}/stat") as fp:
+            stat = fp.read()
+    except OSError:
+        return None
+    # the command name may contain spaces and parentheses
+    fields = stat[stat.rindex(")") + 2 :].split()
+    ticks = sum(int(value) for value in fields[11:15])
+    return int(fields[1]), ticks / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+def _read_io(pid: int) -> tuple[int, int] | None:
+    try:
+        with open(f"/proc/{pid}/io") as fp:
+            values = dict(line.split(": ") for line in fp.read().splitlines())
+    except OSError:
+        return None
+    return int(values["read_bytes"]), int(values["write_bytes"])
+
+
+class ResourceMonitor:
+    """
+    Samples the resources used by the build every interval seconds.
+    """
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.cpu_count = os.cpu_count() or 1
+        self.packages: list[PackageUsage] = []
+        self._available = os.path.exists("/proc/self/stat")
+        self._current: PackageUsage | None = None
+        # totals over the build process tree when last sampled
+        self._cpu_seconds = 0.0
+        self._io = (0, 0)
+        self._last_time = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._available and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    @contextlib.contextmanager
+    def track(self, name: str) -> Iterator[None]:
+        """
+        Attributes the resources used until exit to the named package.
+        """
+        usage = PackageUsage(name=name, start=time.monotonic())
+        with self._lock:
+            self._current = usage
+            self._cpu_seconds, _, self._io = self._read_tree()
+            self._last_time = usage.start
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._sample()
+                self._current = None
+                usage.end = time.monotonic()
+                self.packages.append(usage)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if self._current is not None:
+                    self._sample()
+
+    def _read_tree(self) -> tuple[float, int, tuple[int, int]]:
+        """
+        Returns the CPU seconds, RSS and (read, write) bytes of the build
+        process tree.
+        """
+        if not self._available:
+            return 0.0, 0, (0, 0)
+
+        stats = {}
+        for pid in os.listdir("/proc"):
+            if pid.isdigit() and (stat := _read_stat(pid)) is not None:
+                stats[int(pid)] = stat
+
+        tree = [os.getpid()]
+        children: dict[int, list[int]] = {}
+        for pid, (ppid, _, _) in stats.items():
+            children.setdefault(ppid, []).append(pid)
+        for pid in tree:
+            tree.extend(children.get(pid, []))
+
+        # exited processes are accounted in the cumulative times and I/O of
+        # the parent which reaped them, up to this process at the root, so
+        # the sums over the live tree only grow
+        cpu_seconds = sum(stats[pid][1] for pid in tree if pid in stats)
+        rss = sum(stats[pid][2] for pid in tree if pid in stats)
+        read_bytes = write_bytes = 0
+        for pid in tree:
+            if (io := _read_io(pid)) is not None:
+                read_bytes += io[0]
+                write_bytes += io[1]
+        return cpu_seconds, rss, (read_bytes, write_bytes)
+
+    def _sample(self) -> None:
+        usage = self._current
+        assert usage is not None
+        now = time.monotonic()
+        cpu_seconds, rss, (read_bytes, write_bytes) = self._read_tree()
+
+        delta = max(cpu_seconds - self._cpu_seconds, 0.0)
+        cores = delta / (now - self._last_time) if now > self._last_time else 0.0
+        self._cpu_seconds, self._last_time = max(cpu_seconds, self._cpu_seconds), now
+
+        usage.cpu_seconds += delta
+        usage.peak_cores = max(usage.peak_cores, cores)
+        usage.peak_rss = max(usage.peak_rss, rss)
+        usage.read_bytes += max(read_bytes - self._io[0], 0)
+        usage.write_bytes += max(write_bytes - self._io[1], 0)
+        self._io = (max(read_bytes, self._io[0]), max(write_bytes, self._io[1]))
+        usage.samples.append((round(now - usage.start, 3), round(cores, 2), rss))
+
+    def report(self) -> dict:
+        return {
+            "cpu_count": self.cpu_count,
+            "interval": self.interval,
+            "packages": {
+                usage.name: {
+                    "wall_seconds": round(usage.wall_seconds, 3),
+                    "cpu_seconds": round(usage.cpu_seconds, 3),
+                    "average_cores": round(usage.average_cores, 2),
+                    "peak_cores": round(usage.peak_cores, 2),
+                    "peak_rss": usage.peak_rss,
+                    "read_bytes": usage.read_bytes,
+                    "write_bytes": usage.write_bytes,
+                    "samples": usage.samples,
+                }
+                for usage in self.packages
+            },
+        }
+
+    def print_report(self) -> None:
+        print(
+            f"{'package':<20} {'wall s':>8} {'cores':>6} {'peak':>6} {'idle':>6} "
+            f"{'rss MiB':>8} {'read MiB':>9} {'write MiB':>9}"
+        )
+        for usage in self.packages:
+            idle = self.cpu_count - usage.average_cores
+            print(
+                f"{usage.name:<20} {usage.wall_seconds:8.1f} "
+                f"{usage.average_cores:6.2f} {usage.peak_cores:6.2f} {idle:6.2f} "
+                f"{usage.peak_rss / 2**20:8.1f} {usage.read_bytes / 2**20:9.1f} "
+                f"{usage.write_bytes / 2**20:9.1f}"
+            )
+        total_wall = sum(usage.wall_seconds for usage in self.packages)
+        total_cpu = sum(usage.cpu_seconds for usage in self.packages)
+        if total_wall:
+            print(
+                f"{self.cpu_count} cores, {total_cpu / total_wall:.2f} busy on average, "
+                f"{self.cpu_count - total_cpu / total_wall:.2f} idle"
+            )
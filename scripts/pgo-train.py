@@ -0,0 +1,54 @@
+# Training workload for profile-guided optimization builds.
+#
+# This runs against an instrumented build of FFmpeg through the dummy binding,
+# the profiles it produces are used to optimize the final build. Keep the
+# workload fixed: changing it invalidates cached profiles.
+
+from dummy import binding
+
+# (encoder, pixel format), each is also decoded with FFmpeg's preferred decoder
+ENCODERS = [
+    ("libx264", "yuv420p"),
+    ("libx265", "yuv420p"),
+    ("libx265", "yuv420p10le"),
+    ("libvpx", "yuv420p"),
+    ("libvpx-vp9", "yuv420p"),
+    ("libsvtav1", "yuv420p"),
+    ("libsvtav1", "yuv420p10le"),
+    ("mpeg4", "yuv420p"),
+]
+
+SCALERS = [
+    ("yuv420p", 1280, 720, "yuv420p", 640, 360),
+    ("yuv420p", 640, 360, "rgb24", 640, 360),
+    ("yuv420p10le", 1280, 720, "yuv420p", 1280, 720),
+]
+
+
+def main():
+    for encoder, pix_fmt in ENCODERS:
+        for threads in (1, 4):
+            try:
+                binding.benchmark(
+                    encoder, pix_fmt=pix_fmt, frames=30, threads=threads
+                )
+            except (RuntimeError, ValueError) as exc:
+                print(f"{encoder} ({pix_fmt}): skipped ({exc})")
+            else:
+                print(f"{encoder} ({pix_fmt}, {threads} threads): ok")
+
+    for src_fmt, width, height, dst_fmt, dst_width, dst_height in SCALERS:
+        binding.scale(
+            pix_fmt=src_fmt,
+            width=width,
+            height=height,
+            dst_pix_fmt=dst_fmt,
+            dst_width=dst_width,
+            dst_height=dst_height,
+            frames=30,
+        )
+        print(f"scale {src_fmt} {width}x{height} -> {dst_fmt} {dst_width}x{dst_height}: ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ class Package:
     requires: list[str] = field(default_factory=list)
     source_dir: str = ""
     source_filename: str = ""
+    # set to False for packages which fail to build with link-time optimization
+    lto: bool = True
 
     def __lt__(self, other):
         return self.name < other.name
@@ -27,6 +29,8 @@ gnutls_group = [
         sha256="a3c2b80201b89e68616f4ad30bc66aee4927c3ce50e33929ca819d5c43538898",
         # out-of-tree builds fail on Windows
         build_dir=".",
+        # configure inspects object files to detect the assembler symbol prefix
+        lto=False,
     ),
     Package(
         name="unistring",
@@ -39,6 +43,8 @@ gnutls_group = [
         sha256="3addbc00da01846b232fb3bc453538ea5468da43033f21bb345cb1e9073f5094",
         requires=["gmp"],
         build_arguments=["--disable-documentation"],
+        # configure inspects object files to detect the assembler symbol prefix
+        lto=False,
     ),
     Package(
         name="gnutls",
@@ -143,9 +149,11 @@ codec_group = [
         name="x264",
         source_url="https://code.videolan.org/videolan/x264/-/archive/b35605ace3ddf7c1a5d67a2eb553f034aef41d55/x264-b35605ace3ddf7c1a5d67a2eb553f034aef41d55.tar.bz2",
         sha256="6eeb82934e69fd51e043bd8c5b0d152839638d1ce7aa4eea65a3fedcf83ff224",
-        # assembly contains textrels which are not supported by musl
+        # musl does not support textrels: --enable-shared already builds the
+        # assembly as PIC, make the linker reject any text relocation left over
         build_arguments=(
-            "--disable-cli --disable-lsmash --disable-swscale --disable-ffms --disable-opencl --enable-strip" + (" --disable-asm" if is_musllinux else "")
+            "--disable-cli --disable-lsmash --disable-swscale --disable-ffms --disable-opencl --enable-strip"
+            + (" --extra-ldflags=-Wl,-z,text" if is_musllinux else "")
         ).split(" "),
     ),
     Package(
@@ -193,6 +201,9 @@ libvpl_package = Package(
     ],
 )
 
+# build tools installed with pip, pinned so the host tools can be cached
+host_python_tools = {"cmake": "4.1.2", "meson": "1.9.1", "ninja": "1.13.0"}
+
 nasm_package = Package(
     name="nasm",
     source_url="https://www.nasm.us/pub/nasm/releasebuilds/2.16.03/nasm-2.16.03.tar.xz",
@@ -211,3 +222,118 @@ all_packages.extend(gnutls_group)
 all_packages.extend(
     [nasm_package, alsa_package, nvheaders_package, amfheaders_package, libvpl_package]
 )
+
+# optional dependencies which --lazy-libs loads on the first call into them,
+# with the pkg-config modules FFmpeg finds them with. gnutls is not included
+# by default: FFmpeg references exported data such as gnutls_free.
+lazy_libraries = {
+    "gnutls": ["gnutls"],
+    "libsvtav1": ["SvtAv1Enc"],
+    "libvmaf": ["libvmaf"],
+    "vpx": ["vpx"],
+    "webp": ["libwebp", "libwebpmux"],
+    "x265": ["x265"],
+}
+default_lazy_libraries = ["libsvtav1", "libvmaf", "vpx", "webp", "x265"]
+
+# what the first calls FFmpeg makes into a lazily loaded library return when it
+# cannot be loaded, so that opening the codec or filter fails. Other functions
+# return 0, which WebPConfigInitInternal reports failure with. x265 is used
+# through the table x265_api_get returns, whose param_alloc then returns NULL.
+lazy_library_failures: dict[str, int | str] = {
+    "gnutls_global_init": -1,
+    "svt_av1_enc_init_handle": -1,
+    "vmaf_init": -1,
+    "vpx_codec_dec_init_ver": 1,
+    "vpx_codec_enc_config_default": 1,
+    "vpx_codec_enc_init_ver": 1,
+    "x265_api_get": "table",
+}
+
+# used to update the copies shipped with autoconf packages, these follow
+# upstream and are not pinned
+config_script_urls = {
+    name: f"https://raw.githubusercontent.com/gcc-mirror/gcc/refs/heads/master/{name}"
+    for name in ("config.guess", "config.sub")
+}
+
+
+@dataclass(slots=True)
+class ComponentProfile:
+    name: str
+    # dependency packages to build, None builds all of them
+    packages: set[str] | None = None
+    # FFmpeg components by kind (decoder, encoder, muxer, ...) enabled on
+    # top of --disable-everything, None keeps FFmpeg's defaults
+    components: dict[str, list[str]] | None = None
+
+    def uses(self, package_name: str) -> bool:
+        return self.packages is None or package_name in self.packages
+
+    def configure_arguments(self) -> list[str]:
+        if self.components is None:
+            return []
+        return ["--disable-everything"] + [
+            f"--enable-{kind}={','.join(names)}"
+            for kind, names in sorted(self.components.items())
+        ]
+
+
+_decode_components = {
+    "decoder": [
+        "aac", "aac_latm", "ac3", "alac", "eac3", "flac", "h264", "hevc",
+        "libdav1d", "mjpeg", "mp3", "mp3float", "mpeg2video", "mpeg4", "opus",
+        "pcm_f32le", "pcm_s16le", "pcm_s24le", "png", "vorbis", "vp8", "vp9",
+        "webp",
+    ],
+    "demuxer": [
+        "aac", "avi", "flac", "h264", "hevc", "image2", "ivf", "matroska", "mov",
+        "mp3", "mpegts", "ogg", "wav",
+    ],
+    "parser": [
+        "aac", "ac3", "av1", "flac", "h264", "hevc", "mjpeg", "mpeg4video",
+        "mpegaudio", "mpegvideo", "opus", "png", "vorbis", "vp8", "vp9",
+    ],
+    "bsf": ["extract_extradata", "h264_mp4toannexb", "hevc_mp4toannexb", "null"],
+    "protocol": ["file", "pipe"],
+    "filter": [
+        "abuffer", "abuffersink", "aformat", "anull", "aresample", "buffer",
+        "buffersink", "format", "null", "scale",
+    ],
+}
+
+component_profiles = {
+    profile.name: profile
+    for profile in [
+        ComponentProfile(name="full"),
+        ComponentProfile(
+            name="decode-only",
+            packages={"dav1d"},
+            components=_decode_components,
+        ),
+        ComponentProfile(
+            name="transcode-web",
+            packages={
+                "dav1d", "gmp", "gnutls", "lamer", "libsvtav1", "nettle", "opus",
+                "unistring", "vpx", "webp", "x264",
+            },
+            components={
+                **_decode_components,
+                "encoder": [
+                    "aac", "libmp3lame", "libopus", "libsvtav1", "libvpx_vp8",
+                    "libvpx_vp9", "libwebp", "libx264", "mjpeg", "png",
+                ],
+                "muxer": [
+                    "adts", "dash", "hls", "image2", "matroska", "mov", "mp3", "mp4",
+                    "ogg", "opus", "segment", "webm", "webp",
+                ],
+                "demuxer": _decode_components["demuxer"] + ["hls"],
+                "bsf": _decode_components["bsf"] + ["aac_adtstoasc", "vp9_superframe"],
+                "protocol": ["crypto", "file", "hls", "http", "https", "pipe", "tcp", "tls"],
+                "filter": _decode_components["filter"] + [
+                    "asetpts", "crop", "fps", "pad", "setpts", "transpose",
+                ],
+            },
+        ),
+    ]
+}
@@ -0,0 +1,257 @@
+# Reproducibility pass over an installed prefix
+#
+# Static archives and pkg-config files are the installed files which embed
+# build-time state: ar member headers carry timestamps and ownership, symbol
+# indexes follow whatever order the archiver enumerated symbols in, and .pc
+# files carry the absolute install prefix. This pass rewrites them in place.
+
+import concurrent.futures
+import glob
+import mmap
+import os
+import re
+from dataclasses import dataclass
+
+AR_MAGIC = b"!<arch>\n"
+AR_HEADER_SIZE = 60
+
+# ar member header layout (60 bytes):
+#   [0:16]  name          16 bytes
+#   [16:28] mtime         12 bytes  <- zeroed
+#   [28:34] uid            6 bytes  <- zeroed
+#   [34:40] gid            6 bytes  <- zeroed
+#   [40:48] mode           8 bytes
+#   [48:58] size          10 bytes
+#   [58:60] end magic      2 bytes  (`\n)
+DETERMINISTIC_FIELDS = b"0           " + b"0     " + b"0     "
+
+
+@dataclass(slots=True)
+class ArMember:
+    name: str
+    header_offset: int
+    # BSD archives store long names at the start of the member data
+    name_size: int
+    size: int
+
+    @property
+    def data_offset(self) -> int:
+        return self.header_offset + AR_HEADER_SIZE + self.name_size
+
+    @property
+    def data_size(self) -> int:
+        return self.size - self.name_size
+
+
+def read_ar_members(data: bytes | mmap.mmap) -> list[ArMember]:
+    """
+    Parses and validates every member header of an ar archive, resolving
+    GNU (//) and BSD (#1/N) long names.
+    """
+    if data[: len(AR_MAGIC)] != AR_MAGIC:
+        raise ValueError("not an ar archive")
+
+    members = []
+    long_names = b""
+    pos = len(AR_MAGIC)
+    while pos < len(data):
+        if len(data) - pos < AR_HEADER_SIZE and data[pos:].strip(b"\n") == b"":
+            break  # trailing padding
+        header = data[pos : pos + AR_HEADER_SIZE]
+        if len(header) < AR_HEADER_SIZE or header[58:60] != b"`\n":
+            raise ValueError(f"invalid member header at offset {pos}")
+        try:
+            size = int(header[48:58].decode("ascii").strip())
+        except ValueError:
+            raise ValueError(f"invalid member size at offset {pos}") from None
+        if pos + AR_HEADER_SIZE + size > len(data):
+            raise ValueError(f"truncated member at offset {pos}")
+
+        raw_name = header[:16].decode("latin-1").rstrip(" ")
+        name_size = 0
+        if raw_name.startswith("#1/"):
+            name_size = int(raw_name[3:])
+            start = pos + AR_HEADER_SIZE
+            name = data[start : start + name_size].rstrip(b"\0").decode("latin-1")
+        elif raw_name == "//":
+            name = raw_name
+            long_names = data[pos + AR_HEADER_SIZE : pos + AR_HEADER_SIZE + size]
+        elif raw_name[:1] == "/" and raw_name[1:].isdigit():
+            offset = int(raw_name[1:])
+            end = long_names.find(b"/\n", offset)
+            name = long_names[offset : end if end >= 0 else None].decode("latin-1")
+        elif raw_name in {"/", "/SYM64/"}:
+            name = raw_name
+        else:
+            name = raw_name.rstrip("/")
+
+        members.append(ArMember(name, pos, name_size, size))
+        # member data is padded to an even offset
+        pos += AR_HEADER_SIZE + size + size % 2
+    return members
+
+
+def _sort_symbol_entries(
+    data: bytes, count_offset: int, entry_size: int, count: int, key
+) -> bytes:
+    entries = [
+        data[count_offset + i * entry_size : count_offset + (i + 1) * entry_size]
+        for i in range(count)
+    ]
+    return b"".join(sorted(entries, key=key))
+
+
+def _sorted_gnu_symbol_table(data: bytes, width: int) -> bytes:
+    # count, offsets, then as many NUL-terminated names, all big endian
+    count = int.from_bytes(data[:width], "big")
+    names_start = width + count * width
+    names = data[names_start:].split(b"\0")[:count]
+    offsets = [
+        data[width + i * width : width + (i + 1) * width] for i in range(count)
+    ]
+    entries = sorted(zip(offsets, names))
+    table = (
+        data[:width]
+        + b"".join(offset for offset, name in entries)
+        + b"".join(name + b"\0" for offset, name in entries)
+    )
+    return table + data[len(table) :]
+
+
+def _sorted_bsd_symbol_table(data: bytes, width: int) -> bytes:
+    # size of the ranlib entries, (string index, member offset) entries,
+    # then the string table, all little endian on supported hosts
+    entries_size = int.from_bytes(data[:width], "little")
+    strings_start = width + entries_size + width
+
+    def key(entry: bytes) -> tuple[int, bytes]:
+        strx = int.from_bytes(entry[:width], "little")
+        start = strings_start + strx
+        return int.from_bytes(entry[width:], "little"), data[start : data.index(b"\0", start)]
+
+    entries = _sort_symbol_entries(data, width, 2 * width, entries_size // (2 * width), key)
+    return data[:width] + entries + data[width + entries_size :]
+
+
+def make_archive_deterministic(path: str) -> list[str]:
+    """
+    Normalizes a static archive in place and returns what was changed.
+
+    Every member header is validated before anything is written. Timestamps,
+    uid and gid are zeroed in each header, since ar(1), libtool -static and
+    custom CMake merge steps (e.g. x265's multi-lib merge) do not always honour
+    SOURCE_DATE_EPOCH or -D. Symbol index entries are ordered by member and
+    name so that they do not depend on the order the archiver visited symbols.
+    """
+    if os.path.getsize(path) == 0:
+        return []
+
+    changes = []
+    with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0) as buf:
+        if buf[: len(AR_MAGIC)] != AR_MAGIC:
+            return []
+        members = read_ar_members(buf)
+
+        patched = 0
+        for member in members:
+            start = member.header_offset + 16
+            if buf[start : start + len(DETERMINISTIC_FIELDS)] != DETERMINISTIC_FIELDS:
+                buf[start : start + len(DETERMINISTIC_FIELDS)] = DETERMINISTIC_FIELDS
+                patched += 1
+        if patched:
+            changes.append(f"zeroed timestamps and ownership of {patched} members")
+
+        # only the first member can be a symbol index; "__.SYMDEF SORTED" is
+        # already sorted by name for binary search and must stay that way
+        if members:
+            index = members[0]
+            table = buf[index.data_offset : index.data_offset + index.data_size]
+            if index.name == "/":
+                sorted_table = _sorted_gnu_symbol_table(table, 4)
+            elif index.name == "/SYM64/":
+                sorted_table = _sorted_gnu_symbol_table(table, 8)
+            elif index.name == "__.SYMDEF":
+                sorted_table = _sorted_bsd_symbol_table(table, 4)
+            elif index.name == "__.SYMDEF_64":
+                sorted_table = _sorted_bsd_symbol_table(table, 8)
+            else:
+                sorted_table = table
+            if sorted_table != table:
+                buf[index.data_offset : index.data_offset + index.data_size] = sorted_table
+                changes.append("sorted symbol index")
+        buf.flush()
+    return changes
+
+
+def prefix_spellings(prefix: str) -> list[str]:
+    """Returns the ways an install prefix may be written, longest first."""
+    spellings = {prefix, prefix.replace(os.path.sep, "/")}
+    if len(prefix) > 1 and prefix[1] == ":":
+        # MSYS path, as passed to configure scripts on Windows
+        spellings.add(f"/{prefix[0].lower()}{prefix[2:]}".replace(os.path.sep, "/"))
+    return sorted(spellings, key=len, reverse=True)
+
+
+def make_pkgconfig_relocatable(path: str, prefix: str) -> list[str]:
+    """
+    Replaces the absolute install prefix in a pkg-config file with a path
+    relative to the file itself, so the file no longer depends on where the
+    build ran.
+    """
+    with open(path, encoding="utf-8") as fp:
+        content = fp.read()
+
+    pattern = re.compile(
+        "|".join(re.escape(p) for p in prefix_spellings(prefix)) + r"(?=[/\s\"']|$)",
+        re.MULTILINE,
+    )
+    # the .pc file lives in <prefix>/lib/pkgconfig
+    relative_prefix = "${pcfiledir}/../.."
+    lines = []
+    has_prefix = False
+    for line in content.splitlines(keepends=True):
+        if line.startswith("prefix="):
+            has_prefix = True
+            if line[len("prefix=") :].strip() in prefix_spellings(prefix):
+                line = f"prefix={relative_prefix}\n"
+            lines.append(line)
+        else:
+            lines.append(pattern.sub("${prefix}", line))
+    if not has_prefix and any(pattern.search(line) for line in content.splitlines()):
+        lines.insert(0, f"prefix={relative_prefix}\n")
+    new_content = "".join(lines)
+
+    if new_content == content:
+        return []
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(new_content)
+    return ["replaced absolute prefix"]
+
+
+def normalize_prefix(prefix: str) -> dict[str, list[str]]:
+    """
+    Runs the reproducibility pass concurrently over the static archives and
+    pkg-config files installed in prefix. Returns the changes made, keyed by
+    path relative to prefix.
+    """
+    archives = glob.glob(os.path.join(prefix, "lib", "*.a"))
+    pc_files = glob.glob(os.path.join(prefix, "lib", "pkgconfig", "*.pc"))
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = {executor.submit(make_archive_deterministic, path): path for path in archives}
+        futures.update(
+            {
+                executor.submit(make_pkgconfig_relocatable, path, prefix): path
+                for path in pc_files
+            }
+        )
+        report = {}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                changes = future.result()
+            except ValueError as exc:
+                raise ValueError(f"{path}: {exc}") from exc
+            if changes:
+                report[os.path.relpath(path, prefix)] = changes
+    return dict(sorted(report.items()))
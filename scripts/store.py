@@ -0,0 +1,226 @@
+# Content-addressed store of source tarballs
+#
+# Files are kept as <store>/sha256/<hex>. Downloads without a pinned hash,
+# such as config.guess, are also recorded as <store>/url/<hex of the URL>,
+# which holds the hash of the file the URL last resolved to.
+#
+# Every fetch consults the store named by the SOURCE_STORE environment
+# variable before going upstream. The store is either a directory, which
+# downloads are added to, or the URL of a store exported with `serve`.
+
+import argparse
+import functools
+import hashlib
+import http.server
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+from typing import BinaryIO
+
+from pkg import all_packages, config_script_urls
+
+# seconds a request may wait on a remote store, which then counts as a miss
+TIMEOUT = 30
+
+
+def _is_remote(store: str) -> bool:
+    return store.startswith(("http://", "https://"))
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def stream_sha256(fp: BinaryIO) -> str:
+    """Returns the sha256 of the rest of a binary file object."""
+    h = hashlib.sha256()
+    for block in iter(lambda: fp.read(2**20), b""):
+        h.update(block)
+    return h.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as fp:
+        return stream_sha256(fp)
+
+
+def _copy_from_store(store: str, name: str, path: str) -> bool:
+    if _is_remote(store):
+        try:
+            with urllib.request.urlopen(
+                f"{store.rstrip('/')}/{name}", timeout=TIMEOUT
+            ) as response:
+                with open(path, "wb") as fp:
+                    shutil.copyfileobj(response, fp)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return False
+            raise
+        return True
+
+    store_path = os.path.join(store, *name.split("/"))
+    if not os.path.exists(store_path):
+        return False
+    shutil.copyfile(store_path, path)
+    return True
+
+
+def _read_url_index(store: str, url: str) -> str | None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "index")
+        if not _copy_from_store(store, f"url/{_url_key(url)}", path):
+            return None
+        with open(path) as fp:
+            return fp.read().strip()
+
+
+def get(path: str, *, url: str, sha256: str | None = None, store: str | None = None) -> bool:
+    """
+    Copies the file for url from the store to path and returns whether it was
+    found. Without a sha256, the file the URL last resolved to is used. A
+    store which cannot be reached or holds a corrupt file is a miss, and path
+    is only written once the file is complete and verified.
+    """
+    store = store or os.environ.get("SOURCE_STORE")
+    if not store:
+        return False
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        digest = sha256 or _read_url_index(store, url)
+        if not digest or not _copy_from_store(store, f"sha256/{digest}", temp_path):
+            return False
+        if file_sha256(temp_path) != digest:
+            raise ValueError(f"corrupt file in source store {store}: sha256/{digest}")
+        os.replace(temp_path, path)
+        return True
+    except (OSError, ValueError) as exc:
+        print(f"source store: {exc}")
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def _write_atomic(path: str, write) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            write(fp)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def put(path: str, *, url: str | None = None, store: str | None = None) -> str | None:
+    """
+    Adds a file to the store and returns its sha256. This does nothing unless
+    the store is a directory.
+    """
+    store = store or os.environ.get("SOURCE_STORE")
+    if not store or _is_remote(store):
+        return None
+
+    digest = file_sha256(path)
+    blob_path = os.path.join(store, "sha256", digest)
+    if not os.path.exists(blob_path):
+        with open(path, "rb") as src:
+            _write_atomic(blob_path, functools.partial(shutil.copyfileobj, src))
+    if url:
+        _write_atomic(
+            os.path.join(store, "url", _url_key(url)),
+            lambda fp: fp.write(f"{digest}\n".encode()),
+        )
+    return digest
+
+
+def known_sources() -> dict[str, tuple[str, str | None]]:
+    """Returns the URL and pinned sha256 of each source file, by file name."""
+    sources: dict[str, tuple[str, str | None]] = {
+        name: (url, None) for name, url in config_script_urls.items()
+    }
+    for package in all_packages:
+        filename = package.source_filename or package.source_url.split("/")[-1]
+        sources[filename] = (package.source_url, package.sha256)
+    return sources
+
+
+def import_files(store: str, paths: list[str]) -> None:
+    sources = known_sources()
+    for path in paths:
+        files = (
+            [os.path.join(path, name) for name in sorted(os.listdir(path))]
+            if os.path.isdir(path)
+            else [path]
+        )
+        for file in filter(os.path.isfile, files):
+            url, sha256 = sources.get(os.path.basename(file), (None, None))
+            if sha256 and file_sha256(file) != sha256:
+                print(f"{file}: sha256 does not match {url}, importing without URL")
+                url = None
+            digest = put(file, url=url, store=store)
+            print(f"{file}: sha256/{digest}")
+
+
+def export_files(store: str, dest_dir: str) -> None:
+    os.makedirs(dest_dir, exist_ok=True)
+    missing = []
+    for filename, (url, sha256) in sorted(known_sources().items()):
+        path = os.path.join(dest_dir, filename)
+        if os.path.exists(path):
+            continue
+        if get(path, url=url, sha256=sha256, store=store):
+            print(f"{filename}: exported")
+        else:
+            missing.append(filename)
+    if missing:
+        print(f"not in store: {', '.join(missing)}")
+
+
+def serve(store: str, bind: str, port: int) -> None:
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=store)
+    with http.server.ThreadingHTTPServer((bind, port), handler) as server:
+        print(f"Serving {store} at http://{bind}:{port}/", flush=True)
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser("store")
+    parser.add_argument(
+        "--store",
+        default=os.environ.get("SOURCE_STORE"),
+        help="store directory, defaults to $SOURCE_STORE",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser(
+        "import", help="add files, or the files in directories, to the store"
+    )
+    import_parser.add_argument("paths", nargs="+")
+    export_parser = subparsers.add_parser(
+        "export", help="copy every known source file from the store to a directory"
+    )
+    export_parser.add_argument("destination")
+    serve_parser = subparsers.add_parser("serve", help="serve the store over HTTP")
+    serve_parser.add_argument("--bind", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error("--store or SOURCE_STORE is required")
+    if args.command == "import":
+        if _is_remote(args.store):
+            parser.error("cannot import into a remote store")
+        import_files(args.store, args.paths)
+    elif args.command == "export":
+        export_files(args.store, args.destination)
+    elif args.command == "serve":
+        serve(args.store, args.bind, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# Cached layer of host tools: cmake, meson, ninja, nasm and xxd
+#
+# The tools are installed into the prefix which holds host tools (the
+# ".builder" prefix, which is on PATH), then their files are archived into a
+# cache directory under a key derived from the platform and the tool
+# versions. nasm is only part of the layer where the build uses it. Later builds
+# extract the archive instead of running pip, the system package manager and
+# the nasm build, and check the versions of the restored tools.
+#
+# The layer is relocatable: the Python tools are installed with pip --target
+# and reached through relative symlinks or wrappers which locate themselves.
+
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from buildcache import extract_tarball
+from pkg import host_python_tools, nasm_package
+
+# where pip installs the Python tools inside the prefix
+PYTHON_DIR = os.path.join("lib", "host-tools")
+
+# records the key of the layer installed in a prefix
+STAMP = os.path.join("var", "lib", "cibuildpkg", "host-tools.json")
+
+# records the files of nasm, which is built with staging
+NASM_MARKER = os.path.join("var", "lib", "cibuildpkg", "nasm")
+
+# binaries shipped in the cmake and ninja wheels
+NATIVE_TOOLS = {"cmake": ["cmake", "cpack", "ctest"], "ninja": ["ninja"]}
+
+MESON_WRAPPER = """\
+#!/usr/bin/env python3
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", {python_dir!r})
+)
+from mesonbuild.mesonmain import main
+
+sys.exit(main())
+"""
+
+
+def nasm_version() -> str:
+    match = re.search(r"nasm-([\d.]+)\.tar", nasm_package.source_url)
+    assert match, nasm_package.source_url
+    return match.group(1)
+
+
+def layer_key(*, with_xxd: bool, with_nasm: bool) -> str:
+    """
+    Returns the name of the layer for this platform and the pinned versions.
+    """
+    spec = {
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "libc": "-".join(platform.libc_ver()),
+        # musllinux images report no libc version
+        "auditwheel_plat": os.environ.get("AUDITWHEEL_PLAT", ""),
+        "macos": os.environ.get("MACOSX_DEPLOYMENT_TARGET", ""),
+        "python": f"{sys.version_info[0]}.{sys.version_info[1]}",
+        "tools": host_python_tools,
+        "nasm": nasm_package.sha256 if with_nasm else None,
+        "xxd": with_xxd,
+    }
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+    return f"host-tools-{platform.system().lower()}-{platform.machine()}-{digest[:16]}"
+
+
+def expected_versions(*, with_nasm: bool) -> dict[str, str]:
+    if not with_nasm:
+        return dict(host_python_tools)
+    return {**host_python_tools, "nasm": nasm_version()}
+
+
+def check_versions(prefix: str, *, with_nasm: bool) -> list[str]:
+    """
+    Returns the tools of the prefix which are missing or report another
+    version than the pinned one.
+    """
+    commands = {
+        "cmake": ["cmake", "--version"],
+        "meson": ["meson", "--version"],
+        "ninja": ["ninja", "--version"],
+        "nasm": ["nasm", "-v"],
+    }
+    mismatches = []
+    for tool, version in expected_versions(with_nasm=with_nasm).items():
+        command = [os.path.join(prefix, "bin", commands[tool][0]), *commands[tool][1:]]
+        try:
+            output = subprocess.run(
+                command, check=True, capture_output=True, text=True
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            mismatches.append(f"{tool}: not runnable")
+            continue
+        if not re.search(rf"(?<![\d.]){re.escape(version)}(?![\d.])", output):
+            mismatches.append(f"{tool}: expected {version}, got {output.strip()}")
+    return mismatches
+
+
+def install_python_tools(prefix: str) -> None:
+    """
+    Installs the pinned Python tools into the prefix, with relocatable
+    entry points in its bin directory.
+    """
+    python_dir = os.path.join(prefix, PYTHON_DIR)
+    bin_dir = os.path.join(prefix, "bin")
+    shutil.rmtree(python_dir, ignore_errors=True)
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "--no-compile",
+            "--target",
+            python_dir,
+            *(f"{name}=={version}" for name, version in host_python_tools.items()),
+        ],
+        check=True,
+    )
+
+    os.makedirs(bin_dir, exist_ok=True)
+    for package, names in NATIVE_TOOLS.items():
+        for name in names:
+            target = os.path.join(python_dir, package, "data", "bin", name)
+            if not os.path.exists(target):
+                raise RuntimeError(f"{package} wheel does not ship {name}")
+            link = os.path.join(bin_dir, name)
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(os.path.relpath(target, bin_dir), link)
+
+    # meson is pure Python: the wrapper is what it records to regenerate
+    # build files, so it must keep working from wherever it is run
+    meson = os.path.join(bin_dir, "meson")
+    with open(meson, "w") as fp:
+        fp.write(MESON_WRAPPER.format(python_dir=PYTHON_DIR))
+    os.chmod(meson, 0o755)
+
+
+def copy_system_tool(prefix: str, name: str) -> None:
+    """Copies a tool provided by the system into the prefix."""
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(f"{name} is not installed")
+    os.makedirs(os.path.join(prefix, "bin"), exist_ok=True)
+    shutil.copy2(path, os.path.join(prefix, "bin", name))
+
+
+def _read_stamp(prefix: str) -> str | None:
+    try:
+        with open(os.path.join(prefix, STAMP)) as fp:
+            return json.load(fp)["key"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_stamp(prefix: str, key: str, *, with_nasm: bool) -> None:
+    os.makedirs(os.path.dirname(os.path.join(prefix, STAMP)), exist_ok=True)
+    with open(os.path.join(prefix, STAMP), "w") as fp:
+        versions = expected_versions(with_nasm=with_nasm)
+        json.dump({"key": key, "versions": versions}, fp, indent=1)
+
+
+def layer_files(prefix: str, *, with_xxd: bool, with_nasm: bool) -> list[str]:
+    """
+    Returns the paths, relative to the prefix, which make up the layer, so
+    that anything else installed into the prefix stays out of it.
+    """
+    names = [*(name for names in NATIVE_TOOLS.values() for name in names), "meson"]
+    if with_xxd:
+        names.append("xxd")
+    files = [PYTHON_DIR, STAMP, *(os.path.join("bin", name) for name in names)]
+    if with_nasm:
+        with open(os.path.join(prefix, NASM_MARKER)) as fp:
+            nasm_files = fp.read().splitlines()[1:]
+        if not nasm_files:
+            raise RuntimeError("nasm was not built with staging, its files are unknown")
+        files += [NASM_MARKER, *nasm_files]
+    return files
+
+
+def restore(prefix: str, cache_dir: str, key: str, *, with_nasm: bool) -> bool:
+    """
+    Makes the layer available in the prefix, extracting it from the cache
+    unless it is already installed, and returns whether the restored tools
+    passed the version check.
+    """
+    archive = os.path.join(cache_dir, key + ".tar.gz")
+    if _read_stamp(prefix) != key:
+        if not os.path.exists(archive):
+            print(f"host tools: {key} is not cached")
+            return False
+        try:
+            with tarfile.open(archive) as tar:
+                extract_tarball(tar, prefix)
+        except tarfile.TarError as exc:
+            print(f"host tools: {key} is not usable: {exc}")
+            return False
+        print(f"host tools: restored {key}")
+
+    mismatches = check_versions(prefix, with_nasm=with_nasm)
+    if mismatches:
+        print("host tools: version check failed, reinstalling")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+        if os.path.exists(os.path.join(prefix, STAMP)):
+            os.unlink(os.path.join(prefix, STAMP))
+        return False
+    return True
+
+
+def save(prefix: str, cache_dir: str, key: str, *, with_xxd: bool, with_nasm: bool) -> None:
+    """
+    Archives the files of the layer into the cache after checking the
+    versions of the tools.
+    """
+    mismatches = check_versions(prefix, with_nasm=with_nasm)
+    if mismatches:
+        raise RuntimeError("host tools do not match their pins: " + "; ".join(mismatches))
+    _write_stamp(prefix, key, with_nasm=with_nasm)
+    files = layer_files(prefix, with_xxd=with_xxd, with_nasm=with_nasm)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp, tarfile.open(fileobj=fp, mode="w:gz") as tar:
+            for name in sorted(files):
+                tar.add(os.path.join(prefix, name), arcname=name)
+        os.replace(temp_path, os.path.join(cache_dir, key + ".tar.gz"))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    print(f"host tools: saved {key}")
@@ -0,0 +1,147 @@
+# Checks that two builds of the same artifact are bit-for-bit identical
+#
+# Both tarballs are streamed and hashed concurrently. Only the files whose
+# hashes differ are read a second time, to report which sections of a library
+# or which members of a static archive differ.
+
+import argparse
+import concurrent.futures
+import struct
+import sys
+import tarfile
+
+import binfmt
+from store import stream_sha256
+
+
+def hash_tarball(path: str) -> dict[str, str]:
+    hashes = {}
+    with tarfile.open(path, "r|gz") as tar:
+        for info in tar:
+            if info.issym() or info.islnk():
+                hashes[info.name] = f"link:{info.linkname}"
+            elif info.isfile():
+                fp = tar.extractfile(info)
+                assert fp is not None
+                hashes[info.name] = stream_sha256(fp)
+            else:
+                hashes[info.name] = f"type:{info.type.decode()}"
+    return hashes
+
+
+def read_files(path: str, names: set[str]) -> dict[str, bytes]:
+    contents = {}
+    with tarfile.open(path, "r|gz") as tar:
+        for info in tar:
+            if info.name in names and info.isfile():
+                fp = tar.extractfile(info)
+                assert fp is not None
+                contents[info.name] = fp.read()
+    return contents
+
+
+def _named_sections(data: bytes) -> dict[str, bytes]:
+    # section names are not unique in object files, e.g. .group
+    sections: dict[str, bytes] = {}
+    for name, contents in binfmt.sections(data):
+        key, count = name, 1
+        while key in sections:
+            count += 1
+            key = f"{name}#{count}"
+        sections[key] = contents
+    return sections
+
+
+def describe_difference(a: bytes, b: bytes) -> list[str]:
+    """Returns which parts of two versions of a file differ."""
+    kind = binfmt.identify(a)
+    if kind is not None and kind == binfmt.identify(b):
+        try:
+            sections_a, sections_b = _named_sections(a), _named_sections(b)
+        except (IndexError, ValueError, struct.error):
+            pass
+        else:
+            differences = []
+            for name in sections_a.keys() | sections_b.keys():
+                if name not in sections_b:
+                    differences.append(f"{name}: only in first")
+                elif name not in sections_a:
+                    differences.append(f"{name}: only in second")
+                elif sections_a[name] != sections_b[name]:
+                    if kind == "ar":
+                        differences.extend(
+                            f"{name}: {d}"
+                            for d in describe_difference(sections_a[name], sections_b[name])
+                        )
+                    else:
+                        differences.append(
+                            f"{name}: differs ({len(sections_a[name])} -> "
+                            f"{len(sections_b[name])} bytes)"
+                        )
+            if differences:
+                return sorted(differences)
+
+    if len(a) != len(b):
+        return [f"size differs ({len(a)} -> {len(b)} bytes)"]
+    offset = next(i for i, (x, y) in enumerate(zip(a, b)) if x != y)
+    return [f"contents differ from offset {offset:#x}"]
+
+
+def main():
+    parser = argparse.ArgumentParser("verify-reproducible")
+    parser.add_argument("first", help="first build of the tarball")
+    parser.add_argument("second", help="second build of the tarball")
+    args = parser.parse_args()
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        hashes_a, hashes_b = executor.map(hash_tarball, [args.first, args.second])
+
+        only_a = sorted(hashes_a.keys() - hashes_b.keys())
+        only_b = sorted(hashes_b.keys() - hashes_a.keys())
+        changed = sorted(
+            name
+            for name in hashes_a.keys() & hashes_b.keys()
+            if hashes_a[name] != hashes_b[name]
+        )
+
+        # links and directories are described by their hash entry alone
+        regular = {
+            name
+            for name in changed
+            if ":" not in hashes_a[name] and ":" not in hashes_b[name]
+        }
+        contents_a, contents_b = (
+            executor.map(read_files, [args.first, args.second], [regular, regular])
+            if regular
+            else ({}, {})
+        )
+        descriptions = dict(
+            zip(
+                sorted(regular),
+                executor.map(
+                    describe_difference,
+                    [contents_a[name] for name in sorted(regular)],
+                    [contents_b[name] for name in sorted(regular)],
+                ),
+            )
+        )
+
+    for name in only_a:
+        print(f"{name}: only in {args.first}")
+    for name in only_b:
+        print(f"{name}: only in {args.second}")
+    for name in changed:
+        if name in descriptions:
+            print(f"{name}:")
+            for description in descriptions[name]:
+                print(f"  {description}")
+        else:
+            print(f"{name}: {hashes_a[name]} -> {hashes_b[name]}")
+
+    if only_a or only_b or changed:
+        sys.exit(1)
+    print(f"{len(hashes_a)} entries identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,97 @@
+import glob
+import os
+import re
+import shutil
 import setuptools
 import sys
+from setuptools.command.build_ext import build_ext
 
 if sys.platform == "win32":
-    include_dirs = ["C:\\cibw\\vendor\\include"]
-    library_dirs = ["C:\\cibw\\vendor\\lib"]
+    vendor_dir = os.environ.get("FFMPEG_VENDOR_DIR", "C:\\cibw\\vendor")
     extra_link_args = []
 else:
-    include_dirs = ["/tmp/vendor/include"]
-    library_dirs = ["/tmp/vendor/lib"]
+    vendor_dir = os.environ.get("FFMPEG_VENDOR_DIR", "/tmp/vendor")
     extra_link_args = ["-headerpad_max_install_names"] if sys.platform == "darwin" else []
+include_dirs = [os.path.join(vendor_dir, "include")]
+library_dirs = [os.path.join(vendor_dir, "lib")]
+
+ffmpeg_libraries = [
+    "avformat",
+    "avcodec",
+    "avdevice",
+    "avutil",
+    "avfilter",
+    "swscale",
+    "swresample",
+]
+
+ext_modules = [
+    setuptools.Extension(
+        "dummy.binding",
+        include_dirs=include_dirs,
+        library_dirs=library_dirs,
+        extra_link_args=extra_link_args,
+        libraries=ffmpeg_libraries,
+        sources=["src/dummy/binding.c"],
+    ),
+]
+
+# FFmpeg built with --lazy-libs does not link the libraries it loads lazily:
+# link them into an extension which is never imported, so that auditwheel
+# bundles them. --no-as-needed keeps them although nothing is called.
+lazy_libraries_txt = os.path.join(vendor_dir, "lib", "lazy-libraries.txt")
+if os.path.exists(lazy_libraries_txt):
+    with open(lazy_libraries_txt) as fp:
+        lazy_libraries = fp.read().split()
+    ext_modules.append(
+        setuptools.Extension(
+            "dummy._lazy",
+            library_dirs=library_dirs,
+            extra_link_args=["-Wl,--no-as-needed"] + [f"-l{name}" for name in lazy_libraries],
+            sources=["src/dummy/_lazy.c"],
+        )
+    )
+
+# tiers built with `build-ffmpeg.py --march-tier` into <vendor>-<tier>: each
+# gets a copy of the binding in dummy/tiers/<tier>, next to its libraries,
+# see src/dummy/_tiers.py
+tier_vendor_dirs = {}
+tiers = os.environ.get("FFMPEG_TIERS", "")
+if tiers:
+    if sys.platform != "linux":
+        raise SystemExit("FFMPEG_TIERS is only supported on Linux")
+    for tier in tiers.split(","):
+        tier_vendor_dir = f"{vendor_dir}-{tier}"
+        name = "dummy.tiers." + re.sub(r"\W", "_", tier) + ".binding"
+        tier_vendor_dirs[name] = tier_vendor_dir
+        ext_modules.append(
+            setuptools.Extension(
+                name,
+                include_dirs=[os.path.join(tier_vendor_dir, "include")],
+                library_dirs=[os.path.join(tier_vendor_dir, "lib")],
+                runtime_library_dirs=["$ORIGIN"],
+                libraries=ffmpeg_libraries,
+                sources=["src/dummy/binding.c"],
+            )
+        )
+
+
+class BuildExt(build_ext):
+    def run(self):
+        super().run()
+        # the libraries of each tier are shipped next to its binding, under
+        # their SONAME since wheels cannot hold symlinks
+        for name, tier_vendor_dir in tier_vendor_dirs.items():
+            dest_dir = os.path.dirname(self.get_ext_fullpath(name))
+            for path in glob.glob(os.path.join(tier_vendor_dir, "lib", "*.so.*")):
+                if re.search(r"\.so\.\d+$", path):
+                    shutil.copy(path, dest_dir)
+
 
 setuptools.setup(
     name="dummy",
     package_dir={"": "src"},
     packages=["dummy"],
-    ext_modules=[
-        setuptools.Extension(
-            "dummy.binding",
-            include_dirs=include_dirs,
-            library_dirs=library_dirs,
-            extra_link_args=extra_link_args,
-            libraries=[
-                "avformat",
-                "avcodec",
-                "avdevice",
-                "avutil",
-                "avfilter",
-                "swscale",
-                "swresample",
-            ],
-            sources=["src/dummy/binding.c"],
-        ),
-    ],
+    ext_modules=ext_modules,
+    cmdclass={"build_ext": BuildExt},
 )
@@ -1,3 +1,7 @@
-from .binding import test
+from ._tiers import load_tier
+
+tier = load_tier()
+
+from .binding import test  # noqa: E402
 
 test()
@@ -0,0 +1,23 @@
+#include <Python.h>
+
+/*
+ * Never imported: this module is linked against the libraries FFmpeg loads
+ * lazily, so that their DT_NEEDED entries make wheel repair tools bundle them
+ * next to the FFmpeg libraries, where the stubs find them.
+ */
+
+#define MODULE_NAME "dummy._lazy"
+
+static struct PyModuleDef moduledef = {
+    PyModuleDef_HEAD_INIT,
+    MODULE_NAME,                        /* m_name */
+    NULL,                               /* m_doc */
+    -1,                                 /* m_size */
+    NULL,                               /* m_methods */
+};
+
+PyMODINIT_FUNC
+PyInit__lazy(void)
+{
+    return PyModule_Create(&moduledef);
+}
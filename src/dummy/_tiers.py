@@ -0,0 +1,113 @@
+# Selects the FFmpeg build tuned for the running CPU.
+#
+# Builds made with `build-ffmpeg.py --march-tier` can be shipped in the wheel
+# next to the baseline: setup.py builds a copy of the binding for each tier of
+# FFMPEG_TIERS into dummy/tiers/<tier>, along with the tier's libraries. Its
+# runpath is $ORIGIN, so the dynamic loader itself resolves the libraries of
+# the tier, even after auditwheel renamed them, and the baseline libraries
+# are never loaded. The binding of the best tier the CPU supports is imported
+# as dummy.binding. Tiers are only shipped on Linux: elsewhere, without any
+# tier directory, or when the CPU supports none of them, the baseline is used.
+
+import importlib.machinery
+import importlib.util
+import os
+import platform
+import re
+import sys
+
+# ordered from the least to the most demanding tier
+TIERS = {
+    "x86_64": [
+        ("x86-64-v2", {"cx16", "lahf_lm", "popcnt", "sse4_1", "sse4_2", "ssse3"}),
+        ("x86-64-v3", {"abm", "avx", "avx2", "bmi1", "bmi2", "f16c", "fma", "movbe", "xsave"}),
+        ("x86-64-v4", {"avx512f", "avx512bw", "avx512cd", "avx512dq", "avx512vl"}),
+    ],
+    "aarch64": [
+        ("armv8.2-a", {"atomics", "asimdrdm", "crc32"}),
+    ],
+}
+
+TIERS_DIR = os.path.join(os.path.dirname(__file__), "tiers")
+
+
+def _machine() -> str:
+    machine = platform.machine().lower()
+    return {"amd64": "x86_64", "arm64": "aarch64"}.get(machine, machine)
+
+
+def _cpu_features() -> set[str]:
+    with open("/proc/cpuinfo") as fp:
+        for line in fp:
+            key, _, value = line.partition(":")
+            if key.strip() in {"flags", "Features"}:
+                return set(value.split())
+    return set()
+
+
+def tier_dir(tier: str) -> str:
+    """Returns the directory of a tier, named so that it is a valid module path."""
+    return os.path.join(TIERS_DIR, re.sub(r"\W", "_", tier))
+
+
+def shipped_tiers() -> list[str]:
+    """Returns the tiers shipped for the running machine, best last."""
+    if platform.system() != "Linux":
+        return []
+    return [
+        tier
+        for tier, required in TIERS.get(_machine(), [])
+        if os.path.isdir(tier_dir(tier))
+    ]
+
+
+def supported_tiers() -> list[str]:
+    """Returns the tiers the running CPU supports, best last."""
+    if platform.system() != "Linux":
+        return []
+    features = _cpu_features()
+    tiers = []
+    for tier, required in TIERS.get(_machine(), []):
+        # each tier implies the previous ones
+        if not required <= features:
+            break
+        tiers.append(tier)
+    return tiers
+
+
+def select_tier() -> str | None:
+    """Returns the best shipped tier for the running CPU, if any."""
+    shipped = shipped_tiers()
+    forced = os.environ.get("DUMMY_FFMPEG_TIER")
+    if forced is not None:
+        if forced and forced not in shipped:
+            raise ImportError(
+                f"DUMMY_FFMPEG_TIER={forced} is not shipped, "
+                f"available: {', '.join(shipped) or 'none'}"
+            )
+        return forced or None
+    for tier in reversed(supported_tiers()):
+        if tier in shipped:
+            return tier
+    return None
+
+
+def load_tier() -> str | None:
+    """Imports the binding of the selected tier as dummy.binding, returning the tier."""
+    tier = select_tier()
+    if tier is None:
+        return None
+
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        path = os.path.join(tier_dir(tier), "binding" + suffix)
+        if os.path.exists(path):
+            break
+    else:
+        raise ImportError(f"no binding for tier {tier} in {tier_dir(tier)}")
+    loader = importlib.machinery.ExtensionFileLoader("dummy.binding", path)
+    spec = importlib.util.spec_from_file_location("dummy.binding", path, loader=loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    sys.modules["dummy.binding"] = module
+    sys.modules["dummy"].binding = module
+    return tier
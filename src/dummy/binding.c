@@ -3,6 +3,16 @@
 #include "libavcodec/avcodec.h"
 #include "libavdevice/avdevice.h"
 #include "libavformat/avformat.h"
+#include "libavutil/dict.h"
+#include "libavutil/pixdesc.h"
+#include "libavutil/time.h"
+#include "libswscale/swscale.h"
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
 
 #define MODULE_NAME "dummy.binding"
 
@@ -18,8 +28,367 @@ test(PyObject *args)
     Py_RETURN_NONE;
 }
 
+typedef struct {
+    int64_t encode_time;
+    int64_t decode_time;
+    int64_t encode_cpu_time;
+    int64_t decode_cpu_time;
+    int64_t bytes;
+    int frames;
+    const char *error;
+} BenchmarkResult;
+
+// CPU time used by all threads of the process, in microseconds
+static int64_t
+process_cpu_time(void)
+{
+#ifdef _WIN32
+    FILETIME creation, exit, kernel, user;
+    if (!GetProcessTimes(GetCurrentProcess(), &creation, &exit, &kernel, &user))
+        return 0;
+    return ((((int64_t)kernel.dwHighDateTime << 32) | kernel.dwLowDateTime) +
+            (((int64_t)user.dwHighDateTime << 32) | user.dwLowDateTime)) / 10;
+#else
+    struct timespec ts;
+    if (clock_gettime(CLOCK_PROCESS_CPUTIME_ID, &ts) < 0)
+        return 0;
+    return ts.tv_sec * INT64_C(1000000) + ts.tv_nsec / 1000;
+#endif
+}
+
+static void
+fill_frame(AVFrame *frame, int index)
+{
+    // moving gradient, cheap to generate but not trivially compressible
+    const AVPixFmtDescriptor *desc = av_pix_fmt_desc_get(frame->format);
+    int depth = desc->comp[0].depth;
+    int mask = (1 << depth) - 1;
+
+    for (int p = 0; p < desc->nb_components; p++) {
+        int w = frame->width, h = frame->height;
+        if (p == 1 || p == 2) {
+            w = AV_CEIL_RSHIFT(w, desc->log2_chroma_w);
+            h = AV_CEIL_RSHIFT(h, desc->log2_chroma_h);
+        }
+        for (int y = 0; y < h; y++) {
+            uint8_t *row = frame->data[p] + y * frame->linesize[p];
+            for (int x = 0; x < w; x++) {
+                int value = (x * (p + 1) + y * 2 + index * 3) & mask;
+                if (depth > 8)
+                    ((uint16_t *)row)[x] = value;
+                else
+                    row[x] = value;
+            }
+        }
+    }
+}
+
+static enum AVPixelFormat
+pick_pix_fmt(const AVCodecContext *ctx, const AVCodec *codec)
+{
+    const enum AVPixelFormat *formats = NULL;
+    int count = 0;
+
+    if (avcodec_get_supported_config(ctx, codec, AV_CODEC_CONFIG_PIX_FORMAT, 0,
+                                     (const void **)&formats, &count) < 0 || !formats)
+        return AV_PIX_FMT_YUV420P;
+    for (int i = 0; i < count; i++) {
+        if (formats[i] == AV_PIX_FMT_YUV420P)
+            return AV_PIX_FMT_YUV420P;
+    }
+    return formats[0];
+}
+
+static int
+run_benchmark(const AVCodec *encoder, const AVCodec *decoder, enum AVPixelFormat pix_fmt,
+              int width, int height, int frames, int threads, int64_t min_decode_time,
+              AVDictionary **options, BenchmarkResult *result)
+{
+    AVCodecContext *enc = NULL, *dec = NULL;
+    const AVPixFmtDescriptor *desc;
+    AVFrame *frame = NULL;
+    AVPacket **packets = NULL;
+    int nb_packets = 0, ret = 0;
+    int64_t start, start_cpu;
+
+    enc = avcodec_alloc_context3(encoder);
+    dec = avcodec_alloc_context3(decoder);
+    frame = av_frame_alloc();
+    packets = av_calloc(frames + 64, sizeof(*packets));
+    if (!enc || !dec || !frame || !packets) {
+        ret = AVERROR(ENOMEM);
+        goto end;
+    }
+
+    enc->width = width;
+    enc->height = height;
+    enc->time_base = (AVRational){1, 25};
+    enc->framerate = (AVRational){25, 1};
+    enc->pix_fmt = pix_fmt != AV_PIX_FMT_NONE ? pix_fmt : pick_pix_fmt(enc, encoder);
+    enc->thread_count = threads;
+
+    desc = av_pix_fmt_desc_get(enc->pix_fmt);
+    if (!(desc->flags & AV_PIX_FMT_FLAG_PLANAR) || (desc->flags & AV_PIX_FMT_FLAG_RGB)) {
+        result->error = "only planar YUV pixel formats are supported";
+        ret = AVERROR(EINVAL);
+        goto end;
+    }
+
+    if ((ret = avcodec_open2(enc, encoder, options)) < 0)
+        goto end;
+    if (av_dict_count(*options)) {
+        result->error = "unknown encoder option";
+        ret = AVERROR_OPTION_NOT_FOUND;
+        goto end;
+    }
+
+    frame->format = enc->pix_fmt;
+    frame->width = width;
+    frame->height = height;
+    if ((ret = av_frame_get_buffer(frame, 0)) < 0)
+        goto end;
+
+    start = av_gettime_relative();
+    start_cpu = process_cpu_time();
+    for (int i = 0; i <= frames; i++) {
+        if (i < frames) {
+            if ((ret = av_frame_make_writable(frame)) < 0)
+                goto end;
+            fill_frame(frame, i);
+            frame->pts = i;
+        }
+        if ((ret = avcodec_send_frame(enc, i < frames ? frame : NULL)) < 0)
+            goto end;
+        while (1) {
+            AVPacket *pkt = av_packet_alloc();
+            if (!pkt) {
+                ret = AVERROR(ENOMEM);
+                goto end;
+            }
+            ret = avcodec_receive_packet(enc, pkt);
+            if (ret < 0) {
+                av_packet_free(&pkt);
+                break;
+            }
+            if (nb_packets >= frames + 64) {
+                av_packet_free(&pkt);
+                result->error = "encoder produced more packets than frames";
+                ret = AVERROR_BUG;
+                goto end;
+            }
+            result->bytes += pkt->size;
+            packets[nb_packets++] = pkt;
+        }
+        if (ret != AVERROR(EAGAIN) && ret != AVERROR_EOF)
+            goto end;
+    }
+    result->encode_time = av_gettime_relative() - start;
+    result->encode_cpu_time = process_cpu_time() - start_cpu;
+
+    if (enc->extradata_size) {
+        dec->extradata = av_mallocz(enc->extradata_size + AV_INPUT_BUFFER_PADDING_SIZE);
+        if (!dec->extradata) {
+            ret = AVERROR(ENOMEM);
+            goto end;
+        }
+        memcpy(dec->extradata, enc->extradata, enc->extradata_size);
+        dec->extradata_size = enc->extradata_size;
+    }
+    dec->thread_count = threads;
+    if ((ret = avcodec_open2(dec, decoder, NULL)) < 0)
+        goto end;
+
+    // the stream is decoded again until min_decode_time has passed, so that
+    // short decodes last long enough for their CPU time to be measured
+    start = av_gettime_relative();
+    start_cpu = process_cpu_time();
+    do {
+        for (int i = 0; i <= nb_packets; i++) {
+            if ((ret = avcodec_send_packet(dec, i < nb_packets ? packets[i] : NULL)) < 0)
+                goto end;
+            while ((ret = avcodec_receive_frame(dec, frame)) >= 0) {
+                result->frames++;
+                av_frame_unref(frame);
+            }
+            if (ret != AVERROR(EAGAIN) && ret != AVERROR_EOF)
+                goto end;
+        }
+        avcodec_flush_buffers(dec);
+    } while (av_gettime_relative() - start < min_decode_time);
+    result->decode_time = av_gettime_relative() - start;
+    result->decode_cpu_time = process_cpu_time() - start_cpu;
+    ret = 0;
+
+end:
+    for (int i = 0; i < nb_packets; i++)
+        av_packet_free(&packets[i]);
+    av_free(packets);
+    av_frame_free(&frame);
+    avcodec_free_context(&enc);
+    avcodec_free_context(&dec);
+    return ret;
+}
+
+static PyObject*
+benchmark(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"encoder", "decoder", "pix_fmt", "width", "height",
+                             "frames", "threads", "min_decode_seconds", "options",
+                             NULL};
+    const char *encoder_name, *decoder_name = NULL, *pix_fmt_name = NULL;
+    int width = 640, height = 360, frames = 50, threads = 1;
+    double min_decode_seconds = 0;
+    PyObject *options = NULL, *key, *value;
+    Py_ssize_t pos = 0;
+    AVDictionary *encoder_options = NULL;
+    const AVCodec *encoder, *decoder;
+    enum AVPixelFormat pix_fmt = AV_PIX_FMT_NONE;
+    BenchmarkResult result = {0};
+    char errbuf[AV_ERROR_MAX_STRING_SIZE];
+    int ret;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s|zziiiidO", kwlist,
+                                     &encoder_name, &decoder_name, &pix_fmt_name,
+                                     &width, &height, &frames, &threads,
+                                     &min_decode_seconds, &options))
+        return NULL;
+
+    encoder = avcodec_find_encoder_by_name(encoder_name);
+    if (!encoder || encoder->type != AVMEDIA_TYPE_VIDEO)
+        return PyErr_Format(PyExc_ValueError, "unknown video encoder: %s", encoder_name);
+    decoder = decoder_name ? avcodec_find_decoder_by_name(decoder_name)
+                           : avcodec_find_decoder(encoder->id);
+    if (!decoder)
+        return PyErr_Format(PyExc_ValueError, "no decoder for encoder: %s", encoder_name);
+    if (pix_fmt_name) {
+        pix_fmt = av_get_pix_fmt(pix_fmt_name);
+        if (pix_fmt == AV_PIX_FMT_NONE)
+            return PyErr_Format(PyExc_ValueError, "unknown pixel format: %s", pix_fmt_name);
+    }
+    // private options of the encoder, e.g. x264-params
+    if (options == Py_None)
+        options = NULL;
+    if (options && !PyDict_Check(options))
+        return PyErr_Format(PyExc_TypeError, "options must be a dict or None");
+    while (options && PyDict_Next(options, &pos, &key, &value)) {
+        const char *name = PyUnicode_AsUTF8(key), *setting = PyUnicode_AsUTF8(value);
+        if (!name || !setting) {
+            av_dict_free(&encoder_options);
+            return NULL;
+        }
+        av_dict_set(&encoder_options, name, setting, 0);
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = run_benchmark(encoder, decoder, pix_fmt, width, height, frames, threads,
+                        min_decode_seconds * 1e6, &encoder_options, &result);
+    Py_END_ALLOW_THREADS
+    av_dict_free(&encoder_options);
+
+    if (ret < 0) {
+        if (!result.error)
+            result.error = av_make_error_string(errbuf, sizeof(errbuf), ret);
+        return PyErr_Format(PyExc_RuntimeError, "%s: %s", encoder_name, result.error);
+    }
+
+    return Py_BuildValue("{s:s,s:d,s:d,s:d,s:d,s:L,s:i}",
+                         "decoder", decoder->name,
+                         "encode_seconds", result.encode_time / 1e6,
+                         "decode_seconds", result.decode_time / 1e6,
+                         "encode_cpu_seconds", result.encode_cpu_time / 1e6,
+                         "decode_cpu_seconds", result.decode_cpu_time / 1e6,
+                         "bytes", (long long)result.bytes,
+                         "frames", result.frames);
+}
+
+static int
+run_scale(enum AVPixelFormat src_fmt, int src_width, int src_height,
+          enum AVPixelFormat dst_fmt, int dst_width, int dst_height,
+          int frames, int64_t *elapsed)
+{
+    struct SwsContext *sws = NULL;
+    AVFrame *src = NULL, *dst = NULL;
+    int64_t start;
+    int ret = 0;
+
+    sws = sws_getContext(src_width, src_height, src_fmt, dst_width, dst_height, dst_fmt,
+                         SWS_BICUBIC, NULL, NULL, NULL);
+    src = av_frame_alloc();
+    dst = av_frame_alloc();
+    if (!sws || !src || !dst) {
+        ret = sws ? AVERROR(ENOMEM) : AVERROR(EINVAL);
+        goto end;
+    }
+
+    src->format = src_fmt;
+    src->width = src_width;
+    src->height = src_height;
+    dst->format = dst_fmt;
+    dst->width = dst_width;
+    dst->height = dst_height;
+    if ((ret = av_frame_get_buffer(src, 0)) < 0 || (ret = av_frame_get_buffer(dst, 0)) < 0)
+        goto end;
+
+    start = av_gettime_relative();
+    for (int i = 0; i < frames; i++) {
+        fill_frame(src, i);
+        if ((ret = sws_scale_frame(sws, dst, src)) < 0)
+            goto end;
+    }
+    *elapsed = av_gettime_relative() - start;
+    ret = 0;
+
+end:
+    av_frame_free(&src);
+    av_frame_free(&dst);
+    sws_freeContext(sws);
+    return ret;
+}
+
+static PyObject*
+scale(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"pix_fmt", "width", "height", "dst_pix_fmt", "dst_width",
+                             "dst_height", "frames", NULL};
+    const char *src_name = "yuv420p", *dst_name = "yuv420p";
+    int src_width = 1280, src_height = 720, dst_width = 640, dst_height = 360, frames = 50;
+    enum AVPixelFormat src_fmt, dst_fmt;
+    const AVPixFmtDescriptor *desc;
+    char errbuf[AV_ERROR_MAX_STRING_SIZE];
+    int64_t elapsed = 0;
+    int ret;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|siisiii", kwlist,
+                                     &src_name, &src_width, &src_height,
+                                     &dst_name, &dst_width, &dst_height, &frames))
+        return NULL;
+
+    src_fmt = av_get_pix_fmt(src_name);
+    dst_fmt = av_get_pix_fmt(dst_name);
+    if (src_fmt == AV_PIX_FMT_NONE || dst_fmt == AV_PIX_FMT_NONE)
+        return PyErr_Format(PyExc_ValueError, "unknown pixel format");
+    desc = av_pix_fmt_desc_get(src_fmt);
+    if (!(desc->flags & AV_PIX_FMT_FLAG_PLANAR) || (desc->flags & AV_PIX_FMT_FLAG_RGB))
+        return PyErr_Format(PyExc_ValueError, "only planar YUV source formats are supported");
+
+    Py_BEGIN_ALLOW_THREADS
+    ret = run_scale(src_fmt, src_width, src_height, dst_fmt, dst_width, dst_height,
+                    frames, &elapsed);
+    Py_END_ALLOW_THREADS
+
+    if (ret < 0)
+        return PyErr_Format(PyExc_RuntimeError, "scale: %s",
+                            av_make_error_string(errbuf, sizeof(errbuf), ret));
+
+    return Py_BuildValue("{s:d}", "seconds", elapsed / 1e6);
+}
+
 static PyMethodDef module_methods[] = {
     {"test", (PyCFunction)test, METH_NOARGS, ""},
+    {"benchmark", (PyCFunction)(void(*)(void))benchmark, METH_VARARGS | METH_KEYWORDS,
+     "Encode and decode synthetic video, returning the wall and CPU time spent in each."},
+    {"scale", (PyCFunction)(void(*)(void))scale, METH_VARARGS | METH_KEYWORDS,
+     "Convert synthetic video with swscale, returning the time spent."},
     {NULL}
 };
 